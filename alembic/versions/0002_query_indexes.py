@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0002_query_indexes"
+down_revision = "0001_init"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        # list_by_user: user_id (+ optional company/status) ORDER BY id DESC
+        op.create_index(
+            "ix_cart_user_id_id",
+            "cart",
+            ["user_id", sa.text("id DESC")],
+            postgresql_where=sa.text("user_id IS NOT NULL"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_cart_user_company_status_id",
+            "cart",
+            ["user_id", "company_id", "status", sa.text("id DESC")],
+            postgresql_where=sa.text("user_id IS NOT NULL"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_cart_item_product_id",
+            "cart_item",
+            ["product_id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        # Leading column of uq_cart_item_cart_product already covers cart_id lookups
+        op.drop_index(
+            "ix_cart_item_cart_id",
+            table_name="cart_item",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_cart_item_cart_id",
+            "cart_item",
+            ["cart_id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.drop_index("ix_cart_item_product_id", table_name="cart_item", postgresql_concurrently=True, if_exists=True)
+        op.drop_index("ix_cart_user_company_status_id", table_name="cart", postgresql_concurrently=True, if_exists=True)
+        op.drop_index("ix_cart_user_id_id", table_name="cart", postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0003_cart_totals"
+down_revision = "0002_query_indexes"
+branch_labels = None
+depends_on = None
+
+
+# Keeps cart.item_count / total_quantity / total_amount in sync with cart_item.
+# Runs in the writer's transaction, so the totals are never observably stale.
+CART_ITEM_TOTALS_FN = """
+CREATE OR REPLACE FUNCTION cart_item_totals() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.cart_id = NEW.cart_id THEN
+        IF OLD.quantity = NEW.quantity AND OLD.price = NEW.price THEN
+            RETURN NULL;
+        END IF;
+        UPDATE cart
+        SET total_quantity = total_quantity + NEW.quantity - OLD.quantity,
+            total_amount = total_amount + NEW.price * NEW.quantity - OLD.price * OLD.quantity
+        WHERE id = NEW.cart_id;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE cart
+        SET item_count = item_count - 1,
+            total_quantity = total_quantity - OLD.quantity,
+            total_amount = total_amount - OLD.price * OLD.quantity
+        WHERE id = OLD.cart_id;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        UPDATE cart
+        SET item_count = item_count + 1,
+            total_quantity = total_quantity + NEW.quantity,
+            total_amount = total_amount + NEW.price * NEW.quantity
+        WHERE id = NEW.cart_id;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def upgrade() -> None:
+    op.add_column("cart", sa.Column("item_count", sa.Integer(), nullable=False, server_default=sa.text("0")))
+    op.add_column("cart", sa.Column("total_quantity", sa.BigInteger(), nullable=False, server_default=sa.text("0")))
+    op.add_column("cart", sa.Column("total_amount", sa.Numeric(20, 2), nullable=False, server_default=sa.text("0")))
+
+    op.execute(CART_ITEM_TOTALS_FN)
+    # Creating the trigger locks cart_item against writes until this
+    # migration commits, so the backfill below cannot miss a change.
+    op.execute(
+        """
+        CREATE TRIGGER trg_cart_item_totals
+        AFTER INSERT OR DELETE OR UPDATE OF cart_id, price, quantity ON cart_item
+        FOR EACH ROW EXECUTE FUNCTION cart_item_totals()
+        """
+    )
+    op.execute(
+        """
+        UPDATE cart c
+        SET item_count = s.item_count,
+            total_quantity = s.total_quantity,
+            total_amount = s.total_amount
+        FROM (
+            SELECT cart_id,
+                   count(*) AS item_count,
+                   sum(quantity) AS total_quantity,
+                   sum(price * quantity) AS total_amount
+            FROM cart_item
+            GROUP BY cart_id
+        ) s
+        WHERE c.id = s.cart_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS trg_cart_item_totals ON cart_item")
+    op.execute("DROP FUNCTION IF EXISTS cart_item_totals()")
+    op.drop_column("cart", "total_amount")
+    op.drop_column("cart", "total_quantity")
+    op.drop_column("cart", "item_count")
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "0004_cart_reaper"
+down_revision = "0003_cart_totals"
+branch_labels = None
+depends_on = None
+
+
+CART_TOUCH_FN = """
+CREATE OR REPLACE FUNCTION cart_touch() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at = now();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def upgrade() -> None:
+    # now() is stable, so existing rows get the migration time without a table rewrite
+    op.add_column(
+        "cart",
+        sa.Column("updated_at", sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.text("now()")),
+    )
+    op.execute(CART_TOUCH_FN)
+    # Item writes update the cart totals, so this also tracks item activity
+    op.execute("CREATE TRIGGER trg_cart_touch BEFORE UPDATE ON cart FOR EACH ROW EXECUTE FUNCTION cart_touch()")
+
+    op.create_table(
+        "cart_archive",
+        sa.Column("id", sa.BigInteger(), primary_key=True),
+        sa.Column("user_id", sa.BigInteger(), nullable=True),
+        sa.Column("company_id", sa.BigInteger(), nullable=False),
+        sa.Column("cookie", sa.String(length=255), nullable=True),
+        sa.Column("status", sa.SmallInteger(), nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column("updated_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column("items", postgresql.JSONB(), nullable=False),
+        sa.Column("reason", sa.String(length=32), nullable=False),
+        sa.Column("archived_at", sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.text("now()")),
+    )
+
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_cart_empty_created_id",
+            "cart",
+            ["created_at", "id"],
+            postgresql_where=sa.text("item_count = 0"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_cart_anon_active_updated_id",
+            "cart",
+            ["updated_at", "id"],
+            postgresql_where=sa.text("status = 1 AND user_id IS NULL"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_cart_anon_active_updated_id", table_name="cart", postgresql_concurrently=True, if_exists=True)
+        op.drop_index("ix_cart_empty_created_id", table_name="cart", postgresql_concurrently=True, if_exists=True)
+    op.drop_table("cart_archive")
+    op.execute("DROP TRIGGER IF EXISTS trg_cart_touch ON cart")
+    op.execute("DROP FUNCTION IF EXISTS cart_touch()")
+    op.drop_column("cart", "updated_at")
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0005_cart_archive_partitions"
+down_revision = "0004_cart_reaper"
+branch_labels = None
+depends_on = None
+
+
+ARCHIVE_COLUMNS = "id, user_id, company_id, cookie, status, created_at, updated_at, items, reason, archived_at"
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE cart_archive RENAME TO cart_archive_old")
+    op.execute("ALTER INDEX cart_archive_pkey RENAME TO cart_archive_old_pkey")
+
+    # Cold storage for closed carts: one partition per archived status, so
+    # status-filtered reads touch a single partition
+    op.execute(
+        """
+        CREATE TABLE cart_archive (
+            id BIGINT NOT NULL,
+            user_id BIGINT,
+            company_id BIGINT NOT NULL,
+            cookie VARCHAR(255),
+            status SMALLINT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL,
+            item_count INTEGER NOT NULL,
+            total_amount NUMERIC(20, 2) NOT NULL,
+            items JSONB NOT NULL,
+            reason VARCHAR(32) NOT NULL,
+            archived_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, status)
+        ) PARTITION BY LIST (status)
+        """
+    )
+    op.execute("CREATE TABLE cart_archive_checked_out PARTITION OF cart_archive FOR VALUES IN (3)")
+    op.execute("CREATE TABLE cart_archive_cancelled PARTITION OF cart_archive FOR VALUES IN (4)")
+    op.execute("CREATE TABLE cart_archive_other PARTITION OF cart_archive DEFAULT")
+    # Partitioned indexes: created on the parent, cascaded to every partition
+    op.create_index(
+        "ix_cart_archive_user_id_id",
+        "cart_archive",
+        ["user_id", sa.text("id DESC")],
+        postgresql_where=sa.text("user_id IS NOT NULL"),
+    )
+    op.create_index(
+        "ix_cart_archive_user_company_status_id",
+        "cart_archive",
+        ["user_id", "company_id", "status", sa.text("id DESC")],
+        postgresql_where=sa.text("user_id IS NOT NULL"),
+    )
+
+    op.execute(
+        f"""
+        INSERT INTO cart_archive ({ARCHIVE_COLUMNS}, item_count, total_amount)
+        SELECT {ARCHIVE_COLUMNS},
+               jsonb_array_length(items),
+               (SELECT coalesce(sum((i ->> 'price')::numeric * (i ->> 'quantity')::int), 0)
+                FROM jsonb_array_elements(items) AS i)
+        FROM cart_archive_old
+        """
+    )
+    op.execute("DROP TABLE cart_archive_old")
+
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_cart_closed_updated_id",
+            "cart",
+            ["updated_at", "id"],
+            postgresql_where=sa.text("status IN (3, 4)"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_cart_closed_updated_id", table_name="cart", postgresql_concurrently=True, if_exists=True)
+
+    op.execute("ALTER TABLE cart_archive RENAME TO cart_archive_new")
+    op.execute("ALTER INDEX cart_archive_pkey RENAME TO cart_archive_new_pkey")
+    op.execute(
+        """
+        CREATE TABLE cart_archive (
+            id BIGINT PRIMARY KEY,
+            user_id BIGINT,
+            company_id BIGINT NOT NULL,
+            cookie VARCHAR(255),
+            status SMALLINT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL,
+            items JSONB NOT NULL,
+            reason VARCHAR(32) NOT NULL,
+            archived_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
+    op.execute(f"INSERT INTO cart_archive ({ARCHIVE_COLUMNS}) SELECT {ARCHIVE_COLUMNS} FROM cart_archive_new")
+    op.execute("DROP TABLE cart_archive_new")
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0006_price_minor"
+down_revision = "0005_cart_archive_partitions"
+branch_labels = None
+depends_on = None
+
+
+# Keeps cart_item.price and price_minor (integer cents) equal, whichever of the
+# two a writer sets: the app writes price_minor, older code and ad-hoc SQL price.
+CART_ITEM_PRICE_FN = """
+CREATE OR REPLACE FUNCTION cart_item_price() RETURNS trigger AS $$
+BEGIN
+    IF NEW.price_minor IS NOT NULL AND (TG_OP = 'INSERT' OR NEW.price_minor <> OLD.price_minor) THEN
+        NEW.price = NEW.price_minor / 100.0;
+    ELSIF TG_OP = 'INSERT' OR NEW.price IS DISTINCT FROM OLD.price THEN
+        NEW.price_minor = (NEW.price * 100)::bigint;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# 0003's cart_item_totals, also maintaining cart.total_amount_minor as an integer sum
+CART_ITEM_TOTALS_FN = """
+CREATE OR REPLACE FUNCTION cart_item_totals() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.cart_id = NEW.cart_id THEN
+        IF OLD.quantity = NEW.quantity AND OLD.price_minor = NEW.price_minor THEN
+            RETURN NULL;
+        END IF;
+        UPDATE cart
+        SET total_quantity = total_quantity + NEW.quantity - OLD.quantity,
+            total_amount = total_amount + NEW.price * NEW.quantity - OLD.price * OLD.quantity,
+            total_amount_minor = total_amount_minor + NEW.price_minor * NEW.quantity - OLD.price_minor * OLD.quantity
+        WHERE id = NEW.cart_id;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE cart
+        SET item_count = item_count - 1,
+            total_quantity = total_quantity - OLD.quantity,
+            total_amount = total_amount - OLD.price * OLD.quantity,
+            total_amount_minor = total_amount_minor - OLD.price_minor * OLD.quantity
+        WHERE id = OLD.cart_id;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        UPDATE cart
+        SET item_count = item_count + 1,
+            total_quantity = total_quantity + NEW.quantity,
+            total_amount = total_amount + NEW.price * NEW.quantity,
+            total_amount_minor = total_amount_minor + NEW.price_minor * NEW.quantity
+        WHERE id = NEW.cart_id;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# As created by 0003, for downgrade
+CART_ITEM_TOTALS_FN_0003 = """
+CREATE OR REPLACE FUNCTION cart_item_totals() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.cart_id = NEW.cart_id THEN
+        IF OLD.quantity = NEW.quantity AND OLD.price = NEW.price THEN
+            RETURN NULL;
+        END IF;
+        UPDATE cart
+        SET total_quantity = total_quantity + NEW.quantity - OLD.quantity,
+            total_amount = total_amount + NEW.price * NEW.quantity - OLD.price * OLD.quantity
+        WHERE id = NEW.cart_id;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE cart
+        SET item_count = item_count - 1,
+            total_quantity = total_quantity - OLD.quantity,
+            total_amount = total_amount - OLD.price * OLD.quantity
+        WHERE id = OLD.cart_id;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        UPDATE cart
+        SET item_count = item_count + 1,
+            total_quantity = total_quantity + NEW.quantity,
+            total_amount = total_amount + NEW.price * NEW.quantity
+        WHERE id = NEW.cart_id;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def upgrade() -> None:
+    # Adding the column locks cart_item against writes until this migration
+    # commits, so the backfill cannot miss a row; the triggers are created
+    # after it so backfilled rows do not re-run the cart totals.
+    op.add_column("cart_item", sa.Column("price_minor", sa.BigInteger(), nullable=True))
+    op.execute("UPDATE cart_item SET price_minor = (price * 100)::bigint")
+    op.alter_column("cart_item", "price_minor", nullable=False)
+
+    op.add_column("cart", sa.Column("total_amount_minor", sa.BigInteger(), nullable=False, server_default=sa.text("0")))
+    # A backfill is not activity: keep updated_at, which drives the reaper
+    op.execute("ALTER TABLE cart DISABLE TRIGGER trg_cart_touch")
+    op.execute("UPDATE cart SET total_amount_minor = (total_amount * 100)::bigint WHERE total_amount <> 0")
+    op.execute("ALTER TABLE cart ENABLE TRIGGER trg_cart_touch")
+
+    # Archived items get the same keys as the cart view's items
+    op.execute(
+        """
+        UPDATE cart_archive
+        SET items = (
+            SELECT coalesce(
+                jsonb_agg(i || jsonb_build_object('price_minor', ((i ->> 'price')::numeric * 100)::bigint) ORDER BY n),
+                '[]'::jsonb
+            )
+            FROM jsonb_array_elements(items) WITH ORDINALITY AS e(i, n)
+        )
+        WHERE jsonb_array_length(items) > 0
+        """
+    )
+
+    op.execute(CART_ITEM_PRICE_FN)
+    op.execute(
+        """
+        CREATE TRIGGER trg_cart_item_price
+        BEFORE INSERT OR UPDATE OF price, price_minor ON cart_item
+        FOR EACH ROW EXECUTE FUNCTION cart_item_price()
+        """
+    )
+    op.execute(CART_ITEM_TOTALS_FN)
+    # price_minor joins the column list: a write of price_minor alone changes
+    # price only through the BEFORE trigger, which UPDATE OF does not see
+    op.execute("DROP TRIGGER trg_cart_item_totals ON cart_item")
+    op.execute(
+        """
+        CREATE TRIGGER trg_cart_item_totals
+        AFTER INSERT OR DELETE OR UPDATE OF cart_id, price, price_minor, quantity ON cart_item
+        FOR EACH ROW EXECUTE FUNCTION cart_item_totals()
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER trg_cart_item_totals ON cart_item")
+    op.execute(CART_ITEM_TOTALS_FN_0003)
+    op.execute(
+        """
+        CREATE TRIGGER trg_cart_item_totals
+        AFTER INSERT OR DELETE OR UPDATE OF cart_id, price, quantity ON cart_item
+        FOR EACH ROW EXECUTE FUNCTION cart_item_totals()
+        """
+    )
+    op.execute("DROP TRIGGER IF EXISTS trg_cart_item_price ON cart_item")
+    op.execute("DROP FUNCTION IF EXISTS cart_item_price()")
+    op.execute(
+        """
+        UPDATE cart_archive
+        SET items = (
+            SELECT jsonb_agg(i - 'price_minor' ORDER BY n)
+            FROM jsonb_array_elements(items) WITH ORDINALITY AS e(i, n)
+        )
+        WHERE jsonb_array_length(items) > 0
+        """
+    )
+    op.drop_column("cart", "total_amount_minor")
+    op.drop_column("cart_item", "price_minor")
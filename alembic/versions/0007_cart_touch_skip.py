@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0007_cart_touch_skip"
+down_revision = "0006_price_minor"
+branch_labels = None
+depends_on = None
+
+
+# A catalog reprice rewrites item prices, and through trg_cart_item_totals the
+# cart totals, but is not activity: writers set cart.skip_touch for the
+# duration of such a statement to keep updated_at, which drives the reaper.
+CART_TOUCH_FN = """
+CREATE OR REPLACE FUNCTION cart_touch() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('cart.skip_touch', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
+    NEW.updated_at = now();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# As created by 0004, for downgrade
+CART_TOUCH_FN_0004 = """
+CREATE OR REPLACE FUNCTION cart_touch() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at = now();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def upgrade() -> None:
+    op.execute(CART_TOUCH_FN)
+
+
+def downgrade() -> None:
+    op.execute(CART_TOUCH_FN_0004)
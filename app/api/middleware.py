@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import time
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.instrumentation import log_request, track_statements
+from app.metrics import http_duration, http_in_flight, http_requests
+
+
+class InstrumentationMiddleware:
+    """
+    Per-request SQL stats headers, app.requests log record and HTTP metrics.
+
+    Plain ASGI rather than BaseHTTPMiddleware, which would run every request
+    through an extra task and memory stream.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        with track_statements() as stats:
+
+            async def send_with_stats(message: Message) -> None:
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    # Handlers have returned by now, except for streamed bodies
+                    status = message["status"]
+                    MutableHeaders(scope=message).update(stats.headers(time.perf_counter() - started))
+                await send(message)
+
+            http_in_flight.inc()
+            try:
+                await self.app(scope, receive, send_with_stats)
+            finally:
+                http_in_flight.dec()
+                elapsed = time.perf_counter() - started
+                # Route template, not the raw path, keeps label cardinality bounded
+                route = getattr(scope.get("route"), "path", "<unmatched>")
+                http_duration.observe(elapsed, scope["method"], route)
+                http_requests.inc(scope["method"], route, str(status))
+                log_request("http", f"{scope['method']} {route}", status, stats, elapsed)
@@ -2,13 +2,13 @@ from __future__ import annotations
 
 import secrets
 from datetime import timedelta
-from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, HTTPException, Request, Response, status
 
-from app.db import get_session
-from app.schemas import ByIdsRequest, CartOut
+from app.cache import active_key, cart_key, summary_key, user_key
+from app.db import read_session_ctx
+from app.schemas import ByIdsRequest, CartOut, CartSummaryOut
+from app.serialization import json_response
 from app.services.cart_service import CartService
 
 
@@ -17,6 +17,7 @@ router = APIRouter(prefix="/api/v1")
 
 COOKIE_NAME = "sellio_cart"
 COOKIE_MAX_AGE = int(timedelta(days=30).total_seconds())
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
 
 
 def ensure_cookie(request: Request, response: Response) -> str:
@@ -38,47 +39,74 @@ def ensure_cookie(request: Request, response: Response) -> str:
 async def get_active(
     request: Request,
     response: Response,
-    session: Annotated[AsyncSession, Depends(get_session)],
     company_id: int,
     user_id: int | None = None,
 ):
     cookie = ensure_cookie(request, response)
-    svc = CartService(session)
-    cart = await svc.get_active(company_id=company_id, user_id=user_id, cookie=cookie)
+    async with read_session_ctx({active_key(company_id, user_id, cookie)}) as session:
+        svc = CartService(session)
+        cart = await svc.get_active(company_id=company_id, user_id=user_id, cookie=cookie)
     if not cart:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-    return await svc.serialize(cart)
+    return json_response(cart, response)
+
+
+@router.get("/cart/active/summary", response_model=CartSummaryOut)
+async def get_active_summary(
+    request: Request,
+    response: Response,
+    company_id: int,
+    user_id: int | None = None,
+):
+    """Item count and total for mini-cart widgets, without loading items."""
+    cookie = ensure_cookie(request, response)
+    async with read_session_ctx({summary_key(company_id, user_id, cookie)}) as session:
+        svc = CartService(session)
+        summary = await svc.get_active_summary(company_id=company_id, user_id=user_id, cookie=cookie)
+    if not summary:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return json_response(summary, response)
 
 
 @router.get("/cart/{cart_id}", response_model=CartOut)
-async def get_cart(cart_id: int, session: Annotated[AsyncSession, Depends(get_session)]):
-    svc = CartService(session)
-    cart = await svc.get_cart(cart_id)
+async def get_cart(cart_id: int):
+    async with read_session_ctx({cart_key(cart_id)}) as session:
+        svc = CartService(session)
+        cart = await svc.get_cart(cart_id)
     if not cart:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-    return await svc.serialize(cart)
+    return json_response(cart)
 
 
 @router.get("/carts/by-user", response_model=list[CartOut])
 async def carts_by_user(
     user_id: int,
+    response: Response,
     company_id: int | None = None,
     status_param: int | None = None,
     limit: int = 50,
     offset: int = 0,
-    *,
-    session: Annotated[AsyncSession, Depends(get_session)],
+    cursor: str | None = None,
 ):
-    svc = CartService(session)
-    carts = await svc.list_by_user(user_id, company_id, status_param, limit, offset)
-    return [await svc.serialize(c) for c in carts]
+    async with read_session_ctx({user_key(user_id)}) as session:
+        svc = CartService(session)
+        try:
+            carts, next_cursor = await svc.list_by_user(user_id, company_id, status_param, limit, offset, cursor)
+        except ValueError as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return json_response(carts, response)
 
 
 @router.post("/carts/by-ids", response_model=list[CartOut])
-async def carts_by_ids(body: ByIdsRequest, session: Annotated[AsyncSession, Depends(get_session)]):
-    svc = CartService(session)
-    carts = await svc.list_by_ids(body.ids)
-    return [await svc.serialize(c) for c in carts]
+async def carts_by_ids(body: ByIdsRequest):
+    async with read_session_ctx({cart_key(i) for i in body.ids}) as session:
+        svc = CartService(session)
+        try:
+            return json_response(await svc.list_by_ids(body.ids))
+        except ValueError as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
 
 
 @router.get("/healthz")
@@ -1,14 +1,17 @@
 from __future__ import annotations
 
-from typing import Annotated
+from typing import Annotated, Literal
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from pydantic import BaseModel
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.api.v1.routes_read import COOKIE_NAME
 from app.db import session_ctx
 from app.schemas import CartOut
-from app.services.cart_service import CartService
+from app.serialization import json_response
+from app.services.cart_service import CartMutation, CartService
 
 
 router = APIRouter(prefix="/api/v1")
@@ -20,10 +23,15 @@ class UpsertCartRequest(BaseModel):
     cookie: str | None = None
 
 
+# Prices are decimal strings ("10.50"), or integer minor units (1050) in
+# `price_minor` for clients that opt in; `price_minor` wins when both are sent
+
+
 class UpsertItemRequest(BaseModel):
     product_id: int
     name: str
-    price: str
+    price: str | None = None
+    price_minor: int | None = None
     quantity: int
 
 
@@ -33,7 +41,8 @@ class AddItemToCartRequest(BaseModel):
     cookie: str | None = None
     product_id: int
     name: str
-    price: str
+    price: str | None = None
+    price_minor: int | None = None
     quantity: int
 
 
@@ -41,10 +50,55 @@ class UpdateQuantityRequest(BaseModel):
     quantity: int
 
 
+class IncrementItemRequest(BaseModel):
+    delta: int = 1
+
+
 class ChangeStatusRequest(BaseModel):
     status: int
 
 
+class CartMutationRequest(BaseModel):
+    op: Literal["upsert", "set_qty", "remove"]
+    product_id: int
+    name: str | None = None
+    price: str | None = None
+    price_minor: int | None = None
+    quantity: int = 0
+
+
+class BatchMutateRequest(BaseModel):
+    ops: list[CartMutationRequest]
+
+
+class MergeCartsRequest(BaseModel):
+    company_id: int
+    user_id: int
+    cookie: str | None = None  # defaults to the cart cookie of the request
+    policy: Literal["sum", "max", "keep_user", "keep_guest"] | None = None
+
+
+class ProductPriceRequest(BaseModel):
+    product_id: int
+    price: str | None = None
+    price_minor: int | None = None
+    name: str | None = None
+
+
+class RepriceRequest(BaseModel):
+    products: list[ProductPriceRequest]
+
+
+class RepriceOut(BaseModel):
+    products: int
+    chunks: int
+    rows_updated: int
+
+
+def _price(req: UpsertItemRequest | AddItemToCartRequest | CartMutationRequest | ProductPriceRequest) -> str | int | None:
+    return req.price if req.price_minor is None else req.price_minor
+
+
 @router.post("/cart/upsert", response_model=CartOut, status_code=status.HTTP_201_CREATED)
 async def upsert_cart(req: UpsertCartRequest):
     async with session_ctx() as session:
@@ -55,8 +109,7 @@ async def upsert_cart(req: UpsertCartRequest):
                 user_id=req.user_id,
                 cookie=req.cookie,
             )
-            await session.refresh(cart)
-        return await svc.serialize(cart)
+        return json_response(cart, status_code=status.HTTP_201_CREATED)
 
 
 @router.post("/cart/add-item", response_model=CartOut, status_code=status.HTTP_201_CREATED)
@@ -64,41 +117,40 @@ async def add_item_to_cart(req: AddItemToCartRequest):
     """Create cart if needed and add item in one operation"""
     async with session_ctx() as session:
         svc = CartService(session)
-        async with session.begin():
-            # Get or create active cart
-            cart = await svc.upsert_cart(
-                company_id=req.company_id,
-                user_id=req.user_id,
-                cookie=req.cookie,
-            )
-            # Add item to cart
-            cart = await svc.upsert_item(
-                cart_id=cart.id,
-                product_id=req.product_id,
-                name=req.name,
-                price=req.price,
-                quantity=req.quantity,
-            )
-            await session.refresh(cart)
-        return await svc.serialize(cart)
+        try:
+            async with session.begin():
+                cart = await svc.add_item(
+                    company_id=req.company_id,
+                    user_id=req.user_id,
+                    cookie=req.cookie,
+                    product_id=req.product_id,
+                    name=req.name,
+                    price=_price(req),
+                    quantity=req.quantity,
+                )
+        except ValueError as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+        return json_response(cart, status_code=status.HTTP_201_CREATED)
 
 
 @router.post("/cart/{cart_id}/item", response_model=CartOut)
 async def upsert_item(cart_id: int, req: UpsertItemRequest):
     async with session_ctx() as session:
         svc = CartService(session)
-        async with session.begin():
-            cart = await svc.upsert_item(
-                cart_id=cart_id,
-                product_id=req.product_id,
-                name=req.name,
-                price=req.price,
-                quantity=req.quantity,
-            )
-            if not cart:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
-            await session.refresh(cart)
-        return await svc.serialize(cart)
+        try:
+            async with session.begin():
+                cart = await svc.upsert_item(
+                    cart_id=cart_id,
+                    product_id=req.product_id,
+                    name=req.name,
+                    price=_price(req),
+                    quantity=req.quantity,
+                )
+        except ValueError as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+        if not cart:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
+        return json_response(cart)
 
 
 @router.put("/cart/{cart_id}/item/{product_id}/quantity")
@@ -110,8 +162,20 @@ async def update_quantity(cart_id: int, product_id: int, req: UpdateQuantityRequ
             if not cart:
                 # Cart was deleted (became empty) or not found
                 return {"message": "Cart was deleted (became empty) or item not found", "cart_id": cart_id}
-            await session.refresh(cart)
-        return await svc.serialize(cart)
+        return json_response(cart)
+
+
+@router.post("/cart/{cart_id}/item/{product_id}/increment")
+async def increment_item(cart_id: int, product_id: int, req: IncrementItemRequest):
+    """Atomically add `delta` (negative to decrement) to the item quantity"""
+    async with session_ctx() as session:
+        svc = CartService(session)
+        async with session.begin():
+            cart = await svc.increment_item(cart_id, product_id, req.delta)
+        if not cart:
+            # Cart was deleted (became empty) or not found
+            return {"message": "Cart was deleted (became empty) or item not found", "cart_id": cart_id}
+        return json_response(cart)
 
 
 @router.delete("/cart/{cart_id}/item/{product_id}")
@@ -123,8 +187,7 @@ async def remove_item(cart_id: int, product_id: int):
             if not cart:
                 # Cart was deleted (became empty) or not found
                 return {"message": "Cart was deleted (became empty) or item not found", "cart_id": cart_id}
-            await session.refresh(cart)
-        return await svc.serialize(cart)
+        return json_response(cart)
 
 
 @router.put("/cart/{cart_id}/status", response_model=CartOut)
@@ -134,7 +197,51 @@ async def change_status(cart_id: int, req: ChangeStatusRequest):
         async with session.begin():
             cart = await svc.change_status(cart_id, req.status)
             if not cart:
-                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown error")
-            await session.refresh(cart)
-        return await svc.serialize(cart)
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cart not found or empty")
+        return json_response(cart)
 
+
+@router.post("/cart/{cart_id}/batch", response_model=CartOut)
+async def batch_mutate(cart_id: int, req: BatchMutateRequest):
+    """Apply several item mutations in order, in one transaction"""
+    async with session_ctx() as session:
+        svc = CartService(session)
+        ops = [CartMutation(op.op, op.product_id, op.name, _price(op), op.quantity) for op in req.ops]
+        try:
+            async with session.begin():
+                cart = await svc.batch_mutate(cart_id, ops)
+        except ValueError as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+        if not cart:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found or became empty")
+        return json_response(cart)
+
+
+@router.post("/cart/merge", response_model=CartOut)
+async def merge_carts(req: MergeCartsRequest, request: Request):
+    """Merge the anonymous cookie cart into the user's active cart (on login)"""
+    cookie = req.cookie or request.cookies.get(COOKIE_NAME)
+    async with session_ctx() as session:
+        svc = CartService(session)
+        try:
+            async with session.begin():
+                cart = await svc.merge_carts(req.company_id, req.user_id, cookie, req.policy)
+        except ValueError as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+        except IntegrityError:
+            # The user's cart was created concurrently; a retry merges into it
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Concurrent cart change, retry") from None
+        if not cart:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No cart to merge")
+        return json_response(cart)
+
+
+@router.post("/catalog/reprice", response_model=RepriceOut)
+async def reprice_products(req: RepriceRequest):
+    """Propagate catalog price/name changes to every ACTIVE cart"""
+    async with session_ctx() as session:
+        svc = CartService(session)
+        try:
+            return await svc.reprice_products([(p.product_id, _price(p), p.name) for p in req.products])
+        except ValueError as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import json
+import time
+from collections import OrderedDict
+from collections.abc import Hashable, Iterable
+from typing import Any
+
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .replicas import replica_router
+from .settings import settings
+
+_PENDING_KEY = "cart_cache_pending"
+
+# Sentinel for "not cached", since None is a valid cached value
+MISSING = object()
+
+
+# Invalidating this key drops the whole cache (bulk writes touching many carts)
+ALL_KEYS = ("*",)
+
+
+def cart_key(cart_id: int) -> tuple:
+    return ("cart", cart_id)
+
+
+def active_key(company_id: int, user_id: int | None, cookie: str | None, kind: str = "active") -> tuple:
+    # Mirrors get_active: user_id wins over cookie
+    if user_id:
+        return (kind, company_id, user_id, None)
+    return (kind, company_id, None, cookie)
+
+
+def summary_key(company_id: int, user_id: int | None, cookie: str | None) -> tuple:
+    return active_key(company_id, user_id, cookie, kind="summary")
+
+
+def user_key(user_id: int) -> tuple:
+    # Not cached; keeps a user's cart listings on the primary after writes (app.replicas)
+    return ("user", user_id)
+
+
+def cart_keys(cart_id: int, company_id: int, user_id: int | None, cookie: str | None) -> set[tuple]:
+    """Every key whose cached value may change when this cart changes."""
+    keys = {cart_key(cart_id)}
+    if user_id:
+        keys.add(user_key(user_id))
+    for kind in ("active", "summary"):
+        if user_id:
+            keys.add(active_key(company_id, user_id, None, kind))
+        if cookie:
+            keys.add(active_key(company_id, None, cookie, kind))
+    return keys
+
+
+class CartCache:
+    """
+    Bounded LRU with per-entry TTL for serialized cart views.
+
+    Misses (None) are cached too, so storefront polls for visitors without a
+    cart stay off the database. Values are shared between callers and must be
+    treated as read-only.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        # Bumped on every invalidation; see `token()`
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def token(self) -> int:
+        """
+        Take before reading from the database and pass to `set`.
+
+        A value read while an invalidation was in flight is then dropped
+        instead of being cached stale.
+        """
+        return self._epoch
+
+    def get(self, key: Hashable) -> Any:
+        """Returns the cached value or `MISSING`."""
+        if not self.enabled:
+            return MISSING
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+                self.evictions += 1
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, token: int) -> None:
+        if not self.enabled or token != self._epoch:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, keys: Iterable[Hashable]) -> None:
+        keys = list(keys)
+        if ALL_KEYS in keys:
+            self.clear()
+            return
+        self._epoch += 1
+        for key in keys:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        self._epoch += 1
+        self.invalidations += len(self._data)
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+cart_cache = CartCache(maxsize=settings.cart_cache_size, ttl=settings.cart_cache_ttl)
+
+
+def encode_keys(keys: Iterable[tuple]) -> str:
+    return json.dumps(sorted(keys, key=repr), separators=(",", ":"))
+
+
+def decode_keys(payload: str) -> list[tuple]:
+    return [tuple(key) for key in json.loads(payload)]
+
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD = 7900
+
+
+def encode_payloads(keys: Iterable[tuple]) -> list[str]:
+    """`encode_keys` split into as many payloads as needed to fit NOTIFY."""
+    payloads: list[str] = []
+    batch: list[tuple] = []
+    size = 2
+    for key in sorted(keys, key=repr):
+        key_size = len(json.dumps(key, separators=(",", ":")).encode()) + 1
+        if batch and size + key_size > MAX_PAYLOAD:
+            payloads.append(encode_keys(batch))
+            batch, size = [], 2
+        batch.append(key)
+        size += key_size
+    if batch:
+        payloads.append(encode_keys(batch))
+    return payloads
+
+
+def mark_written(keys: Iterable[tuple]) -> None:
+    """Keep reads of `keys` on the primary database for a while (see `app.replicas`)."""
+    keys = set(keys)
+    if ALL_KEYS in keys:
+        replica_router.mark_all_written()
+    else:
+        replica_router.mark_written(keys)
+
+
+async def invalidate_on_commit(session: AsyncSession, keys: set[tuple]) -> None:
+    """
+    Evict now, again once the transaction commits, and on every other replica.
+
+    The second local eviction drops entries re-populated by concurrent
+    readers that still saw the pre-commit rows. Other replicas are told
+    through NOTIFY, which Postgres delivers only if the transaction commits
+    (see `app.cache_listener`). Committed keys also become sticky to the
+    primary database, here and in the other processes.
+    """
+    if not cart_cache.enabled and not replica_router.enabled:
+        return
+    cart_cache.invalidate(keys)
+    session.info.setdefault(_PENDING_KEY, set()).update(keys)
+    # One statement however many payloads a large batch needs
+    notify = [func.pg_notify(settings.cart_cache_channel, payload) for payload in encode_payloads(keys)]
+    await session.execute(select(*notify))
+
+
+@event.listens_for(Session, "after_commit")
+def _evict_after_commit(session: Session) -> None:
+    keys = session.info.pop(_PENDING_KEY, None)
+    if keys:
+        cart_cache.invalidate(keys)
+        mark_written(keys)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
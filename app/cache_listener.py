@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+
+import asyncpg
+from sqlalchemy.engine import make_url
+
+from .cache import CartCache, cart_cache, decode_keys, mark_written
+from .replicas import replica_router
+from .settings import settings
+
+log = logging.getLogger(__name__)
+
+
+def asyncpg_dsn(database_url: str) -> str:
+    """SQLAlchemy URL (postgresql+asyncpg://...) -> plain libpq DSN for asyncpg."""
+    return make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+class CacheInvalidationListener:
+    """
+    LISTENs for cart-changed notifications and evicts the local cache.
+
+    Runs on a dedicated connection outside the pool. Whenever that
+    connection is (re)established the whole cache is dropped, since
+    notifications sent while disconnected are lost.
+    """
+
+    def __init__(self, dsn: str, channel: str, cache: CartCache, retry_delay: float = 1.0):
+        self.dsn = dsn
+        self.channel = channel
+        self.cache = cache
+        self.retry_delay = retry_delay
+        self.connected = asyncio.Event()
+
+    def _on_notify(self, conn: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+        try:
+            keys = decode_keys(payload)
+        except ValueError:
+            log.warning("Malformed cache invalidation payload: %r", payload)
+            self.cache.clear()
+            replica_router.mark_all_written()
+            return
+        self.cache.invalidate(keys)
+        mark_written(keys)
+
+    async def run(self) -> None:
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda _, lost=lost: lost.set())
+                await conn.add_listener(self.channel, self._on_notify)
+                self.cache.clear()
+                replica_router.mark_all_written()
+                self.connected.set()
+                log.info("Listening for cart cache invalidations on %r", self.channel)
+                await lost.wait()
+                log.warning("Cache invalidation listener connection lost")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Cache invalidation listener failed")
+            finally:
+                self.connected.clear()
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(self.retry_delay)
+
+
+def start_cache_listener() -> asyncio.Task | None:
+    """Start the listener on the running loop; no-op without a cache or read replicas."""
+    if not (cart_cache.enabled or replica_router.enabled) or not settings.database_url:
+        return None
+    listener = CacheInvalidationListener(asyncpg_dsn(settings.database_url), settings.cart_cache_channel, cart_cache)
+    return asyncio.get_running_loop().create_task(listener.run())
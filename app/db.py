@@ -1,13 +1,26 @@
 from contextlib import asynccontextmanager
-from typing import AsyncIterator
+from typing import AsyncIterator, Hashable, Iterable
 
+import orjson
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 
+from . import instrumentation  # noqa: F401  (registers statement tracking listeners)
+from .metrics import TimedPool
+from .replicas import replica_router, replica_urls
 from .settings import settings
 
 
 def create_engine(url: str) -> AsyncEngine:
-    return create_async_engine(url, pool_pre_ping=True, pool_size=10, max_overflow=20)
+    return create_async_engine(
+        url,
+        poolclass=TimedPool,
+        pool_pre_ping=True,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        # Decodes the cart views' items arrays
+        json_deserializer=orjson.loads,
+    )
 
 
 engine: AsyncEngine | None = None
@@ -20,6 +33,21 @@ def init_engines() -> None:
         return
     engine = create_engine(settings.database_url)
     session_factory = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    replica_router.set_engines([create_engine(url) for url in replica_urls()])
+
+
+def pool_saturated() -> bool:
+    """Whether a checkout from the primary pool would have to wait (see TimedPool.saturated)."""
+    return engine is not None and isinstance(engine.pool, TimedPool) and engine.pool.saturated()
+
+
+async def dispose_engines() -> None:
+    global engine, session_factory
+    for e in [engine, *replica_router.engines]:
+        if e is not None:
+            await e.dispose()
+    engine = session_factory = None
+    replica_router.set_engines([])
 
 
 @asynccontextmanager
@@ -31,6 +59,20 @@ async def session_ctx() -> AsyncIterator[AsyncSession]:
         yield session
 
 
+@asynccontextmanager
+async def read_session_ctx(keys: Iterable[Hashable] = ()) -> AsyncIterator[AsyncSession]:
+    """
+    Session for read-only work, on a read replica when one is fresh enough
+    and none of `keys` (app.cache keys) was written recently.
+    """
+    if session_factory is None:
+        init_engines()
+    assert session_factory is not None, "Session factory is not initialized"
+    replica = replica_router.pick(keys)
+    async with (session_factory(bind=replica) if replica is not None else session_factory()) as session:
+        yield session
+
+
 async def get_session() -> AsyncIterator[AsyncSession]:
     """FastAPI dependency for database session"""
     async with session_ctx() as session:
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import inspect
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+
+import grpc
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.instrumentation import StatementStats, log_request, track_statements
+from app.metrics import grpc_duration, grpc_handled, grpc_in_flight
+
+
+def _wrap_handler(handler: grpc.RpcMethodHandler, wrap_unary, wrap_stream) -> grpc.RpcMethodHandler:
+    """Re-create `handler` with its unary/stream-response behavior wrapped."""
+    if handler.unary_unary:
+        return grpc.unary_unary_rpc_method_handler(
+            wrap_unary(handler.unary_unary),
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer,
+        )
+    if handler.unary_stream:
+        return grpc.unary_stream_rpc_method_handler(
+            wrap_stream(handler.unary_stream),
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer,
+        )
+    return handler
+
+
+async def _responses(behavior, request, context) -> AsyncIterator:
+    """Responses of a stream handler, whether it yields them or writes them with `context.write()`."""
+    responses = behavior(request, context)
+    if inspect.isasyncgen(responses):
+        async for response in responses:
+            yield response
+    else:
+        await responses
+
+
+class _RpcStats:
+    """
+    Stats of one RPC, reported once as trailing metadata, a log record and metrics.
+
+    Also stands in for the servicer context: `abort` sends the status right
+    away, so the metadata has to be set before it is called.
+    """
+
+    def __init__(self, context: grpc.aio.ServicerContext, method: str, stats: StatementStats):
+        self._context = context
+        self._method = method
+        self._stats = stats
+        self._started = time.perf_counter()
+        self._reported = False
+        self._metadata: tuple = ()
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
+
+    def set_trailing_metadata(self, trailing_metadata) -> None:
+        """Keep the handler's trailing metadata, sent along with the stats by `report`."""
+        self._metadata = tuple(trailing_metadata)
+
+    def report(self, code: grpc.StatusCode) -> None:
+        if self._reported:
+            return
+        self._reported = True
+        elapsed = time.perf_counter() - self._started
+        headers = tuple((k.lower(), v) for k, v in self._stats.headers(elapsed).items())
+        self._context.set_trailing_metadata(self._metadata + headers)
+        log_request("grpc", self._method, code.name, self._stats, elapsed)
+        grpc_duration.observe(elapsed, self._method)
+        grpc_handled.inc(self._method, code.name)
+
+    async def abort(self, code: grpc.StatusCode, details: str = "", trailing_metadata=()):
+        self.report(code)
+        return await self._context.abort(code, details, trailing_metadata)
+
+
+class InstrumentationInterceptor(grpc.aio.ServerInterceptor):
+    """
+    Track SQL statements per RPC, send the totals as trailing metadata, log
+    them to `app.requests` (see app.instrumentation) and record RPC metrics.
+    """
+
+    async def intercept_service(
+        self,
+        continuation: Callable[[grpc.HandlerCallDetails], Awaitable[grpc.RpcMethodHandler]],
+        handler_call_details: grpc.HandlerCallDetails,
+    ) -> grpc.RpcMethodHandler:
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return handler
+        method = handler_call_details.method
+
+        def wrap_unary(behavior):
+            async def wrapper(request, context):
+                grpc_in_flight.inc()
+                with track_statements() as stats:
+                    rpc = _RpcStats(context, method, stats)
+                    try:
+                        response = await behavior(request, rpc)
+                    except BaseException:
+                        rpc.report(grpc.StatusCode.UNKNOWN)
+                        raise
+                    finally:
+                        grpc_in_flight.dec()
+                    rpc.report(context.code() or grpc.StatusCode.OK)
+                    return response
+
+            return wrapper
+
+        def wrap_stream(behavior):
+            async def wrapper(request, context):
+                grpc_in_flight.inc()
+                with track_statements() as stats:
+                    rpc = _RpcStats(context, method, stats)
+                    try:
+                        async for response in _responses(behavior, request, rpc):
+                            yield response
+                    except BaseException:
+                        rpc.report(grpc.StatusCode.UNKNOWN)
+                        raise
+                    finally:
+                        grpc_in_flight.dec()
+                    rpc.report(context.code() or grpc.StatusCode.OK)
+
+            return wrapper
+
+        return _wrap_handler(handler, wrap_unary, wrap_stream)
+
+
+class LoadSheddingInterceptor(grpc.aio.ServerInterceptor):
+    """
+    Fail RPCs fast with RESOURCE_EXHAUSTED instead of queueing them without
+    bound: past `max_in_flight` concurrent RPCs (0 = no limit), and while
+    `saturated()` says the DB pool has no connection to give, so an RPC is
+    rejected at once rather than after waiting out DB_POOL_TIMEOUT. One that
+    still times out on a checkout (admitted just before the pool filled up)
+    gets the same status. Clients can back off or retry elsewhere while the
+    RPCs already admitted keep their latency.
+    """
+
+    def __init__(self, max_in_flight: int = 0, saturated: Callable[[], bool] | None = None):
+        self.max_in_flight = max_in_flight
+        self.saturated = saturated
+        self.in_flight = 0
+
+    async def intercept_service(
+        self,
+        continuation: Callable[[grpc.HandlerCallDetails], Awaitable[grpc.RpcMethodHandler]],
+        handler_call_details: grpc.HandlerCallDetails,
+    ) -> grpc.RpcMethodHandler:
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return handler
+
+        def admit() -> str | None:
+            """Why the RPC is rejected, or None after counting it in."""
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                return "too many concurrent requests"
+            if self.saturated is not None and self.saturated():
+                return "database connections exhausted"
+            self.in_flight += 1
+            return None
+
+        def wrap_unary(behavior):
+            async def wrapper(request, context):
+                if rejected := admit():
+                    await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, rejected)
+                try:
+                    return await behavior(request, context)
+                except PoolTimeoutError:
+                    await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "database connections exhausted")
+                finally:
+                    self.in_flight -= 1
+
+            return wrapper
+
+        def wrap_stream(behavior):
+            async def wrapper(request, context):
+                if rejected := admit():
+                    await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, rejected)
+                try:
+                    async for response in _responses(behavior, request, context):
+                        yield response
+                except PoolTimeoutError:
+                    await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "database connections exhausted")
+                finally:
+                    self.in_flight -= 1
+
+            return wrapper
+
+        return _wrap_handler(handler, wrap_unary, wrap_stream)
@@ -1,40 +1,73 @@
 from __future__ import annotations
 
 import asyncio
+from collections.abc import AsyncIterator
+from contextlib import aclosing
 from datetime import datetime
 from decimal import Decimal
 
 import grpc
 from google.protobuf.empty_pb2 import Empty  # type: ignore
 
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db import session_ctx
+from app.cache import active_key, cart_key, summary_key, user_key
+from app.db import pool_saturated, read_session_ctx, session_ctx
 from app.models import CartStatus
-from app.services.cart_service import CartService
+from app.serialization import cart_list, cart_response, fill_cart
+from app.services.cart_service import CartMutation, CartService, encode_cursor
+from app.settings import settings
+from .interceptors import InstrumentationInterceptor, LoadSheddingInterceptor
 from .utils import ensure_generated
 cart_pb2, cart_pb2_grpc = ensure_generated()
 
 
-def serialize_cart_message(cart_dict: dict) -> cart_pb2.Cart:
-    return cart_pb2.Cart(
-        id=cart_dict["id"],
-        company_id=cart_dict["company_id"],
-        user_id=cart_dict["user_id"] or 0,
-        cookie=cart_dict["cookie"] or "",
-        status=cart_dict["status"],
-        created_at=cart_dict["created_at"].isoformat(),
-        items=[
-            cart_pb2.CartItem(
-                product_id=i["product_id"],
-                name=i["name"],
-                price=i["price"],
-                quantity=i["quantity"],
-            )
-            for i in cart_dict["items"]
-        ],
-        total_amount=cart_dict["total_amount"],
-    )
+def price_of(msg) -> str | int:
+    """`price_minor` when the client set it, else the decimal string `price`."""
+    return msg.price_minor if msg.HasField("price_minor") else msg.price
+
+
+async def write_carts(context: grpc.aio.ServicerContext, carts: AsyncIterator[dict]) -> dict | None:
+    """
+    Write one Cart message per cart and return the last one written. Past
+    STREAM_MAX_SECONDS the stream ends with DEADLINE_EXCEEDED, set rather
+    than aborted so the carts already written stand: the timeout also covers
+    waiting on a slow client, which is what keeps the connection and the
+    read transaction from being held open.
+    """
+    last = None
+    try:
+        async with aclosing(carts), asyncio.timeout(settings.stream_max_seconds or None):
+            async for cart in carts:
+                await context.write(fill_cart(cart_pb2.Cart(), cart))
+                last = cart
+    except TimeoutError:
+        context.set_code(grpc.StatusCode.DEADLINE_EXCEEDED)
+        context.set_details(f"stream open for longer than STREAM_MAX_SECONDS ({settings.stream_max_seconds:g}s)")
+    return last
+
+
+def mutations_from_request(request: cart_pb2.BatchMutateRequest) -> list[CartMutation]:
+    ops = []
+    for m in request.ops:
+        kind = m.WhichOneof("op")
+        if kind == "upsert":
+            ops.append(CartMutation("upsert", m.upsert.product_id, m.upsert.name, price_of(m.upsert), m.upsert.quantity))
+        elif kind == "set_qty":
+            ops.append(CartMutation("set_qty", m.set_qty.product_id, quantity=m.set_qty.quantity))
+        elif kind == "remove":
+            ops.append(CartMutation("remove", m.remove.product_id))
+    return ops
+
+
+MERGE_POLICIES = {
+    cart_pb2.MERGE_POLICY_UNSPECIFIED: None,
+    cart_pb2.SUM: "sum",
+    cart_pb2.MAX: "max",
+    cart_pb2.KEEP_USER: "keep_user",
+    cart_pb2.KEEP_GUEST: "keep_guest",
+}
 
 
 class CartServiceImpl(cart_pb2_grpc.CartServiceServicer):
@@ -46,26 +79,25 @@ class CartServiceImpl(cart_pb2_grpc.CartServiceServicer):
             cookie = request.cookie or None
             async with session.begin():
                 cart = await svc.upsert_cart(company_id=request.company_id, user_id=user_id, cookie=cookie)
-                await session.refresh(cart)
-            serialized = await svc.serialize(cart)
-            return cart_pb2.CartResponse(cart=serialize_cart_message(serialized))
+            return cart_response(cart)
 
     async def UpsertItem(self, request: cart_pb2.UpsertItemRequest, context: grpc.aio.ServicerContext) -> cart_pb2.CartResponse:  # type: ignore
         async with session_ctx() as session:
             svc = CartService(session)
-            async with session.begin():
-                cart = await svc.upsert_item(
-                    cart_id=request.cart_id,
-                    product_id=request.product_id,
-                    name=request.name,
-                    price=request.price,
-                    quantity=request.quantity,
-                )
-                if not cart:
-                    await context.abort(grpc.StatusCode.NOT_FOUND, "cart not found")
-                await session.refresh(cart)
-            serialized = await svc.serialize(cart)  # type: ignore[arg-type]
-            return cart_pb2.CartResponse(cart=serialize_cart_message(serialized))
+            try:
+                async with session.begin():
+                    cart = await svc.upsert_item(
+                        cart_id=request.cart_id,
+                        product_id=request.product_id,
+                        name=request.name,
+                        price=price_of(request),
+                        quantity=request.quantity,
+                    )
+            except ValueError as exc:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(exc))
+            if not cart:
+                await context.abort(grpc.StatusCode.NOT_FOUND, "cart not found")
+            return cart_response(cart)  # type: ignore[arg-type]
 
     async def UpdateQty(self, request: cart_pb2.UpdateQtyRequest, context: grpc.aio.ServicerContext) -> cart_pb2.CartResponse:  # type: ignore
         async with session_ctx() as session:
@@ -74,9 +106,16 @@ class CartServiceImpl(cart_pb2_grpc.CartServiceServicer):
                 cart = await svc.update_qty(request.cart_id, request.product_id, request.quantity)
                 if not cart:
                     await context.abort(grpc.StatusCode.NOT_FOUND, "cart was deleted (became empty) or item not found")
-                await session.refresh(cart)
-            serialized = await svc.serialize(cart)  # type: ignore[arg-type]
-            return cart_pb2.CartResponse(cart=serialize_cart_message(serialized))
+            return cart_response(cart)  # type: ignore[arg-type]
+
+    async def IncrementItem(self, request: cart_pb2.IncrementItemRequest, context: grpc.aio.ServicerContext) -> cart_pb2.CartResponse:  # type: ignore
+        async with session_ctx() as session:
+            svc = CartService(session)
+            async with session.begin():
+                cart = await svc.increment_item(request.cart_id, request.product_id, request.delta)
+            if not cart:
+                await context.abort(grpc.StatusCode.NOT_FOUND, "cart was deleted (became empty) or item not found")
+            return cart_response(cart)  # type: ignore[arg-type]
 
     async def RemoveItem(self, request: cart_pb2.RemoveItemRequest, context: grpc.aio.ServicerContext) -> cart_pb2.CartResponse:  # type: ignore
         async with session_ctx() as session:
@@ -85,9 +124,7 @@ class CartServiceImpl(cart_pb2_grpc.CartServiceServicer):
                 cart = await svc.remove_item(request.cart_id, request.product_id)
                 if not cart:
                     await context.abort(grpc.StatusCode.NOT_FOUND, "cart was deleted (became empty) or item not found")
-                await session.refresh(cart)
-            serialized = await svc.serialize(cart)  # type: ignore[arg-type]
-            return cart_pb2.CartResponse(cart=serialize_cart_message(serialized))
+            return cart_response(cart)  # type: ignore[arg-type]
 
     async def ChangeStatus(self, request: cart_pb2.ChangeStatusRequest, context: grpc.aio.ServicerContext) -> cart_pb2.CartResponse:  # type: ignore
         async with session_ctx() as session:
@@ -95,54 +132,197 @@ class CartServiceImpl(cart_pb2_grpc.CartServiceServicer):
             async with session.begin():
                 cart = await svc.change_status(request.cart_id, request.status)
                 if not cart:
-                    await context.abort(grpc.StatusCode.FAILED_PRECONDITION, "invalid transition or cart not found")
-                await session.refresh(cart)
-            serialized = await svc.serialize(cart)  # type: ignore[arg-type]
-            return cart_pb2.CartResponse(cart=serialize_cart_message(serialized))
+                    await context.abort(grpc.StatusCode.FAILED_PRECONDITION, "cart not found or empty")
+            return cart_response(cart)  # type: ignore[arg-type]
+
+    async def BatchMutate(self, request: cart_pb2.BatchMutateRequest, context: grpc.aio.ServicerContext) -> cart_pb2.CartResponse:  # type: ignore
+        async with session_ctx() as session:
+            svc = CartService(session)
+            try:
+                async with session.begin():
+                    cart = await svc.batch_mutate(request.cart_id, mutations_from_request(request))
+            except ValueError as exc:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(exc))
+            if not cart:
+                await context.abort(grpc.StatusCode.NOT_FOUND, "cart not found or became empty")
+            return cart_response(cart)  # type: ignore[arg-type]
+
+    async def MergeCarts(self, request: cart_pb2.MergeCartsRequest, context: grpc.aio.ServicerContext) -> cart_pb2.CartResponse:  # type: ignore
+        async with session_ctx() as session:
+            svc = CartService(session)
+            try:
+                async with session.begin():
+                    cart = await svc.merge_carts(
+                        request.company_id, request.user_id, request.cookie, MERGE_POLICIES.get(request.policy)
+                    )
+            except ValueError as exc:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(exc))
+            except IntegrityError:
+                # The user's cart was created concurrently; a retry merges into it
+                await context.abort(grpc.StatusCode.ABORTED, "concurrent cart change, retry")
+            if not cart:
+                await context.abort(grpc.StatusCode.NOT_FOUND, "no cart to merge")
+            return cart_response(cart)  # type: ignore[arg-type]
+
+    async def RepriceProducts(self, request: cart_pb2.RepriceProductsRequest, context: grpc.aio.ServicerContext) -> cart_pb2.RepriceProductsResponse:  # type: ignore
+        async with session_ctx() as session:
+            svc = CartService(session)
+            products = [(p.product_id, price_of(p), p.name or None) for p in request.products]
+            try:
+                report = await svc.reprice_products(products)
+            except ValueError as exc:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(exc))
+            return cart_pb2.RepriceProductsResponse(**report)
 
     # RO
     async def GetCart(self, request: cart_pb2.GetCartRequest, context: grpc.aio.ServicerContext) -> cart_pb2.CartResponse:  # type: ignore
-        async with session_ctx() as session:
+        async with read_session_ctx({cart_key(request.cart_id)}) as session:
             svc = CartService(session)
             cart = await svc.get_cart(request.cart_id)
             if not cart:
                 await context.abort(grpc.StatusCode.NOT_FOUND, "not found")
-            serialized = await svc.serialize(cart)  # type: ignore[arg-type]
-            return cart_pb2.CartResponse(cart=serialize_cart_message(serialized))
+            return cart_response(cart)  # type: ignore[arg-type]
 
     async def GetActiveCart(self, request: cart_pb2.GetActiveCartRequest, context: grpc.aio.ServicerContext) -> cart_pb2.CartResponse:  # type: ignore
-        async with session_ctx() as session:
+        user_id = request.user_id or None
+        cookie = request.cookie or None
+        async with read_session_ctx({active_key(request.company_id, user_id, cookie)}) as session:
             svc = CartService(session)
-            user_id = request.user_id or None
-            cookie = request.cookie or None
             cart = await svc.get_active(company_id=request.company_id, user_id=user_id, cookie=cookie)
             if not cart:
                 await context.abort(grpc.StatusCode.NOT_FOUND, "not found")
-            serialized = await svc.serialize(cart)  # type: ignore[arg-type]
-            return cart_pb2.CartResponse(cart=serialize_cart_message(serialized))
+            return cart_response(cart)  # type: ignore[arg-type]
+
+    async def GetActiveCartSummary(self, request: cart_pb2.GetActiveCartRequest, context: grpc.aio.ServicerContext) -> cart_pb2.CartSummaryResponse:  # type: ignore
+        user_id = request.user_id or None
+        cookie = request.cookie or None
+        async with read_session_ctx({summary_key(request.company_id, user_id, cookie)}) as session:
+            svc = CartService(session)
+            summary = await svc.get_active_summary(company_id=request.company_id, user_id=user_id, cookie=cookie)
+            if not summary:
+                await context.abort(grpc.StatusCode.NOT_FOUND, "not found")
+            return cart_pb2.CartSummaryResponse(summary=cart_pb2.CartSummary(**summary))  # type: ignore[arg-type]
 
     async def ListByUser(self, request: cart_pb2.ListByUserRequest, context: grpc.aio.ServicerContext) -> cart_pb2.CartList:  # type: ignore
-        async with session_ctx() as session:
+        async with read_session_ctx({user_key(request.user_id)}) as session:
             svc = CartService(session)
             company_id = request.company_id or None
             status_filter = request.status or None
-            carts = await svc.list_by_user(request.user_id, company_id, status_filter, request.limit or 50, request.offset or 0)
-            cart_msgs = [serialize_cart_message(await svc.serialize(c)) for c in carts]
-            return cart_pb2.CartList(carts=cart_msgs)
+            try:
+                carts, next_cursor = await svc.list_by_user(
+                    request.user_id,
+                    company_id,
+                    status_filter,
+                    request.limit or 50,
+                    request.offset or 0,
+                    request.cursor or None,
+                )
+            except ValueError as exc:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(exc))
+            return cart_list(carts, next_cursor)
 
     async def ListByIds(self, request: cart_pb2.ListByIdsRequest, context: grpc.aio.ServicerContext) -> cart_pb2.CartList:  # type: ignore
-        async with session_ctx() as session:
+        async with read_session_ctx({cart_key(i) for i in request.ids}) as session:
             svc = CartService(session)
-            carts = await svc.list_by_ids(list(request.ids))
-            cart_msgs = [serialize_cart_message(await svc.serialize(c)) for c in carts]
-            return cart_pb2.CartList(carts=cart_msgs)
+            try:
+                carts = await svc.list_by_ids(list(request.ids))
+            except ValueError as exc:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(exc))
+            return cart_list(carts)
 
+    # Server streaming: rows come from a server-side cursor and each Cart is
+    # yielded once the previous one was written, so a slow reader pauses the
+    # cursor (HTTP/2 flow control) instead of piling up messages in memory.
 
-async def serve_grpc(port: int) -> None:
-    server = grpc.aio.server()
+    async def StreamByUser(self, request: cart_pb2.ListByUserRequest, context: grpc.aio.ServicerContext):  # type: ignore
+        """
+        ListByUser without pages: all of the user's carts (or the first
+        `limit`), newest first. A stream cut at STREAM_MAX_SECONDS carries the
+        cursor to continue from in its x-next-cursor trailing metadata.
+        """
+        async with read_session_ctx({user_key(request.user_id)}) as session:
+            svc = CartService(session)
+            try:
+                carts = svc.stream_by_user(
+                    request.user_id,
+                    request.company_id or None,
+                    request.status or None,
+                    request.limit or None,
+                    request.cursor or None,
+                )
+            except ValueError as exc:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(exc))
+            last = await write_carts(context, carts)
+            if context.code() == grpc.StatusCode.DEADLINE_EXCEEDED:
+                # Cut at STREAM_MAX_SECONDS: resume after the last cart sent, or where this stream started
+                cursor = encode_cursor(last["id"]) if last else request.cursor
+                context.set_trailing_metadata((("x-next-cursor", cursor),))
+
+    async def StreamByIds(self, request: cart_pb2.ListByIdsRequest, context: grpc.aio.ServicerContext):  # type: ignore
+        """ListByIds for up to STREAM_BY_IDS_MAX ids."""
+        async with read_session_ctx({cart_key(i) for i in request.ids}) as session:
+            svc = CartService(session)
+            try:
+                carts = svc.stream_by_ids(list(request.ids))
+            except ValueError as exc:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(exc))
+            await write_carts(context, carts)
+
+
+COMPRESSION = {
+    "none": grpc.Compression.NoCompression,
+    "gzip": grpc.Compression.Gzip,
+    "deflate": grpc.Compression.Deflate,
+}
+
+
+def server_options() -> list[tuple[str, int]]:
+    """
+    Channel arguments for the server, from the GRPC_* settings.
+
+    SO_REUSEPORT lets several worker processes bind the same port, with the
+    kernel spreading connections between them.
+    """
+    def ms(seconds: float) -> int:
+        return int(seconds * 1000)
+
+    options = [
+        ("grpc.so_reuseport", 1),
+        ("grpc.keepalive_time_ms", ms(settings.grpc_keepalive_time)),
+        ("grpc.keepalive_timeout_ms", ms(settings.grpc_keepalive_timeout)),
+        ("grpc.keepalive_permit_without_calls", 1),
+        # Clients pinging more often than this get GOAWAY (too_many_pings)
+        ("grpc.http2.min_ping_interval_without_data_ms", ms(settings.grpc_min_ping_interval)),
+        ("grpc.max_receive_message_length", settings.grpc_max_receive_message_bytes),
+        ("grpc.max_send_message_length", settings.grpc_max_send_message_bytes),
+    ]
+    if settings.grpc_max_connection_idle > 0:
+        options.append(("grpc.max_connection_idle_ms", ms(settings.grpc_max_connection_idle)))
+    if settings.grpc_max_connection_age > 0:
+        options.append(("grpc.max_connection_age_ms", ms(settings.grpc_max_connection_age)))
+        options.append(("grpc.max_connection_age_grace_ms", ms(settings.grpc_max_connection_age_grace)))
+    return options
+
+
+async def start_grpc(port: int) -> grpc.aio.Server:
+    """Start the CartService server on `port`; stop it with `await server.stop(grace)`."""
+    if settings.grpc_compression not in COMPRESSION:
+        raise ValueError(f"GRPC_COMPRESSION must be one of {', '.join(COMPRESSION)}")
+    server = grpc.aio.server(
+        # Shedding inside instrumentation, so rejections show up in metrics and logs
+        interceptors=[
+            InstrumentationInterceptor(),
+            LoadSheddingInterceptor(settings.grpc_max_concurrent_rpcs, saturated=pool_saturated),
+        ],
+        options=server_options(),
+        compression=COMPRESSION[settings.grpc_compression],
+    )
     cart_pb2_grpc.add_CartServiceServicer_to_server(CartServiceImpl(), server)
     server.add_insecure_port(f"0.0.0.0:{port}")
     await server.start()
-    await server.wait_for_termination()
+    return server
 
 
+async def serve_grpc(port: int) -> None:
+    server = await start_grpc(port)
+    await server.wait_for_termination()
@@ -0,0 +1,150 @@
+"""
+Per-request SQL statement tracking.
+
+Every statement an Engine sends is recorded, with its duration and the rows it
+returned, into the tracker of the current context, so a request (or a test)
+can see how many round trips it made and how long it spent in the database:
+
+    with track_statements() as stats:
+        ...
+    assert len(stats.statements) <= 3
+
+REST responses and gRPC trailing metadata report the totals (see `headers`),
+and `log_request` writes them to the `app.requests` log, with the statements
+themselves when a request is slower than SLOW_REQUEST_MS.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .settings import settings
+
+log = logging.getLogger("app.requests")
+
+
+@dataclass
+class StatementStats:
+    statements: list[str] = field(default_factory=list)
+    # Seconds per statement, in the order of `statements`
+    durations: list[float] = field(default_factory=list)
+    # Rows returned by SELECT / RETURNING, summed over statements
+    rows: int = 0
+    # BEGIN / COMMIT / ROLLBACK, each a round trip of its own
+    transactions: list[str] = field(default_factory=list)
+
+    @property
+    def round_trips(self) -> int:
+        return len(self.statements) + len(self.transactions)
+
+    @property
+    def db_time(self) -> float:
+        return sum(self.durations)
+
+    def headers(self, elapsed: float | None = None) -> dict[str, str]:
+        """Totals as response headers (REST) or trailing metadata (gRPC, lower-cased)."""
+        timing = f"db;dur={self.db_time * 1000:.2f}"
+        if elapsed is not None:
+            timing += f", total;dur={elapsed * 1000:.2f}"
+        return {
+            "X-SQL-Statements": str(len(self.statements)),
+            "X-SQL-Round-Trips": str(self.round_trips),
+            "X-SQL-Rows": str(self.rows),
+            "Server-Timing": timing,
+        }
+
+
+_current: ContextVar[StatementStats | None] = ContextVar("sql_statement_stats", default=None)
+
+# Start times of in-flight statements, per connection
+_STARTED_KEY = "sql_statement_started"
+
+
+@contextmanager
+def track_statements() -> Iterator[StatementStats]:
+    """
+    Record statements executed in this context until exit.
+
+    Tasks spawned inside the block share the tracker, since they copy the
+    context (and with it the same StatementStats) when created.
+    """
+    stats = StatementStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def current_stats() -> StatementStats | None:
+    return _current.get()
+
+
+def log_request(kind: str, name: str, outcome: str | int, stats: StatementStats, elapsed: float) -> None:
+    """One `app.requests` record per request; statements included past SLOW_REQUEST_MS."""
+    fields = {
+        "kind": kind,
+        "name": name,
+        "outcome": outcome,
+        "duration_ms": round(elapsed * 1000, 2),
+        "db_ms": round(stats.db_time * 1000, 2),
+        "statements": len(stats.statements),
+        "round_trips": stats.round_trips,
+        "rows": stats.rows,
+    }
+    threshold = settings.slow_request_ms
+    if threshold > 0 and elapsed * 1000 >= threshold:
+        fields["sql"] = [
+            {"ms": round(duration * 1000, 2), "statement": statement}
+            for statement, duration in zip(stats.statements, stats.durations, strict=True)
+        ]
+        log.warning("slow %s %s: %s", kind, name, fields, extra={"request": fields})
+    elif log.isEnabledFor(logging.INFO):
+        log.info("%s %s: %s", kind, name, fields, extra={"request": fields})
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _record_statement(conn, cursor, statement, parameters, context, executemany) -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.statements.append(statement)
+        conn.info.setdefault(_STARTED_KEY, []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_duration(conn, cursor, statement, parameters, context, executemany) -> None:
+    stats = _current.get()
+    started = conn.info.get(_STARTED_KEY)
+    if stats is None or not started:
+        return
+    stats.durations.append(time.perf_counter() - started.pop())
+    if cursor.description is not None and cursor.rowcount > 0:
+        stats.rows += cursor.rowcount
+
+
+@event.listens_for(Engine, "handle_error")
+def _record_failure(context) -> None:
+    stats = _current.get()
+    started = context.connection.info.get(_STARTED_KEY) if context.connection is not None else None
+    if stats is not None and started:
+        stats.durations.append(time.perf_counter() - started.pop())
+
+
+def _transaction_listener(name: str):
+    def record(conn) -> None:
+        stats = _current.get()
+        if stats is not None:
+            stats.transactions.append(name)
+
+    return record
+
+
+for _name in ("begin", "commit", "rollback"):
+    event.listen(Engine, _name, _transaction_listener(_name.upper()))
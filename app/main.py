@@ -1,23 +1,29 @@
 from __future__ import annotations
 
-import asyncio
 import logging
 from concurrent import futures
 
 import grpc
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 
+from app.cache import cart_cache
+from app.cache_listener import start_cache_listener
 from app.db import init_engines
+from app.metrics import CONTENT_TYPE, registry, start_metrics_writer
+from app.reaper import start_reaper
+from app.replicas import start_replica_monitor
 from app.settings import settings
+from app.api.middleware import InstrumentationMiddleware
 from app.api.v1.routes_read import router as read_router
 from app.api.v1.routes_write import router as write_router
-from app.grpc.server import serve_grpc
+from app.grpc.server import start_grpc
 
 
 log = logging.getLogger(__name__)
 
 
 app = FastAPI(title="Sellio Cart", version="0.1.0")
+app.add_middleware(InstrumentationMiddleware)
 app.include_router(read_router)
 app.include_router(write_router)
 
@@ -25,9 +31,24 @@ app.include_router(write_router)
 @app.on_event("startup")
 async def on_startup() -> None:
     init_engines()
-    # Start gRPC server in background
-    asyncio.get_event_loop().create_task(serve_grpc(settings.grpc_port))
-    log.info("gRPC server started on port %s", settings.grpc_port)
+    app.state.cache_listener = start_cache_listener()
+    app.state.reaper = start_reaper()
+    app.state.replica_monitor = start_replica_monitor()
+    app.state.metrics_writer = start_metrics_writer()
+    # Embedded gRPC server on this loop; `python -m app.serve` runs it in separate workers instead
+    if settings.grpc_embedded:
+        app.state.grpc = await start_grpc(settings.grpc_port)
+        log.info("gRPC server started on port %s", settings.grpc_port)
+
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    server = getattr(app.state, "grpc", None)
+    if server is not None:
+        await server.stop(settings.grpc_shutdown_grace)
+    writer = getattr(app.state, "metrics_writer", None)
+    if writer is not None:
+        writer.cancel()
 
 
 @app.get("/")
@@ -40,3 +61,11 @@ async def healthz():
     return {"status": "ok"}
 
 
+@app.get("/cache/stats")
+async def cache_stats():
+    return cart_cache.stats()
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(registry.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,320 @@
+"""
+Minimal Prometheus metrics registry and text exposition (format 0.0.4).
+
+Recording is a dict lookup plus a few integer/float updates, cheap enough
+for every request. Pool and cache gauges are not recorded at all: they are
+read from their sources when /metrics is scraped (see `collectors`).
+
+With several worker processes (app.serve), each one periodically writes its
+samples to METRICS_DIR under a `worker` label, and whichever process is
+scraped serves all of them (see `Registry.share`).
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import os
+import time
+from bisect import bisect_left
+from collections.abc import Callable, Iterable
+
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.settings import settings
+
+# Seconds; covers cache hits (~100us) up to slow multi-statement writes
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable, *extra: str) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values, strict=True)]
+    pairs += [pair for pair in extra if pair]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self, extra: str = "") -> list[str]:
+        """Exposition lines; `extra` is a preformatted label pair added to each."""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, value: float, *labels) -> None:
+        """For collectors mirroring a counter kept elsewhere."""
+        self._values[labels] = value
+
+    def samples(self, extra: str = "") -> list[str]:
+        return [f"{self.name}{_labels(self.labels, k, extra)} {_number(v)}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value: float, *labels) -> None:
+        self._values[labels] = value
+
+    def samples(self, extra: str = "") -> list[str]:
+        return [f"{self.name}{_labels(self.labels, k, extra)} {_number(v)}" for k, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last is +Inf), sum]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self, extra: str = "") -> list[str]:
+        lines = []
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts, strict=True):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, extra, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key, extra)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key, extra)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        # Called on scrape, before rendering; they refresh gauges from their sources
+        self.collectors: list[Callable[[], None]] = []
+        # Set by `share`: directory of every worker's samples, this worker's label value
+        self.directory = ""
+        self.worker = ""
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def share(self, directory: str, worker: str) -> None:
+        """
+        Label this process's samples `worker` and serve other workers' from
+        `directory` as well, where `dump` leaves each process's latest samples.
+        """
+        self.directory, self.worker = directory, worker
+
+    def _samples(self) -> dict[str, list[str]]:
+        for collect in self.collectors:
+            collect()
+        extra = f'worker="{_escape(self.worker)}"' if self.worker else ""
+        return {metric.name: metric.samples(extra) for metric in self._metrics}
+
+    def _path(self, worker: str) -> str:
+        return os.path.join(self.directory, f"{worker}.json")
+
+    def dump(self) -> None:
+        """Write this worker's samples for the others to serve (atomically)."""
+        tmp = self._path(self.worker) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._samples(), f)
+        os.replace(tmp, self._path(self.worker))
+
+    def discard(self) -> None:
+        try:
+            os.remove(self._path(self.worker))
+        except FileNotFoundError:
+            pass
+
+    def _others(self, max_age: float) -> list[dict[str, list[str]]]:
+        """Latest samples of the other workers; files of exited ones go stale and are skipped."""
+        others = []
+        now = time.time()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json") or entry.name == f"{self.worker}.json":
+                    continue
+                try:
+                    if now - entry.stat().st_mtime > max_age:
+                        continue
+                    with open(entry.path, encoding="utf-8") as f:
+                        others.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return others
+
+    def render(self) -> str:
+        samples = self._samples()
+        others = self._others(3 * settings.metrics_flush_interval) if self.directory else []
+        lines = []
+        for metric in self._metrics:
+            lines += metric.header()
+            lines += samples[metric.name]
+            for other in others:
+                lines += other.get(metric.name, [])
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+http_requests = registry.register(
+    Counter("http_requests_total", "REST requests by route and status code.", ("method", "route", "status"))
+)
+http_duration = registry.register(
+    Histogram("http_request_duration_seconds", "REST request latency.", ("method", "route"))
+)
+http_in_flight = registry.register(Gauge("http_requests_in_flight", "REST requests being served."))
+
+grpc_handled = registry.register(
+    Counter("grpc_server_handled_total", "Completed RPCs by method and status code.", ("grpc_method", "grpc_code"))
+)
+grpc_duration = registry.register(
+    Histogram("grpc_server_handling_seconds", "RPC latency.", ("grpc_method",))
+)
+grpc_in_flight = registry.register(Gauge("grpc_server_in_flight", "RPCs being served."))
+
+db_pool = registry.register(
+    Gauge("db_pool_connections", "Connections of each SQLAlchemy pool by state.", ("engine", "state"))
+)
+db_pool_acquire = registry.register(
+    Histogram("db_pool_acquire_seconds", "Time to get a connection from the pool, including connecting.")
+)
+db_reads = registry.register(
+    Counter("db_read_sessions_total", "Read-only sessions by database and routing reason.", ("target", "reason"))
+)
+replica_lag = registry.register(
+    Gauge("db_replica_lag_seconds", "Replication lag per read replica; -1 while unknown or unreachable.", ("replica",))
+)
+
+cache_ops = registry.register(Counter("cart_cache_operations_total", "Cart cache lookups and removals by outcome.", ("op",)))
+cache_size = registry.register(Gauge("cart_cache_entries", "Cart cache entries."))
+
+
+class TimedPool(AsyncAdaptedQueuePool):
+    """Queue pool recording how long each checkout waited (db_pool_acquire_seconds)."""
+
+    def saturated(self) -> bool:
+        """No idle connection and no room to open one: a checkout would wait up to DB_POOL_TIMEOUT."""
+        return self.checkedin() == 0 and -1 < self._max_overflow <= self.overflow()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_acquire.observe(time.perf_counter() - started)
+
+
+def _collect_pool() -> None:
+    from app import db
+    from app.replicas import replica_router
+
+    # The primary is labelled "primary", replicas by host, as in db_replica_lag_seconds
+    engines = [("primary", db.engine), *zip(replica_router.names, replica_router.engines, strict=True)]
+    # Engines can be disposed and replaced (tests, reconfiguration): drop stale series
+    db_pool._values.clear()
+    for name, engine in engines:
+        pool = engine.pool if engine is not None else None
+        if not isinstance(pool, AsyncAdaptedQueuePool):
+            continue
+        db_pool.set(pool.size(), name, "size")
+        db_pool.set(pool.checkedout(), name, "checked_out")
+        db_pool.set(pool.checkedin(), name, "idle")
+        # Negative while the pool has not opened `size` connections yet
+        db_pool.set(max(pool.overflow(), 0), name, "overflow")
+
+
+def _collect_cache() -> None:
+    from app.cache import cart_cache
+
+    stats = cart_cache.stats()
+    cache_size.set(stats["size"])
+    for op in ("hits", "misses", "evictions", "invalidations"):
+        cache_ops.set(stats[op], op)
+
+
+registry.collectors += [_collect_pool, _collect_cache]
+
+
+async def run_metrics_writer(interval: float) -> None:
+    try:
+        while True:
+            registry.dump()
+            await asyncio.sleep(interval)
+    finally:
+        registry.discard()
+
+
+def start_metrics_writer() -> asyncio.Task | None:
+    """Share this process's metrics through METRICS_DIR; no-op when it is not set."""
+    if not settings.metrics_dir:
+        return None
+    registry.share(settings.metrics_dir, str(os.getpid()))
+    return asyncio.get_running_loop().create_task(run_metrics_writer(settings.metrics_flush_interval))
+
+
+async def start_metrics_server(port: int) -> asyncio.Server:
+    """
+    Bare `GET /metrics` listener for processes without an HTTP app (gRPC
+    workers). Several workers can bind `port`: each serves all of them.
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = (await reader.readline()).split()
+            while (await reader.readline()).strip():
+                pass
+            if request[:2] == [b"GET", b"/metrics"]:
+                status, content_type, body = "200 OK", CONTENT_TYPE, registry.render().encode()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", b"not found\n"
+            head = f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+            writer.write(head.encode() + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "0.0.0.0", port, reuse_port=True)
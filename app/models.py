@@ -9,12 +9,16 @@ from sqlalchemy import BigInteger
 from sqlalchemy import CheckConstraint
 from sqlalchemy import DateTime
 from sqlalchemy import Enum as SAEnum
+from sqlalchemy import FetchedValue
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
 from sqlalchemy import Integer
 from sqlalchemy import Numeric
 from sqlalchemy import SmallInteger
 from sqlalchemy import String
 from sqlalchemy import func
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -38,6 +42,14 @@ class Cart(Base):
     cookie: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     status: Mapped[int] = mapped_column(SmallInteger, nullable=False, default=CartStatus.ACTIVE.value)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    # Bumped by the trg_cart_touch trigger on every UPDATE, including item-total changes
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    # Maintained by the trg_cart_item_totals trigger on cart_item; never written by the app
+    item_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default=text("0"))
+    total_quantity: Mapped[int] = mapped_column(BigInteger, nullable=False, server_default=text("0"))
+    total_amount: Mapped[Decimal] = mapped_column(Numeric(20, 2), nullable=False, server_default=text("0"))
+    # total_amount in minor units (cents), summed as integers
+    total_amount_minor: Mapped[int] = mapped_column(BigInteger, nullable=False, server_default=text("0"))
 
     items: Mapped[List["CartItem"]] = relationship(
         back_populates="cart",
@@ -45,21 +57,101 @@ class Cart(Base):
         lazy="selectin",
     )
 
+    __table_args__ = (
+        Index(
+            "uq_cart_company_user_active",
+            "company_id",
+            "user_id",
+            unique=True,
+            postgresql_where=text("status = 1 AND user_id IS NOT NULL"),
+        ),
+        Index(
+            "uq_cart_company_cookie_active",
+            "company_id",
+            "cookie",
+            unique=True,
+            postgresql_where=text("status = 1 AND cookie IS NOT NULL"),
+        ),
+        Index("ix_cart_user_id_id", "user_id", id.desc(), postgresql_where=text("user_id IS NOT NULL")),
+        Index(
+            "ix_cart_user_company_status_id",
+            "user_id",
+            "company_id",
+            "status",
+            id.desc(),
+            postgresql_where=text("user_id IS NOT NULL"),
+        ),
+        # Reaper scans (see app.reaper)
+        Index("ix_cart_empty_created_id", "created_at", "id", postgresql_where=text("item_count = 0")),
+        Index(
+            "ix_cart_anon_active_updated_id",
+            "updated_at",
+            "id",
+            postgresql_where=text("status = 1 AND user_id IS NULL"),
+        ),
+        Index("ix_cart_closed_updated_id", "updated_at", "id", postgresql_where=text("status IN (3, 4)")),
+    )
+
 
 class CartItem(Base):
     __tablename__ = "cart_item"
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
-    cart_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("cart.id", ondelete="CASCADE"), nullable=False, index=True)
+    cart_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("cart.id", ondelete="CASCADE"), nullable=False)
     product_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
     name: Mapped[str] = mapped_column(String(255), nullable=False)
-    price: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False)
+    # Either one may be written; trg_cart_item_price derives the other (migration 0006)
+    price: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False, server_default=FetchedValue())
+    price_minor: Mapped[int] = mapped_column(BigInteger, nullable=False, server_default=FetchedValue())
     quantity: Mapped[int] = mapped_column(Integer, nullable=False)
 
     __table_args__ = (
         CheckConstraint("quantity > 0", name="ck_cart_item_quantity_positive"),
+        # Also serves every cart_id lookup, so no separate cart_id index
+        Index("uq_cart_item_cart_product", "cart_id", "product_id", unique=True),
+        Index("ix_cart_item_product_id", "product_id"),
     )
 
     cart: Mapped[Cart] = relationship(back_populates="items")
 
 
+# Statuses whose carts are moved to cart_archive once closed for REAPER_CLOSED_TTL
+ARCHIVED_STATUSES = (CartStatus.CHECKED_OUT.value, CartStatus.CANCELLED.value)
+
+
+class CartArchive(Base):
+    """
+    Cold copy of a cart (items as JSONB) removed from the hot tables by the reaper.
+
+    LIST-partitioned by status: cart_archive_checked_out, cart_archive_cancelled
+    and cart_archive_other (reaped empty/anonymous carts), see migration 0005.
+    """
+
+    __tablename__ = "cart_archive"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    user_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    company_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    cookie: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # Partition key, hence part of the primary key
+    status: Mapped[int] = mapped_column(SmallInteger, primary_key=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    item_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    total_amount: Mapped[Decimal] = mapped_column(Numeric(20, 2), nullable=False)
+    items: Mapped[list] = mapped_column(JSONB, nullable=False)
+    reason: Mapped[str] = mapped_column(String(32), nullable=False)
+    archived_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_cart_archive_user_id_id", "user_id", id.desc(), postgresql_where=text("user_id IS NOT NULL")),
+        Index(
+            "ix_cart_archive_user_company_status_id",
+            "user_id",
+            "company_id",
+            "status",
+            id.desc(),
+            postgresql_where=text("user_id IS NOT NULL"),
+        ),
+        {"postgresql_partition_by": "LIST (status)"},
+    )
@@ -0,0 +1,124 @@
+"""
+Empty and abandoned cart reaper.
+
+Removes carts that never received items (or lost them all) and ACTIVE
+anonymous carts nobody touched for a while, and moves closed (CHECKED_OUT /
+CANCELLED) carts to the partitioned cart_archive, in small keyset-ordered
+batches, one short transaction each. Runs embedded in the app (REAPER_INTERVAL) or as
+a one-shot CLI for the Helm CronJob:
+
+    python -m app.reaper [--archive] [--batch-size N] [--max-batches N]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+from datetime import UTC, datetime, timedelta
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache import cart_keys, invalidate_on_commit
+from app.db import session_ctx
+from app.repositories.cart_repo import REAP_KINDS, CartRepository
+from app.settings import settings
+
+log = logging.getLogger(__name__)
+
+
+class CartReaper:
+    def __init__(
+        self,
+        session: AsyncSession,
+        ttls: dict[str, float] | None = None,
+        batch_size: int | None = None,
+        max_batches: int | None = None,
+        pause: float | None = None,
+        archive: bool | None = None,
+    ):
+        self.session = session
+        self.carts = CartRepository(session)
+        self.ttls = ttls if ttls is not None else {
+            "empty": settings.reaper_empty_ttl,
+            "anonymous": settings.reaper_anonymous_ttl,
+            "closed": settings.reaper_closed_ttl,
+        }
+        self.batch_size = batch_size or settings.reaper_batch_size
+        self.max_batches = max_batches or settings.reaper_max_batches
+        self.pause = settings.reaper_batch_pause if pause is None else pause
+        self.archive = settings.reaper_archive if archive is None else archive
+
+    async def run_once(self) -> dict:
+        """
+        Reap every kind once and report rows reclaimed per kind.
+
+        The session must not be inside a transaction. A run stops early after
+        `max_batches` batches; the rest is picked up by the next run.
+        """
+        report = {"archive": self.archive, "batches": 0, **{kind: 0 for kind in REAP_KINDS}}
+        now = datetime.now(UTC)
+        for kind in REAP_KINDS:
+            ttl = self.ttls.get(kind, 0)
+            if ttl <= 0:
+                continue
+            cutoff = now - timedelta(seconds=ttl)
+            # Closed carts are order history: always moved to cold storage, never dropped
+            archive = self.archive or kind == "closed"
+            after = None
+            while report["batches"] < self.max_batches:
+                async with self.session.begin():
+                    rows = await self.carts.reap_batch(kind, cutoff, after, self.batch_size, archive)
+                    if rows:
+                        keys = set()
+                        for _, cart_id, company_id, user_id, cookie in rows:
+                            keys |= cart_keys(cart_id, company_id, user_id, cookie)
+                        await invalidate_on_commit(self.session, keys)
+                report["batches"] += 1
+                report[kind] += len(rows)
+                # SKIP LOCKED keeps filling the LIMIT, so a short batch means nothing is left
+                if len(rows) < self.batch_size:
+                    break
+                after = max((age, cart_id) for age, cart_id, *_ in rows)
+                if self.pause:
+                    await asyncio.sleep(self.pause)
+        log.info("Cart reaper run: %s", report)
+        return report
+
+
+async def reap_once(**options) -> dict:
+    async with session_ctx() as session:
+        return await CartReaper(session, **options).run_once()
+
+
+async def run_forever(interval: float) -> None:
+    while True:
+        try:
+            await reap_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("Cart reaper run failed")
+        await asyncio.sleep(interval)
+
+
+def start_reaper() -> asyncio.Task | None:
+    """Start the embedded reaper on the running loop; no-op unless REAPER_INTERVAL > 0."""
+    if settings.reaper_interval <= 0 or not settings.database_url:
+        return None
+    return asyncio.get_running_loop().create_task(run_forever(settings.reaper_interval))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Delete empty and abandoned anonymous carts, archive closed ones")
+    parser.add_argument("--archive", action="store_true", default=None, help="copy carts to cart_archive before deleting")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--max-batches", type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    report = asyncio.run(reap_once(archive=args.archive, batch_size=args.batch_size, max_batches=args.max_batches))
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Read-replica routing for the read-only REST routes and RPCs.
+
+`db.read_session_ctx(keys)` binds the session to a replica unless:
+- no replica is known to lag less than REPLICA_MAX_LAG (lag is polled by
+  `start_replica_monitor`, and unknown lag counts as too much), or
+- one of `keys` (the cache keys of `app.cache`) was written within the
+  sticky window, so the caller reads its own writes.
+
+Written keys are the ones writes already invalidate: this process marks them
+when the transaction commits, other processes when the NOTIFY reaches
+their cache listener. The sticky window is at least REPLICA_MAX_LAG, so a
+replica that is let through has replayed anything older than the window.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections.abc import Hashable, Iterable
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .metrics import db_reads, registry, replica_lag
+from .settings import settings
+
+log = logging.getLogger(__name__)
+
+# Seconds since the last replayed transaction, or 0 when the replica has
+# replayed everything it received (an idle primary writes no transactions)
+LAG_SQL = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+    """
+)
+
+
+def replica_urls() -> list[str]:
+    return [url.strip() for url in settings.database_replica_urls.split(",") if url.strip()]
+
+
+class ReplicaRouter:
+    """Replica engines with their last measured lag, and recently written keys."""
+
+    def __init__(self, sticky_seconds: float, max_lag: float):
+        self.engines: list[AsyncEngine] = []
+        self.names: list[str] = []
+        # Seconds per replica; None until measured or while unreachable
+        self.lags: list[float | None] = []
+        self.sticky_seconds = sticky_seconds
+        self.max_lag = max_lag
+        self._written: dict[Hashable, float] = {}
+        self._all_written = 0.0
+        self._next = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.engines)
+
+    @property
+    def window(self) -> float:
+        return max(self.sticky_seconds, self.max_lag)
+
+    def set_engines(self, engines: list[AsyncEngine]) -> None:
+        self.engines = engines
+        self.names = [make_url(e.url).host or str(i) for i, e in enumerate(engines)]
+        self.lags = [None] * len(engines)
+        self._next = 0
+
+    def mark_written(self, keys: Iterable[Hashable]) -> None:
+        if not self.enabled:
+            return
+        until = time.monotonic() + self.window
+        for key in keys:
+            self._written[key] = until
+
+    def mark_all_written(self) -> None:
+        """Bulk writes, or notifications possibly missed: every read goes to the primary for a window."""
+        if self.enabled:
+            self._all_written = time.monotonic() + self.window
+
+    def is_sticky(self, keys: Iterable[Hashable]) -> bool:
+        now = time.monotonic()
+        if self._all_written > now:
+            return True
+        return any(self._written.get(key, 0.0) > now for key in keys)
+
+    def pick(self, keys: Iterable[Hashable] = ()) -> AsyncEngine | None:
+        """A replica engine to read `keys` from, round robin; None means the primary."""
+        if not self.enabled:
+            return None
+        if self.is_sticky(keys):
+            db_reads.inc("primary", "sticky")
+            return None
+        for _ in range(len(self.engines)):
+            i = self._next
+            self._next = (i + 1) % len(self.engines)
+            lag = self.lags[i]
+            if lag is not None and lag <= self.max_lag:
+                db_reads.inc("replica", "ok")
+                return self.engines[i]
+        db_reads.inc("primary", "lag")
+        return None
+
+    async def check_lag(self) -> None:
+        for i, engine in enumerate(self.engines):
+            try:
+                async with engine.connect() as conn:
+                    self.lags[i] = float(await conn.scalar(LAG_SQL))
+            except Exception as exc:
+                if self.lags[i] is not None:
+                    log.warning("Replica %s unavailable, reading from the primary: %s", self.names[i], exc)
+                self.lags[i] = None
+        # Expired marks would otherwise pile up for every cart ever written
+        now = time.monotonic()
+        self._written = {key: until for key, until in self._written.items() if until > now}
+
+    async def run_lag_monitor(self, interval: float) -> None:
+        while True:
+            await self.check_lag()
+            await asyncio.sleep(interval)
+
+
+replica_router = ReplicaRouter(settings.replica_sticky_seconds, settings.replica_max_lag)
+
+
+def _collect_lag() -> None:
+    for name, lag in zip(replica_router.names, replica_router.lags, strict=True):
+        # -1 while unknown or unreachable
+        replica_lag.set(-1 if lag is None else lag, name)
+
+
+registry.collectors.append(_collect_lag)
+
+
+def start_replica_monitor() -> asyncio.Task | None:
+    """Poll replica lag on the running loop; no-op without replicas."""
+    if not replica_router.enabled:
+        return None
+    return asyncio.get_running_loop().create_task(replica_router.run_lag_monitor(settings.replica_lag_check_interval))
@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+from collections.abc import AsyncIterator
+
+from sqlalchemy import (
+    BigInteger,
+    Select,
+    Text,
+    and_,
+    bindparam,
+    cast,
+    exists,
+    func,
+    literal,
+    literal_column,
+    select,
+    true,
+    union_all,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, JSON, aggregate_order_by
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import ARCHIVED_STATUSES, Cart, CartArchive, CartItem, CartStatus
+
+
+def _items_lateral():
+    """Per-cart LATERAL aggregate of items as a JSON array."""
+    item = func.json_build_object(
+        "product_id", CartItem.product_id,
+        "name", CartItem.name,
+        "price", cast(CartItem.price, Text),
+        "price_minor", CartItem.price_minor,
+        "quantity", CartItem.quantity,
+    )
+    return (
+        select(
+            func.coalesce(
+                func.json_agg(aggregate_order_by(item, CartItem.id)),
+                literal_column("'[]'::json"),
+                type_=JSON,
+            ).label("items"),
+        )
+        .where(CartItem.cart_id == Cart.id)
+        .lateral("agg")
+    )
+
+
+def cart_view_select() -> Select:
+    """
+    Non-empty cart with its items in one statement.
+
+    Rows already have the `CartOut` shape, so they can be returned from REST
+    routes or mapped to `cart_pb2.Cart` without building ORM objects. Carts
+    without items are filtered out in SQL, so LIMIT applies to visible carts.
+    """
+    agg = _items_lateral()
+    return (
+        select(
+            Cart.id,
+            Cart.company_id,
+            Cart.user_id,
+            Cart.cookie,
+            Cart.status,
+            Cart.created_at,
+            agg.c["items"],
+            cast(Cart.total_amount, Text).label("total_amount"),
+            Cart.total_amount_minor,
+        )
+        .select_from(Cart)
+        .join(agg, true())
+        .where(Cart.item_count > 0)
+    )
+
+
+def archive_view_select() -> Select:
+    """
+    Same row shape as `cart_view_select`, read from cart_archive.
+
+    Archived totals are not summed again, so the minor-unit total is derived
+    from the (exact, two-place) total_amount.
+    """
+    return select(
+        CartArchive.id,
+        CartArchive.company_id,
+        CartArchive.user_id,
+        CartArchive.cookie,
+        CartArchive.status,
+        CartArchive.created_at,
+        cast(CartArchive.items, JSON).label("items"),
+        cast(CartArchive.total_amount, Text).label("total_amount"),
+        cast(CartArchive.total_amount * 100, BigInteger).label("total_amount_minor"),
+    ).where(CartArchive.item_count > 0)
+
+
+def _active_condition(company_id: int, user_id: int | None, cookie: str | None):
+    # Status is inlined so generic plans can still match the partial unique indexes
+    conditions = [Cart.company_id == company_id, Cart.status == literal(CartStatus.ACTIVE.value, literal_execute=True)]
+    if user_id:
+        conditions.append(Cart.user_id == user_id)
+    else:
+        conditions.append(Cart.cookie == cookie)
+    return and_(*conditions)
+
+
+class CartReadRepository:
+    """Read-only cart queries returning plain dicts instead of ORM identities."""
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def _fetch(self, stmt: Select) -> list[dict]:
+        res = await self.session.execute(stmt)
+        return [dict(row) for row in res.mappings()]
+
+    async def get_by_id(self, cart_id: int) -> dict | None:
+        """Hot table first, then the archive (closed carts moved by the reaper)."""
+        rows = await self._fetch(cart_view_select().where(Cart.id == cart_id))
+        if not rows:
+            rows = await self._fetch(archive_view_select().where(CartArchive.id == cart_id))
+        return rows[0] if rows else None
+
+    async def _stream(self, stmt: Select, yield_per: int) -> AsyncIterator[dict]:
+        """
+        Rows of `stmt` through a server-side cursor, `yield_per` at a time.
+
+        The cursor needs a transaction, which stays open until the iteration
+        ends; a consumer that stops reading pauses the cursor.
+        """
+        res = await self.session.stream(stmt.execution_options(yield_per=yield_per))
+        async for partition in res.mappings().partitions():
+            for row in partition:
+                yield dict(row)
+
+    def _by_ids_select(self, ids: list[int]) -> Select:
+        """
+        Carts of `ids` in request order, hot table first, then the archive for
+        ids not found there.
+
+        The ids are bound as a single array and unnested WITH ORDINALITY, so
+        the statement text (and its prepared plan) is the same for any number
+        of ids, and Postgres does the ordering.
+        """
+        req = (
+            select(
+                func.unnest(bindparam("ids", ids, type_=ARRAY(BigInteger)))
+                .table_valued("id", with_ordinality="ord")
+                .render_derived(name="r")
+            )
+            .cte("req")
+        )
+        hot = cart_view_select().join(req, req.c.id == Cart.id).add_columns(req.c.ord).cte("hot")
+        cold = (
+            archive_view_select()
+            .join(req, req.c.id == CartArchive.id)
+            .add_columns(req.c.ord)
+            .where(~exists().where(hot.c.id == req.c.id))
+        )
+        carts = union_all(select(hot), cold).subquery("carts")
+        return select(*(c for c in carts.c if c.key != "ord")).order_by(carts.c.ord)
+
+    async def list_by_ids_ordered(self, ids: list[int]) -> list[dict]:
+        """See `_by_ids_select`; one statement. `ids` must not repeat an id."""
+        if not ids:
+            return []
+        return await self._fetch(self._by_ids_select(ids))
+
+    async def stream_by_ids(self, ids: list[int], yield_per: int) -> AsyncIterator[dict]:
+        """`list_by_ids_ordered` through a server-side cursor (see `_stream`)."""
+        if ids:
+            async for cart in self._stream(self._by_ids_select(ids), yield_per):
+                yield cart
+
+    def _by_user_select(
+        self, user_id: int, company_id: int | None, status: int | None, after_id: int | None, window: int | None
+    ) -> Select:
+        """
+        The user's carts newest first, keyset-filtered to id < `after_id`.
+
+        Closed carts may live in cart_archive, so unless `status` rules it out
+        the archive is merged in. Its status is inlined, letting the planner
+        prune to the matching partition(s). With `window`, each side only
+        reads its first `window` rows.
+        """
+        def conditions(table) -> list:
+            conds = [table.user_id == user_id]
+            if company_id and company_id > 0:
+                conds.append(table.company_id == company_id)
+            if after_id is not None:
+                conds.append(table.id < after_id)
+            return conds
+
+        hot = conditions(Cart)
+        if status and status > 0:
+            hot.append(Cart.status == status)
+        stmt = cart_view_select().where(and_(*hot)).order_by(Cart.id.desc())
+        if status and status > 0 and status not in ARCHIVED_STATUSES:
+            return stmt
+
+        cold = conditions(CartArchive)
+        if status and status > 0:
+            cold.append(CartArchive.status == literal(status, literal_execute=True))
+        else:
+            cold.append(CartArchive.status.in_(bindparam("archived", ARCHIVED_STATUSES, expanding=True, literal_execute=True)))
+        archived = archive_view_select().where(and_(*cold)).order_by(CartArchive.id.desc())
+        if window is not None:
+            stmt, archived = stmt.limit(window), archived.limit(window)
+        merged = union_all(stmt, archived).subquery("carts")
+        return select(merged).order_by(merged.c.id.desc())
+
+    async def list_by_user(
+        self,
+        user_id: int,
+        company_id: int | None,
+        status: int | None,
+        limit: int,
+        offset: int,
+        after_id: int | None = None,
+    ) -> list[dict]:
+        """Newest first; with `after_id` pages by keyset (id < after_id) instead of OFFSET."""
+        if after_id is not None:
+            offset = 0
+        # Each side only needs its first offset + limit rows
+        stmt = self._by_user_select(user_id, company_id, status, after_id, window=limit + offset)
+        return await self._fetch(stmt.limit(limit).offset(offset))
+
+    async def stream_by_user(
+        self,
+        user_id: int,
+        company_id: int | None,
+        status: int | None,
+        after_id: int | None,
+        limit: int | None,
+        yield_per: int,
+    ) -> AsyncIterator[dict]:
+        """
+        `list_by_user` without pages: every matching cart, or the first
+        `limit`, through a server-side cursor (see `_stream`).
+        """
+        stmt = self._by_user_select(user_id, company_id, status, after_id, window=limit)
+        if limit:
+            stmt = stmt.limit(limit)
+        async for cart in self._stream(stmt, yield_per):
+            yield cart
+
+    async def get_active(self, company_id: int, user_id: int | None, cookie: str | None) -> dict | None:
+        rows = await self._fetch(cart_view_select().where(_active_condition(company_id, user_id, cookie)).limit(1))
+        return rows[0] if rows else None
+
+    async def get_active_summary(self, company_id: int, user_id: int | None, cookie: str | None) -> dict | None:
+        """Counters of the active cart, read from the denormalized cart row only."""
+        stmt = (
+            select(
+                Cart.id,
+                Cart.status,
+                Cart.item_count,
+                cast(Cart.total_amount, Text).label("total_amount"),
+                Cart.total_amount_minor,
+            )
+            .where(_active_condition(company_id, user_id, cookie), Cart.item_count > 0)
+            .limit(1)
+        )
+        rows = await self._fetch(stmt)
+        return rows[0] if rows else None
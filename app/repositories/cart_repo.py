@@ -1,12 +1,41 @@
 from __future__ import annotations
 
+from datetime import datetime
 from typing import Iterable, Sequence
 
-from sqlalchemy import Select, and_, delete, func, or_, select, text, update
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import BigInteger, Integer, Select, String, Text, and_, any_, bindparam, cast, column, delete, exists, func, insert, literal, literal_column, or_, select, text, tuple_, update, values
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, aggregate_order_by, insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models import Cart, CartItem, CartStatus
+from app.models import ARCHIVED_STATUSES, Cart, CartArchive, CartItem, CartStatus
+
+
+REAP_KINDS = ("empty", "anonymous", "closed")
+
+# Quantity resolution when a guest cart item is already in the user's cart
+MERGE_POLICIES = ("sum", "max", "keep_user", "keep_guest")
+
+
+def _reap_target(kind: str):
+    """
+    (conditions, age column) of a reapable cart kind.
+
+    Conditions mirror the partial indexes ix_cart_empty_created_id,
+    ix_cart_anon_active_updated_id and ix_cart_closed_updated_id, with
+    constants inlined so generic plans still match them.
+    """
+    if kind == "empty":
+        return [Cart.item_count == literal(0, literal_execute=True)], Cart.created_at
+    if kind == "anonymous":
+        return [Cart.status == literal(CartStatus.ACTIVE.value, literal_execute=True), Cart.user_id.is_(None)], Cart.updated_at
+    if kind == "closed":
+        return [Cart.status.in_(bindparam("closed", ARCHIVED_STATUSES, expanding=True, literal_execute=True))], Cart.updated_at
+    raise ValueError(f"unknown reap kind {kind!r}")
+
+
+def _cart_identity(changed, *extra) -> Select:
+    """SELECT the cart's (company_id, user_id, cookie) for the `cart_id` of a DML CTE."""
+    return select(Cart.company_id, Cart.user_id, Cart.cookie, *extra).join_from(changed, Cart, Cart.id == changed.c.cart_id)
 
 
 class CartRepository:
@@ -18,28 +47,9 @@ class CartRepository:
         res = await self.session.execute(stmt)
         return res.scalar_one_or_none()
 
-    async def list_by_ids_ordered(self, ids: list[int]) -> list[Cart]:
-        if not ids:
-            return []
-        order_mapping = {cart_id: idx for idx, cart_id in enumerate(ids)}
-        stmt = select(Cart).where(Cart.id.in_(ids))
-        res = await self.session.execute(stmt)
-        carts = list(res.scalars().all())
-        carts.sort(key=lambda c: order_mapping.get(c.id, 10**12))
-        return carts
-
-    async def list_by_user(self, user_id: int, company_id: int | None, status: int | None, limit: int, offset: int) -> list[Cart]:
-        conditions = [Cart.user_id == user_id]
-        if company_id and company_id > 0:
-            conditions.append(Cart.company_id == company_id)
-        if status and status > 0:
-            conditions.append(Cart.status == status)
-        stmt = select(Cart).where(and_(*conditions)).limit(limit).offset(offset).order_by(Cart.id.desc())
-        res = await self.session.execute(stmt)
-        return list(res.scalars().all())
-
     async def get_active(self, company_id: int, user_id: int | None, cookie: str | None) -> Cart | None:
-        conditions = [Cart.company_id == company_id, Cart.status == CartStatus.ACTIVE.value]
+        # Status is inlined so generic plans can still match the partial unique indexes
+        conditions = [Cart.company_id == company_id, Cart.status == literal(CartStatus.ACTIVE.value, literal_execute=True)]
         if user_id:
             conditions.append(Cart.user_id == user_id)
         else:
@@ -48,7 +58,7 @@ class CartRepository:
         res = await self.session.execute(stmt)
         return res.scalar_one_or_none()
 
-    async def upsert_cart(self, company_id: int, user_id: int | None, cookie: str | None) -> Cart:
+    async def upsert_cart(self, company_id: int, user_id: int | None, cookie: str | None):
         """
         Get or create ACTIVE cart for user/cookie + company.
         
@@ -56,30 +66,101 @@ class CartRepository:
         This is enforced by partial unique constraints in DB:
         - UNIQUE (company_id, user_id) WHERE status = 1 AND user_id IS NOT NULL
         - UNIQUE (company_id, cookie) WHERE status = 1 AND cookie IS NOT NULL
+
+        The conflict target picks the matching partial index, and the no-op
+        DO UPDATE makes RETURNING yield the existing row, so get-or-create is
+        a single statement with no rollback on races.
+
+        Returns (id, company_id, user_id, cookie, status, created_at,
+        item_count, total_amount, total_amount_minor).
         """
-        existing = await self.get_active(company_id=company_id, user_id=user_id, cookie=cookie)
-        if existing:
-            return existing
-        cart = Cart(company_id=company_id, user_id=user_id, cookie=cookie, status=CartStatus.ACTIVE.value)
-        self.session.add(cart)
-        try:
-            await self.session.flush()
-            return cart
-        except IntegrityError:
-            await self.session.rollback()
-            # Unique violation due to race; fetch existing ACTIVE
-            existing = await self.get_active(company_id=company_id, user_id=user_id, cookie=cookie)
-            if existing:
-                return existing
-            raise
-
-    async def change_status(self, cart_id: int, new_status: int) -> Cart | None:
-        cart = await self.get_by_id(cart_id)
-        if not cart:
-            return None
-        cart.status = new_status
-        await self.session.flush()
-        return cart
+        stmt = pg_insert(Cart).values(
+            company_id=company_id,
+            user_id=user_id,
+            cookie=cookie,
+            status=CartStatus.ACTIVE.value,
+        )
+        # Inlined: with a bound status, generic plans (from the 6th execution
+        # on a connection) can no longer infer the arbiter partial index
+        active = Cart.status == literal(CartStatus.ACTIVE.value, literal_execute=True)
+        if user_id:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Cart.company_id, Cart.user_id],
+                index_where=and_(active, Cart.user_id.is_not(None)),
+                set_={"status": stmt.excluded.status},
+            )
+        else:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Cart.company_id, Cart.cookie],
+                index_where=and_(active, Cart.cookie.is_not(None)),
+                set_={"status": stmt.excluded.status},
+            )
+        stmt = stmt.returning(
+            Cart.id,
+            Cart.company_id,
+            Cart.user_id,
+            Cart.cookie,
+            Cart.status,
+            Cart.created_at,
+            Cart.item_count,
+            Cart.total_amount,
+            Cart.total_amount_minor,
+        )
+        res = await self.session.execute(stmt)
+        return res.one()
+
+    async def change_status(self, cart_id: int, new_status: int):
+        """
+        Set the status of a non-empty cart in one UPDATE.
+
+        Returns (company_id, user_id, cookie), or None if the cart does not
+        exist or has no items.
+        """
+        stmt = (
+            update(Cart)
+            .where(Cart.id == cart_id, Cart.item_count > 0)
+            .values(status=new_status)
+            .returning(Cart.company_id, Cart.user_id, Cart.cookie)
+        )
+        res = await self.session.execute(stmt)
+        return res.one_or_none()
+
+    async def lock(self, cart_id: int):
+        """SELECT ... FOR UPDATE of the cart's identity columns, without loading items."""
+        stmt = select(Cart.id, Cart.company_id, Cart.user_id, Cart.cookie, Cart.status).where(Cart.id == cart_id).with_for_update()
+        res = await self.session.execute(stmt)
+        return res.one_or_none()
+
+    async def lock_active(self, company_id: int, user_id: int | None, cookie: str | None):
+        """
+        Lock the ACTIVE cart of a user, or of an anonymous cookie (user_id IS NULL),
+        like `lock`. Returns None if there is none.
+        """
+        conditions = [Cart.company_id == company_id, Cart.status == literal(CartStatus.ACTIVE.value, literal_execute=True)]
+        if user_id:
+            conditions.append(Cart.user_id == user_id)
+        else:
+            conditions += [Cart.cookie == cookie, Cart.user_id.is_(None)]
+        stmt = (
+            select(Cart.id, Cart.company_id, Cart.user_id, Cart.cookie, Cart.status)
+            .where(and_(*conditions))
+            .limit(1)
+            .with_for_update()
+        )
+        res = await self.session.execute(stmt)
+        return res.one_or_none()
+
+    async def assign_to_user(self, cart_id: int, user_id: int) -> bool:
+        """Hand an anonymous cart over to a user; the cookie is dropped so it stops resolving."""
+        stmt = update(Cart).where(Cart.id == cart_id).values(user_id=user_id, cookie=None)
+        res = await self.session.execute(stmt)
+        return bool(res.rowcount)
+
+    async def delete_if_empty(self, cart_id: int) -> bool:
+        """Delete the cart if its last item is gone (item_count is kept by trigger)."""
+        stmt = delete(Cart).where(and_(Cart.id == cart_id, Cart.item_count == 0))
+        res = await self.session.execute(stmt)
+        return bool(res.rowcount and res.rowcount > 0)
 
     async def delete_cart(self, cart_id: int) -> bool:
         """Delete cart by ID"""
@@ -87,69 +168,293 @@ class CartRepository:
         res = await self.session.execute(stmt)
         return res.rowcount and res.rowcount > 0
 
+    async def reap_batch(
+        self,
+        kind: str,
+        cutoff: datetime,
+        after: tuple[datetime, int] | None,
+        limit: int,
+        archive: bool = False,
+    ) -> list:
+        """
+        Delete one batch of `kind` carts (see `_reap_target`) aged past `cutoff`.
+
+        Candidates are taken in (age, id) keyset order after `after` with
+        FOR UPDATE SKIP LOCKED, so carts being written right now are left for
+        the next run. With `archive`, the carts and their items are copied to
+        cart_archive in the same statement.
+
+        Returns rows of (age, id, company_id, user_id, cookie), unordered.
+        """
+        conditions, age = _reap_target(kind)
+        where = [*conditions, age < cutoff]
+        if after is not None:
+            where.append(tuple_(age, Cart.id) > tuple_(*after))
+        batch = (
+            select(Cart.id)
+            .where(*where)
+            .order_by(age, Cart.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .cte("batch")
+        )
+        gone = delete(Cart).where(Cart.id == batch.c.id)
+        if not archive:
+            stmt = gone.returning(age, Cart.id, Cart.company_id, Cart.user_id, Cart.cookie)
+            res = await self.session.execute(stmt)
+            return list(res.all())
+
+        columns = ["id", "user_id", "company_id", "cookie", "status", "created_at", "updated_at", "item_count", "total_amount"]
+        gone = gone.returning(*(getattr(Cart, name) for name in columns)).cte("gone")
+        item = func.jsonb_build_object(
+            "product_id", CartItem.product_id,
+            "name", CartItem.name,
+            "price", cast(CartItem.price, Text),
+            "price_minor", CartItem.price_minor,
+            "quantity", CartItem.quantity,
+        )
+        # Same snapshot as the DELETE, so the cascaded items are still visible here
+        items = (
+            select(
+                func.coalesce(
+                    func.jsonb_agg(aggregate_order_by(item, CartItem.id)),
+                    literal_column("'[]'::jsonb"),
+                    type_=JSONB,
+                )
+            )
+            .where(CartItem.cart_id == gone.c.id)
+            .scalar_subquery()
+        )
+        stmt = (
+            insert(CartArchive)
+            .from_select(
+                [*columns, "items", "reason"],
+                select(*(gone.c[name] for name in columns), items, literal(kind, String)),
+            )
+            .add_cte(gone)
+            .returning(
+                getattr(CartArchive, age.key),
+                CartArchive.id,
+                CartArchive.company_id,
+                CartArchive.user_id,
+                CartArchive.cookie,
+            )
+        )
+        res = await self.session.execute(stmt)
+        return list(res.all())
+
 
 class CartItemRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
 
-    async def upsert_item(self, cart_id: int, product_id: int, name: str, price: str, quantity: int) -> CartItem:
-        stmt = select(CartItem).where(and_(CartItem.cart_id == cart_id, CartItem.product_id == product_id))
-        res = await self.session.execute(stmt)
-        item = res.scalar_one_or_none()
-        if item:
-            item.name = name
-            item.price = price
-            item.quantity = quantity
-            await self.session.flush()
-            return item
-        item = CartItem(cart_id=cart_id, product_id=product_id, name=name, price=price, quantity=quantity)
-        self.session.add(item)
-        try:
-            await self.session.flush()
-            return item
-        except IntegrityError:
-            await self.session.rollback()
-            # On conflict (cart_id, product_id) read current and update to exact quantity
-            res = await self.session.execute(stmt)
-            item = res.scalar_one()
-            item.name = name
-            item.price = price
-            item.quantity = quantity
-            await self.session.flush()
-            return item
+    async def upsert_item(self, cart_id: int, product_id: int, name: str, price_minor: int, quantity: int):
+        """
+        Insert or overwrite item in one statement.
 
-    async def update_quantity(self, cart_id: int, product_id: int, quantity: int) -> CartItem | None:
-        stmt = select(CartItem).where(and_(CartItem.cart_id == cart_id, CartItem.product_id == product_id))
+        Uses ON CONFLICT on uq_cart_item_cart_product. Returns the cart's
+        (company_id, user_id, cookie), or None if the cart does not exist.
+        """
+        source = select(
+            literal(cart_id, BigInteger),
+            literal(product_id, BigInteger),
+            literal(name, String),
+            literal(price_minor, BigInteger),
+            literal(quantity, Integer),
+        ).where(exists().where(Cart.id == cart_id))
+        stmt = pg_insert(CartItem).from_select(
+            ["cart_id", "product_id", "name", "price_minor", "quantity"],
+            source,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CartItem.cart_id, CartItem.product_id],
+            set_={
+                "name": stmt.excluded.name,
+                "price_minor": stmt.excluded.price_minor,
+                "quantity": stmt.excluded.quantity,
+            },
+        )
+        upserted = stmt.returning(CartItem.cart_id).cte("upserted")
+        res = await self.session.execute(_cart_identity(upserted))
+        return res.one_or_none()
+
+    async def update_quantity(self, cart_id: int, product_id: int, quantity: int):
+        """
+        UPDATE ... FROM cart ... RETURNING the cart's (company_id, user_id, cookie),
+        or None if the item does not exist.
+        """
+        stmt = (
+            update(CartItem)
+            .where(CartItem.cart_id == cart_id, CartItem.product_id == product_id, Cart.id == CartItem.cart_id)
+            .values(quantity=quantity)
+            .returning(Cart.company_id, Cart.user_id, Cart.cookie)
+        )
         res = await self.session.execute(stmt)
-        item = res.scalar_one_or_none()
-        if not item:
-            return None
-        item.quantity = quantity
-        await self.session.flush()
-        return item
+        return res.one_or_none()
 
-    async def remove_item(self, cart_id: int, product_id: int) -> tuple[bool, bool]:
+    async def increment(self, cart_id: int, product_id: int, delta: int):
         """
-        Remove item from cart.
-        Returns: (item_removed: bool, cart_deleted: bool)
+        Add `delta` to an item's quantity in one statement, deleting the item
+        instead when the result would be <= 0.
+
+        The item row is locked first and both branches work off the locked
+        (latest) quantity, so concurrent increments never lose an update.
+        Returns (company_id, user_id, cookie, quantity) of the cart and the new
+        quantity (<= 0 means deleted), or None if the item does not exist.
         """
-        stmt = delete(CartItem).where(and_(CartItem.cart_id == cart_id, CartItem.product_id == product_id))
+        cur = (
+            select(CartItem.id, CartItem.cart_id, CartItem.quantity)
+            .where(and_(CartItem.cart_id == cart_id, CartItem.product_id == product_id))
+            .with_for_update()
+            .cte("cur")
+        )
+        new_quantity = cur.c.quantity + delta
+        bumped = (
+            update(CartItem)
+            .where(CartItem.id == cur.c.id, new_quantity > 0)
+            .values(quantity=new_quantity)
+            .returning(CartItem.id)
+            .cte("bumped")
+        )
+        dropped = delete(CartItem).where(CartItem.id == cur.c.id, new_quantity <= 0).returning(CartItem.id).cte("dropped")
+        stmt = (
+            select(Cart.company_id, Cart.user_id, Cart.cookie, new_quantity.label("quantity"))
+            .join_from(cur, Cart, Cart.id == cur.c.cart_id)
+            .add_cte(bumped, dropped)
+        )
         res = await self.session.execute(stmt)
-        item_removed = res.rowcount and res.rowcount > 0
-        
-        if item_removed:
-            # Check if cart has any items left
-            count_stmt = select(func.count(CartItem.id)).where(CartItem.cart_id == cart_id)
-            count_res = await self.session.execute(count_stmt)
-            remaining_items = count_res.scalar() or 0
-            
-            if remaining_items == 0:
-                # Delete empty cart directly
-                cart_delete_stmt = delete(Cart).where(Cart.id == cart_id)
-                cart_res = await self.session.execute(cart_delete_stmt)
-                cart_deleted = cart_res.rowcount and cart_res.rowcount > 0
-                return item_removed, cart_deleted
-        
-        return item_removed, False
+        return res.one_or_none()
+
+    async def remove_item(self, cart_id: int, product_id: int):
+        """
+        Delete the item. The cart is left to `CartRepository.delete_if_empty`
+        even when this was its last item (see `CartService.remove_item`).
 
+        Returns the cart's (company_id, user_id, cookie), or None if the item
+        does not exist.
+        """
+        removed = (
+            delete(CartItem)
+            .where(and_(CartItem.cart_id == cart_id, CartItem.product_id == product_id))
+            .returning(CartItem.cart_id)
+            .cte("removed")
+        )
+        res = await self.session.execute(_cart_identity(removed))
+        return res.one_or_none()
 
+    async def bulk_upsert(self, cart_id: int, items: list[dict]) -> int:
+        """
+        Multi-row INSERT ... ON CONFLICT of (product_id, name, price_minor,
+        quantity) dicts; `items` must not repeat a product_id.
+        """
+        if not items:
+            return 0
+        stmt = pg_insert(CartItem).values([{"cart_id": cart_id, **item} for item in items])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CartItem.cart_id, CartItem.product_id],
+            set_={
+                "name": stmt.excluded.name,
+                "price_minor": stmt.excluded.price_minor,
+                "quantity": stmt.excluded.quantity,
+            },
+        )
+        res = await self.session.execute(stmt)
+        return res.rowcount or 0
+
+    async def merge_into(self, target_id: int, source_id: int, policy: str) -> int:
+        """
+        Copy every item of `source_id` into `target_id` with one
+        INSERT ... SELECT ... ON CONFLICT. Items present in both carts are
+        resolved by `policy` (see MERGE_POLICIES); "keep_guest" also takes
+        the source item's name and price. Returns the rows inserted or updated.
+        """
+        source = select(
+            literal(target_id, BigInteger), CartItem.product_id, CartItem.name, CartItem.price_minor, CartItem.quantity
+        ).where(CartItem.cart_id == source_id)
+        stmt = pg_insert(CartItem).from_select(["cart_id", "product_id", "name", "price_minor", "quantity"], source)
+        conflict = [CartItem.cart_id, CartItem.product_id]
+        if policy == "keep_user":
+            stmt = stmt.on_conflict_do_nothing(index_elements=conflict)
+        elif policy == "sum":
+            stmt = stmt.on_conflict_do_update(index_elements=conflict, set_={"quantity": CartItem.quantity + stmt.excluded.quantity})
+        elif policy == "max":
+            stmt = stmt.on_conflict_do_update(
+                index_elements=conflict, set_={"quantity": func.greatest(CartItem.quantity, stmt.excluded.quantity)}
+            )
+        elif policy == "keep_guest":
+            stmt = stmt.on_conflict_do_update(
+                index_elements=conflict,
+                set_={"name": stmt.excluded.name, "price_minor": stmt.excluded.price_minor, "quantity": stmt.excluded.quantity},
+            )
+        else:
+            raise ValueError(f"unknown merge policy {policy!r}")
+        res = await self.session.execute(stmt)
+        return res.rowcount or 0
+
+    async def bulk_set_quantity(self, cart_id: int, quantities: dict[int, int]) -> int:
+        """One UPDATE ... FROM (VALUES ...) for many products; missing items are ignored."""
+        if not quantities:
+            return 0
+        v = values(
+            column("product_id", BigInteger),
+            column("quantity", Integer),
+            name="v",
+        ).data(list(quantities.items()))
+        stmt = (
+            update(CartItem)
+            .where(and_(CartItem.cart_id == cart_id, CartItem.product_id == v.c.product_id))
+            .values(quantity=v.c.quantity)
+            .execution_options(synchronize_session=False)
+        )
+        res = await self.session.execute(stmt)
+        return res.rowcount or 0
+
+    async def bulk_remove(self, cart_id: int, product_ids: list[int]) -> int:
+        if not product_ids:
+            return 0
+        stmt = (
+            delete(CartItem)
+            .where(and_(CartItem.cart_id == cart_id, CartItem.product_id == any_(cast(product_ids, ARRAY(BigInteger)))))
+            .execution_options(synchronize_session=False)
+        )
+        res = await self.session.execute(stmt)
+        return res.rowcount or 0
+
+    async def reprice_active(self, products: list[tuple[int, int, str | None]]) -> list:
+        """
+        Set price (and name, unless None) of `(product_id, price_minor, name)`
+        in every ACTIVE cart with one UPDATE ... FROM (VALUES ...).
+
+        Rows already up to date are skipped. Returns (id, company_id,
+        user_id, cookie) of the cart of every item row changed, so a cart
+        appears once per repriced item.
+
+        A reprice is not cart activity, so `cart.skip_touch` is on for the
+        UPDATE: `trg_cart_touch` then keeps `cart.updated_at`, and an
+        abandoned cart still ages towards the reaper's TTL.
+        """
+        if not products:
+            return []
+        v = values(
+            column("product_id", BigInteger),
+            column("price_minor", BigInteger),
+            column("name", String),
+            name="v",
+        ).data(products)
+        new_name = func.coalesce(v.c.name, CartItem.name)
+        stmt = (
+            update(CartItem)
+            .where(
+                CartItem.product_id == v.c.product_id,
+                CartItem.cart_id == Cart.id,
+                Cart.status == literal(CartStatus.ACTIVE.value, literal_execute=True),
+                or_(CartItem.price_minor != v.c.price_minor, CartItem.name != new_name),
+            )
+            .values(price_minor=v.c.price_minor, name=new_name)
+            .returning(Cart.id, Cart.company_id, Cart.user_id, Cart.cookie)
+            .execution_options(synchronize_session=False)
+        )
+        await self.session.execute(select(func.set_config("cart.skip_touch", "on", True)))
+        rows = (await self.session.execute(stmt)).all()
+        await self.session.execute(select(func.set_config("cart.skip_touch", "off", True)))
+        return rows
@@ -8,6 +8,8 @@ class CartItemOut(BaseModel):
     product_id: int
     name: str
     price: str
+    # The same price in integer minor units (cents)
+    price_minor: int
     quantity: int
 
 
@@ -20,6 +22,15 @@ class CartOut(BaseModel):
     created_at: datetime
     items: list[CartItemOut]
     total_amount: str
+    total_amount_minor: int
+
+
+class CartSummaryOut(BaseModel):
+    id: int
+    status: int
+    item_count: int
+    total_amount: str
+    total_amount_minor: int
 
 
 class ByIdsRequest(BaseModel):
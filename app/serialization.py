@@ -0,0 +1,80 @@
+"""
+Cart views (the dicts of `CartReadRepository`) straight to response bytes.
+
+The views already have the `CartOut` / `cart_pb2.Cart` shape, with prices
+formatted by Postgres, so nothing needs validating or converting:
+
+- REST routes return `json_response(...)`: orjson-encoded, and as a Response
+  it bypasses FastAPI's `response_model` validation and `jsonable_encoder`.
+  `response_model` stays on the routes for the OpenAPI schema. Output is
+  byte-for-byte what the `response_model` path produced.
+- RPCs build messages in place with `cart_response` / `cart_list`; adding to
+  a repeated field instead of passing finished submessages saves a copy of
+  every cart and item.
+
+`bench/serialization.py` measures both against the generic paths.
+"""
+from __future__ import annotations
+
+from collections.abc import Iterable
+from typing import Any
+
+import orjson
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+from app.grpc.utils import ensure_generated
+
+cart_pb2, _ = ensure_generated()
+
+
+# Pydantic writes UTC datetimes with a "Z" suffix; keep the same output
+JSON_OPTIONS = orjson.OPT_UTC_Z
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=JSON_OPTIONS)
+
+
+def json_response(content: Any, response: Response | None = None, status_code: int = 200) -> FastJSONResponse:
+    """
+    `content` as a JSON response, skipping `response_model`.
+
+    FastAPI ignores headers and cookies set on an injected `response` once the
+    route returns a Response of its own, so they are carried over here.
+    """
+    out = FastJSONResponse(content, status_code=status_code)
+    if response is not None:
+        out.raw_headers.extend(h for h in response.raw_headers if h[0] != b"content-length")
+    return out
+
+
+def fill_cart(msg: cart_pb2.Cart, cart: dict) -> cart_pb2.Cart:
+    msg.id = cart["id"]
+    msg.company_id = cart["company_id"]
+    msg.user_id = cart["user_id"] or 0
+    msg.cookie = cart["cookie"] or ""
+    msg.status = cart["status"]
+    msg.created_at = cart["created_at"].isoformat()
+    msg.total_amount = cart["total_amount"]
+    msg.total_amount_minor = cart["total_amount_minor"]
+    add_item = msg.items.add
+    # Item dicts have exactly the CartItem fields (built by json_build_object)
+    for item in cart["items"]:
+        add_item(**item)
+    return msg
+
+
+def cart_response(cart: dict) -> cart_pb2.CartResponse:
+    out = cart_pb2.CartResponse()
+    fill_cart(out.cart, cart)
+    return out
+
+
+def cart_list(carts: Iterable[dict], next_cursor: str | None = None) -> cart_pb2.CartList:
+    out = cart_pb2.CartList(next_cursor=next_cursor or "")
+    add_cart = out.carts.add
+    for cart in carts:
+        fill_cart(add_cart(), cart)
+    return out
@@ -0,0 +1,200 @@
+"""
+Process entry point: REST and gRPC in one process, or each in its own workers.
+
+    python -m app.serve [--mode embedded|http|grpc|all] [--http-workers N] [--grpc-workers M]
+
+- embedded: one uvicorn process with the gRPC server on the same event loop
+  (the historical `uvicorn app.main:app` setup)
+- http: uvicorn with N workers, no gRPC
+- grpc: M gRPC worker processes sharing GRPC_PORT through SO_REUSEPORT
+- all: supervisor running both of the above; if any child dies the rest are
+  stopped and the supervisor exits non-zero, so the orchestrator restarts it
+
+Defaults come from SERVER_MODE, HTTP_WORKERS and GRPC_WORKERS. With
+DB_MAX_CONNECTIONS set, every process gets an equal share of it for its pools
+(DB_POOL_SIZE, no overflow) and cache listener, so scaling workers never
+exceeds the budget.
+
+Outside embedded mode the processes share their metrics through METRICS_DIR
+(a temporary directory unless set), so a scrape of any of them returns all
+workers' series; in grpc mode the gRPC workers serve /metrics on HTTP_PORT.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+
+from app.replicas import replica_urls
+from app.settings import settings
+
+log = logging.getLogger(__name__)
+
+MODES = ("embedded", "http", "grpc", "all")
+
+
+def size_pool(processes: int) -> None:
+    """
+    Give each of `processes` an equal share of DB_MAX_CONNECTIONS.
+
+    A process opens one pool for the primary and one per read replica, plus
+    the cache listener's LISTEN connection when the cart cache or replicas
+    are on; each pool gets an equal part of what the listener leaves of the
+    share. Applied to this process's settings and to the environment
+    spawned children read theirs from.
+    """
+    if settings.db_max_connections <= 0:
+        return
+    engines = 1 + len(replica_urls())
+    listener = 1 if settings.cart_cache_size > 0 or engines > 1 else 0
+    share = settings.db_max_connections // processes
+    settings.db_pool_size = max(1, (share - listener) // engines)
+    settings.db_max_overflow = 0
+    os.environ.update(DB_POOL_SIZE=str(settings.db_pool_size), DB_MAX_OVERFLOW="0")
+    if processes * (settings.db_pool_size * engines + listener) > settings.db_max_connections:
+        log.warning(
+            "DB_MAX_CONNECTIONS=%s is too small for %s processes with %s engines; using pools of 1",
+            settings.db_max_connections, processes, engines,
+        )
+
+
+def share_metrics() -> str | None:
+    """
+    Point this process and its children at a common METRICS_DIR. Returns
+    the directory if it was created here (the caller removes it).
+    """
+    if settings.metrics_dir:
+        return None
+    settings.metrics_dir = tempfile.mkdtemp(prefix="cart-metrics-")
+    os.environ["METRICS_DIR"] = settings.metrics_dir
+    return settings.metrics_dir
+
+
+def run_http(workers: int, embedded_grpc: bool) -> None:
+    import uvicorn
+
+    os.environ["GRPC_EMBEDDED"] = "true" if embedded_grpc else "false"
+    # Re-read by every worker, which imports app.main afresh
+    settings.grpc_embedded = embedded_grpc
+    uvicorn.run("app.main:app", host="0.0.0.0", port=settings.http_port, workers=workers, log_level=settings.log_level)
+
+
+async def _grpc_worker() -> None:
+    from app.cache_listener import start_cache_listener
+    from app.db import init_engines
+    from app.grpc.server import start_grpc
+    from app.metrics import start_metrics_server, start_metrics_writer
+    from app.replicas import start_replica_monitor
+
+    init_engines()
+    listener = start_cache_listener()
+    monitor = start_replica_monitor()
+    writer = start_metrics_writer()
+    metrics_server = await start_metrics_server(settings.grpc_metrics_port) if settings.grpc_metrics_port > 0 else None
+    server = await start_grpc(settings.grpc_port)
+    log.info("gRPC worker %s serving on port %s", os.getpid(), settings.grpc_port)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    await server.stop(settings.grpc_shutdown_grace)
+    if metrics_server is not None:
+        metrics_server.close()
+    for task in (listener, monitor, writer):
+        if task is not None:
+            task.cancel()
+    if writer is not None:
+        await asyncio.gather(writer, return_exceptions=True)
+
+
+def run_grpc_worker() -> None:
+    logging.basicConfig(level=settings.log_level.upper())
+    asyncio.run(_grpc_worker())
+
+
+def supervise(http_workers: int, grpc_workers: int) -> int:
+    """
+    Run `app.serve --mode http` and single `--mode grpc` workers as child
+    processes until a signal or a child exit. Returns the exit code.
+    """
+    size_pool(http_workers + grpc_workers)
+    # Children get their pool size as is instead of splitting the budget again, and
+    # gRPC workers leave HTTP_PORT to uvicorn unless there is none
+    env = {**os.environ, "DB_MAX_CONNECTIONS": "0", "GRPC_METRICS_PORT": str(settings.grpc_metrics_port or -1)}
+    command = [sys.executable, "-m", "app.serve"]
+    commands = []
+    if http_workers:
+        commands.append(("http", [*command, "--mode", "http", "--http-workers", str(http_workers)]))
+    commands += [(f"grpc-{i}", [*command, "--mode", "grpc", "--grpc-workers", "1"]) for i in range(grpc_workers)]
+    children = {}
+    for name, cmd in commands:
+        child = subprocess.Popen(cmd, env=env)
+        children[child.pid] = (name, child)
+    log.info("Supervising %s", ", ".join(f"{name} (pid {pid})" for pid, (name, _) in children.items()))
+
+    stopping = False
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for _, child in children.values():
+            if child.poll() is None:
+                child.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    failed = False
+    while children:
+        pid, status = os.wait()
+        name, child = children.pop(pid, (None, None))
+        if child is None:
+            continue
+        child.returncode = os.waitstatus_to_exitcode(status)
+        if not stopping:
+            failed = True
+            log.error("Child %s exited with %s, stopping", name, child.returncode)
+            stop(None, None)
+    return 1 if failed else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the REST and/or gRPC servers")
+    parser.add_argument("--mode", choices=MODES, default=settings.server_mode)
+    parser.add_argument("--http-workers", type=int, default=settings.http_workers)
+    parser.add_argument("--grpc-workers", type=int, default=settings.grpc_workers)
+    args = parser.parse_args()
+    logging.basicConfig(level=settings.log_level.upper())
+
+    if args.mode == "embedded":
+        run_http(1, embedded_grpc=True)
+        return
+    # Children of a supervisor find METRICS_DIR and GRPC_METRICS_PORT already set
+    created = share_metrics()
+    if args.mode == "grpc" and settings.grpc_metrics_port == 0:
+        # No HTTP server in this pod: the gRPC workers answer scrapes
+        settings.grpc_metrics_port = settings.http_port
+    try:
+        if args.mode == "http":
+            size_pool(args.http_workers)
+            run_http(args.http_workers, embedded_grpc=False)
+        elif args.mode == "grpc" and args.grpc_workers == 1:
+            size_pool(1)
+            run_grpc_worker()
+        else:
+            sys.exit(supervise(args.http_workers if args.mode == "all" else 0, args.grpc_workers))
+    finally:
+        if created:
+            shutil.rmtree(created, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
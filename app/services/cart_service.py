@@ -1,20 +1,110 @@
 from __future__ import annotations
 
-from decimal import Decimal
-from typing import Iterable
+import base64
+import binascii
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import AsyncIterator, Iterable
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models import Cart, CartItem, CartStatus
-from app.repositories.cart_repo import CartItemRepository, CartRepository
+from app.cache import ALL_KEYS, MISSING, active_key, cart_cache, cart_key, cart_keys, invalidate_on_commit, summary_key
+from app.repositories.cart_read_repo import CartReadRepository
+from app.repositories.cart_repo import MERGE_POLICIES, CartItemRepository, CartRepository
+from app.settings import settings
 
 
-def compute_total(cart: Cart) -> str:
-    total = Decimal("0.00")
-    for item in cart.items:
-        price = Decimal(str(item.price))
-        total += price * item.quantity
-    return f"{total:.2f}"
+def encode_cursor(cart_id: int) -> str:
+    """Opaque keyset token for the last cart of a page."""
+    return base64.urlsafe_b64encode(f"id:{cart_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        prefix, _, value = raw.partition(":")
+        if prefix != "id":
+            raise ValueError
+        return int(value)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("invalid cursor") from None
+
+
+def to_minor(price: str | int | None) -> int:
+    """
+    A price as integer minor units (cents): ints already are, decimal
+    strings are converted, "10.5" -> 1050.
+
+    Strings round like the Numeric(10, 2) column does; plain "123" / "123.45"
+    ones are parsed without a Decimal. Raises ValueError on an invalid price.
+    """
+    if isinstance(price, int):
+        return price
+    if not price:
+        raise ValueError("price is required")
+    whole, _, frac = price.partition(".")
+    if whole.isascii() and whole.isdigit() and len(frac) <= 2 and (not frac or frac.isascii() and frac.isdigit()):
+        return int(whole) * 100 + int(frac.ljust(2, "0"))
+    try:
+        return int((Decimal(price) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"invalid price {price!r}") from None
+
+
+@dataclass(frozen=True)
+class CartMutation:
+    """One BatchMutate operation: "upsert", "set_qty" or "remove"."""
+
+    op: str
+    product_id: int
+    name: str | None = None
+    price: str | int | None = None  # see to_minor
+    quantity: int = 0
+
+
+def fold_mutations(ops: Iterable[CartMutation]) -> tuple[list[dict], dict[int, int], list[int]]:
+    """
+    Collapse ordered ops into their net effect per product, so each kind can
+    be applied with one set-based statement.
+
+    Returns (upserts, quantity updates, removals). Raises ValueError on
+    malformed ops.
+    """
+    final: dict[int, CartMutation] = {}
+    for op in ops:
+        if op.op == "upsert":
+            if not op.name or op.price in (None, ""):
+                raise ValueError(f"upsert of product {op.product_id} requires name and price")
+            try:
+                minor = to_minor(op.price)
+            except ValueError as exc:
+                raise ValueError(f"{exc} for product {op.product_id}") from None
+            if op.quantity > 0:
+                final[op.product_id] = CartMutation("upsert", op.product_id, op.name, minor, op.quantity)
+            else:
+                final[op.product_id] = CartMutation("remove", op.product_id)
+        elif op.op == "set_qty":
+            prev = final.get(op.product_id)
+            if op.quantity <= 0:
+                final[op.product_id] = CartMutation("remove", op.product_id)
+            elif prev is None or prev.op == "set_qty":
+                final[op.product_id] = op
+            elif prev.op == "upsert":
+                final[op.product_id] = CartMutation("upsert", op.product_id, prev.name, prev.price, op.quantity)
+            # set_qty after remove: the item is gone, nothing to update
+        elif op.op == "remove":
+            final[op.product_id] = op
+        else:
+            raise ValueError(f"unknown op {op.op!r}")
+
+    upserts = [
+        {"product_id": m.product_id, "name": m.name, "price_minor": m.price, "quantity": m.quantity}
+        for m in final.values()
+        if m.op == "upsert"
+    ]
+    quantities = {m.product_id: m.quantity for m in final.values() if m.op == "set_qty"}
+    removals = [m.product_id for m in final.values() if m.op == "remove"]
+    return upserts, quantities, removals
 
 
 class CartService:
@@ -22,8 +112,118 @@ class CartService:
         self.session = session
         self.carts = CartRepository(session)
         self.items = CartItemRepository(session)
+        self.reads = CartReadRepository(session)
+
+    async def _invalidate(self, cart_id: int, cart) -> None:
+        """`cart` is any row carrying company_id, user_id and cookie."""
+        await invalidate_on_commit(self.session, cart_keys(cart_id, cart.company_id, cart.user_id, cart.cookie))
+
+    async def get_cart(self, cart_id: int) -> dict | None:
+        key = cart_key(cart_id)
+        cached = cart_cache.get(key)
+        if cached is not MISSING:
+            return cached
+        token = cart_cache.token()
+        cart = await self.reads.get_by_id(cart_id)
+        cart_cache.set(key, cart, token)
+        return cart
+
+    async def list_by_user(
+        self,
+        user_id: int,
+        company_id: int | None,
+        status: int | None,
+        limit: int,
+        offset: int,
+        cursor: str | None = None,
+    ) -> tuple[list[dict], str | None]:
+        """
+        Returns (carts, next_cursor). next_cursor is None on the last page.
+        Raises ValueError for a malformed cursor.
+        """
+        after_id = decode_cursor(cursor) if cursor else None
+        carts = await self.reads.list_by_user(user_id, company_id, status, limit, offset, after_id)
+        next_cursor = encode_cursor(carts[-1]["id"]) if carts and len(carts) >= limit else None
+        return carts, next_cursor
+
+    def stream_by_user(
+        self, user_id: int, company_id: int | None, status: int | None, limit: int | None = None, cursor: str | None = None
+    ) -> AsyncIterator[dict]:
+        """
+        Every matching cart (or the first `limit`) newest first, starting
+        after `cursor`, read STREAM_YIELD_PER rows at a time. Raises
+        ValueError for a malformed cursor right away, not on iteration.
+        """
+        after_id = decode_cursor(cursor) if cursor else None
+        return self.reads.stream_by_user(user_id, company_id, status, after_id, limit, settings.stream_yield_per)
+
+    async def list_by_ids(self, ids: list[int]) -> list[dict]:
+        """
+        Carts of `ids` in request order, BY_IDS_CHUNK_SIZE ids per statement.
+        Repeated ids are returned once, at their first position; unknown and
+        empty carts are skipped. Raises ValueError past BY_IDS_MAX ids.
+        """
+        if settings.by_ids_max and len(ids) > settings.by_ids_max:
+            raise ValueError(f"at most {settings.by_ids_max} ids per request, got {len(ids)}")
+        unique = list(dict.fromkeys(ids))
+        size = settings.by_ids_chunk_size
+        carts: list[dict] = []
+        for start in range(0, len(unique), size):
+            carts += await self.reads.list_by_ids_ordered(unique[start:start + size])
+        return carts
+
+    def stream_by_ids(self, ids: list[int]) -> AsyncIterator[dict]:
+        """
+        `list_by_ids` in one statement read STREAM_YIELD_PER rows at a time.
+        Raises ValueError past STREAM_BY_IDS_MAX ids right away, not on iteration.
+        """
+        if settings.stream_by_ids_max and len(ids) > settings.stream_by_ids_max:
+            raise ValueError(f"at most {settings.stream_by_ids_max} ids per stream, got {len(ids)}")
+        return self.reads.stream_by_ids(list(dict.fromkeys(ids)), settings.stream_yield_per)
+
+    async def get_active(self, company_id: int, user_id: int | None, cookie: str | None) -> dict | None:
+        key = active_key(company_id, user_id, cookie)
+        cached = cart_cache.get(key)
+        if cached is not MISSING:
+            return cached
+        token = cart_cache.token()
+        cart = await self.reads.get_active(company_id, user_id, cookie)
+        cart_cache.set(key, cart, token)
+        return cart
+
+    async def get_active_summary(self, company_id: int, user_id: int | None, cookie: str | None) -> dict | None:
+        cached = cart_cache.get(active_key(company_id, user_id, cookie))
+        if cached is not MISSING:
+            if cached is None:
+                return None
+            return {
+                "id": cached["id"],
+                "status": cached["status"],
+                "item_count": len(cached["items"]),
+                "total_amount": cached["total_amount"],
+                "total_amount_minor": cached["total_amount_minor"],
+            }
+        key = summary_key(company_id, user_id, cookie)
+        cached = cart_cache.get(key)
+        if cached is not MISSING:
+            return cached
+        token = cart_cache.token()
+        summary = await self.reads.get_active_summary(company_id, user_id, cookie)
+        cart_cache.set(key, summary, token)
+        return summary
+
+    # RW ops
+    #
+    # Each mutation is one DML statement that RETURNs the cart identity needed
+    # for cache invalidation, the NOTIFY, and one final read of the cart view:
+    # no ORM loads, flushes or refreshes. tests/test_statement_budget.py pins
+    # the per-request statement counts.
 
-    async def serialize(self, cart: Cart) -> dict:
+    async def upsert_cart(self, company_id: int, user_id: int | None, cookie: str | None) -> dict:
+        cart = await self.carts.upsert_cart(company_id, user_id, cookie)
+        if cart.item_count:
+            return await self.reads.get_by_id(cart.id)
+        # The cart view only has non-empty carts; an empty one is fully known from RETURNING
         return {
             "id": cart.id,
             "company_id": cart.company_id,
@@ -31,94 +231,170 @@ class CartService:
             "cookie": cart.cookie,
             "status": cart.status,
             "created_at": cart.created_at,
-            "items": [
-                {
-                    "product_id": i.product_id,
-                    "name": i.name,
-                    "price": f"{Decimal(str(i.price)):.2f}",
-                    "quantity": i.quantity,
-                }
-                for i in cart.items
-            ],
-            "total_amount": compute_total(cart),
+            "items": [],
+            "total_amount": f"{cart.total_amount:.2f}",
+            "total_amount_minor": cart.total_amount_minor,
         }
 
-    def _filter_empty_carts(self, carts: list[Cart]) -> list[Cart]:
-        """Filter out carts without items"""
-        return [c for c in carts if c.items]
+    async def add_item(
+        self,
+        company_id: int,
+        user_id: int | None,
+        cookie: str | None,
+        product_id: int,
+        name: str,
+        price: str | int,
+        quantity: int,
+    ) -> dict:
+        """Get or create the ACTIVE cart and upsert an item into it. Raises ValueError on a bad price."""
+        minor = to_minor(price)
+        cart = await self.carts.upsert_cart(company_id, user_id, cookie)
+        await self.items.upsert_item(cart.id, product_id, name, minor, quantity)
+        await self._invalidate(cart.id, cart)
+        return await self.reads.get_by_id(cart.id)
 
-    async def get_cart(self, cart_id: int) -> Cart | None:
-        cart = await self.carts.get_by_id(cart_id)
-        if cart and not cart.items:
-            return None  # Don't return empty carts
-        return cart
+    async def upsert_item(self, cart_id: int, product_id: int, name: str, price: str | int, quantity: int) -> dict | None:
+        """Raises ValueError on a bad price."""
+        cart = await self.items.upsert_item(cart_id, product_id, name, to_minor(price), quantity)
+        if cart is None:
+            return None
+        await self._invalidate(cart_id, cart)
+        return await self.reads.get_by_id(cart_id)
 
-    async def list_by_user(self, user_id: int, company_id: int | None, status: int | None, limit: int, offset: int) -> list[Cart]:
-        carts = await self.carts.list_by_user(user_id, company_id, status, limit, offset)
-        return self._filter_empty_carts(carts)
+    async def update_qty(self, cart_id: int, product_id: int, quantity: int) -> dict | None:
+        """Returns None if the item was not found or the cart became empty."""
+        if quantity <= 0:
+            return await self.remove_item(cart_id, product_id)
+        cart = await self.items.update_quantity(cart_id, product_id, quantity)
+        if cart is None:
+            return None
+        await self._invalidate(cart_id, cart)
+        return await self.reads.get_by_id(cart_id)
 
-    async def list_by_ids(self, ids: list[int]) -> list[Cart]:
-        carts = await self.carts.list_by_ids_ordered(ids)
-        return self._filter_empty_carts(carts)
+    async def increment_item(self, cart_id: int, product_id: int, delta: int) -> dict | None:
+        """
+        Atomically add `delta` (may be negative) to an item's quantity, in the
+        caller's transaction. At zero the item is removed, and the cart too if
+        that was its last item.
 
-    async def get_active(self, company_id: int, user_id: int | None, cookie: str | None) -> Cart | None:
-        cart = await self.carts.get_active(company_id, user_id, cookie)
-        if cart and not cart.items:
-            return None  # Don't return empty carts
-        return cart
+        Returns the cart, or None if the item was not found or the cart became
+        empty.
+        """
+        row = await self.items.increment(cart_id, product_id, delta)
+        if row is None:
+            return None
+        await self._invalidate(cart_id, row)
+        if row.quantity <= 0 and await self.carts.delete_if_empty(cart_id):
+            return None
+        return await self.reads.get_by_id(cart_id)
 
-    # RW ops
-    async def upsert_cart(self, company_id: int, user_id: int | None, cookie: str | None) -> Cart:
-        return await self.carts.upsert_cart(company_id, user_id, cookie)
+    async def remove_item(self, cart_id: int, product_id: int) -> dict | None:
+        """
+        Remove an item, and the cart too if that was its last item.
 
-    async def upsert_item(self, cart_id: int, product_id: int, name: str, price: str, quantity: int) -> Cart | None:
-        cart = await self.carts.get_by_id(cart_id)
-        if not cart:
-            return None
-        await self.items.upsert_item(cart_id, product_id, name, price, quantity)
-        await self.session.refresh(cart)
-        return cart
+        The emptiness check is a separate statement: two concurrent removals
+        of a cart's last two items serialize on the cart row (the totals
+        trigger locks it), and the second one's check then sees item_count 0
+        in its fresh snapshot, so the cart cannot be left behind empty.
 
-    async def update_qty(self, cart_id: int, product_id: int, quantity: int) -> Cart | None:
-        cart = await self.carts.get_by_id(cart_id)
-        if not cart:
+        Returns the cart, or None if the item was not found or the cart
+        became empty (it is then deleted).
+        """
+        cart = await self.items.remove_item(cart_id, product_id)
+        if cart is None:
             return None
-        if quantity <= 0:
-            # If quantity is 0 or negative, remove the item
-            item_removed, cart_deleted = await self.items.remove_item(cart_id, product_id)
-            if cart_deleted:
-                return None  # Cart was deleted because it became empty
-            if item_removed:
-                await self.session.refresh(cart)
-                return cart if cart.items else None
+        await self._invalidate(cart_id, cart)
+        if await self.carts.delete_if_empty(cart_id):
             return None
-        await self.items.update_quantity(cart_id, product_id, quantity)
-        await self.session.refresh(cart)
-        return cart
+        return await self.reads.get_by_id(cart_id)
+
+    async def change_status(self, cart_id: int, new_status: int) -> dict | None:
+        """Returns None if the cart does not exist or is empty."""
+        cart = await self.carts.change_status(cart_id, new_status)
+        if cart is None:
+            return None
+        await self._invalidate(cart_id, cart)
+        return await self.reads.get_by_id(cart_id)
+
+    async def batch_mutate(self, cart_id: int, ops: list[CartMutation]) -> dict | None:
+        """
+        Apply many item mutations in the caller's transaction with one
+        statement per kind, then read the cart once.
 
-    async def remove_item(self, cart_id: int, product_id: int) -> Cart | None:
-        cart = await self.carts.get_by_id(cart_id)
+        Returns None if the cart does not exist or became empty (it is then
+        deleted). Raises ValueError on malformed ops.
+        """
+        upserts, quantities, removals = fold_mutations(ops)
+        cart = await self.carts.lock(cart_id)
         if not cart:
             return None
-        item_removed, cart_deleted = await self.items.remove_item(cart_id, product_id)
-        if not item_removed:
+        await self._invalidate(cart_id, cart)
+        await self.items.bulk_upsert(cart_id, upserts)
+        await self.items.bulk_set_quantity(cart_id, quantities)
+        if await self.items.bulk_remove(cart_id, removals) and await self.carts.delete_if_empty(cart_id):
             return None
-        if cart_deleted:
-            return None  # Cart was deleted because it became empty
-        await self.session.refresh(cart)
-        return cart
+        return await self.reads.get_by_id(cart_id)
 
-    async def change_status(self, cart_id: int, new_status: int) -> Cart | None:
-        cart = await self.carts.get_by_id(cart_id)
-        if not cart:
-            return None, "not_found"
-        
-        # Don't allow status change for empty carts
-        if not cart.items:
-            return None, "empty_cart"
-        
-        cart = await self.carts.change_status(cart_id, new_status)
-        await self.session.refresh(cart)
-        return cart
+    async def merge_carts(self, company_id: int, user_id: int, cookie: str, policy: str | None = None) -> dict | None:
+        """
+        Merge the anonymous ACTIVE cart of `cookie` into the user's ACTIVE cart,
+        in the caller's transaction.
+
+        Without a user cart the guest cart is simply handed over to the user.
+        Otherwise its items are merged with one INSERT ... SELECT ... ON CONFLICT
+        resolved by `policy` (default CART_MERGE_POLICY) and the guest cart is
+        deleted. Returns the resulting cart, or None if neither cart has items.
+        Raises ValueError on bad input.
+        """
+        policy = policy or settings.cart_merge_policy
+        if policy not in MERGE_POLICIES:
+            raise ValueError(f"unknown merge policy {policy!r}")
+        if not user_id or not cookie:
+            raise ValueError("user_id and cookie are required")
+        guest = await self.carts.lock_active(company_id, None, cookie)
+        target = await self.carts.lock_active(company_id, user_id, None)
+        if guest is None:
+            return await self.reads.get_by_id(target.id) if target else None
+        keys = cart_keys(guest.id, company_id, user_id, cookie)
+        if target is not None:
+            keys.add(cart_key(target.id))
+        await invalidate_on_commit(self.session, keys)
+        if target is None:
+            await self.carts.assign_to_user(guest.id, user_id)
+            return await self.reads.get_by_id(guest.id)
+        await self.items.merge_into(target.id, guest.id, policy)
+        await self.carts.delete_cart(guest.id)
+        return await self.reads.get_by_id(target.id)
+
+    async def reprice_products(self, products: list[tuple[int, str | int, str | None]], chunk_size: int | None = None) -> dict:
+        """
+        Propagate catalog `(product_id, price, name)` changes to all ACTIVE carts.
 
+        Runs one transaction per chunk to keep row locks short, so the
+        session must not be inside a transaction. Raises ValueError on a bad
+        price before anything is written.
 
+        Each chunk invalidates the keys of the carts it changed, or the whole
+        cache (and all replica routing) past REPRICE_INVALIDATE_MAX carts.
+        """
+        latest: dict[int, tuple[int, int, str | None]] = {}
+        for product_id, price, name in products:
+            try:
+                latest[product_id] = (product_id, to_minor(price), name or None)
+            except ValueError as exc:
+                raise ValueError(f"{exc} for product {product_id}") from None
+        rows = list(latest.values())
+        chunk_size = chunk_size or settings.reprice_chunk_size
+        report = {"products": len(rows), "chunks": 0, "rows_updated": 0}
+        for start in range(0, len(rows), chunk_size):
+            async with self.session.begin():
+                changed = await self.items.reprice_active(rows[start:start + chunk_size])
+                carts = {cart.id: cart for cart in changed}
+                if len(carts) > settings.reprice_invalidate_max:
+                    await invalidate_on_commit(self.session, {ALL_KEYS})
+                elif carts:
+                    keys = set().union(*(cart_keys(c.id, c.company_id, c.user_id, c.cookie) for c in carts.values()))
+                    await invalidate_on_commit(self.session, keys)
+            report["chunks"] += 1
+            report["rows_updated"] += len(changed)
+        return report
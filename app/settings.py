@@ -11,9 +11,81 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     database_url: str = Field(alias="DATABASE_URL", default="")
+    # Comma-separated read replicas for the read-only routes/RPCs (app.replicas); empty = primary only
+    database_replica_urls: str = Field(alias="DATABASE_REPLICA_URLS", default="")
+    # Reads of a cart/user/cookie stay on the primary this many seconds after a write to it
+    replica_sticky_seconds: float = Field(alias="REPLICA_STICKY_SECONDS", default=5.0)
+    # Replicas lagging more than this (seconds), or not answering the lag check, are skipped
+    replica_max_lag: float = Field(alias="REPLICA_MAX_LAG", default=2.0)
+    replica_lag_check_interval: float = Field(alias="REPLICA_LAG_CHECK_INTERVAL", default=1.0)
     http_port: int = Field(alias="HTTP_PORT", default=8080)
     grpc_port: int = Field(alias="GRPC_PORT", default=50051)
     app_env: str = Field(alias="APP_ENV", default="dev")
+    log_level: str = Field(alias="LOG_LEVEL", default="info")
+    # Process layout (app.serve): embedded, http, grpc or all
+    server_mode: str = Field(alias="SERVER_MODE", default="embedded")
+    http_workers: int = Field(alias="HTTP_WORKERS", default=1)
+    grpc_workers: int = Field(alias="GRPC_WORKERS", default=1)
+    # Run the gRPC server on uvicorn's loop; app.serve turns it off for separate workers
+    grpc_embedded: bool = Field(alias="GRPC_EMBEDDED", default=True)
+    grpc_shutdown_grace: float = Field(alias="GRPC_SHUTDOWN_GRACE", default=10.0)
+    # Worker processes share metrics through this directory (app.serve creates one when unset),
+    # writing their samples every METRICS_FLUSH_INTERVAL seconds
+    metrics_dir: str = Field(alias="METRICS_DIR", default="")
+    metrics_flush_interval: float = Field(alias="METRICS_FLUSH_INTERVAL", default=5.0)
+    # Port of GET /metrics in gRPC workers, which have no HTTP app; 0 = HTTP_PORT in app.serve's grpc mode, < 0 = off
+    grpc_metrics_port: int = Field(alias="GRPC_METRICS_PORT", default=0)
+    # RPCs past this many in flight per process fail fast with RESOURCE_EXHAUSTED; 0 = no limit
+    grpc_max_concurrent_rpcs: int = Field(alias="GRPC_MAX_CONCURRENT_RPCS", default=64)
+    # Keepalive and connection lifetime in seconds; age/idle <= 0 disables. A max age
+    # makes long-lived client channels reconnect, so they rebalance behind a load balancer
+    grpc_keepalive_time: float = Field(alias="GRPC_KEEPALIVE_TIME", default=60.0)
+    grpc_keepalive_timeout: float = Field(alias="GRPC_KEEPALIVE_TIMEOUT", default=20.0)
+    grpc_min_ping_interval: float = Field(alias="GRPC_MIN_PING_INTERVAL", default=10.0)
+    grpc_max_connection_idle: float = Field(alias="GRPC_MAX_CONNECTION_IDLE", default=0)
+    grpc_max_connection_age: float = Field(alias="GRPC_MAX_CONNECTION_AGE", default=0)
+    grpc_max_connection_age_grace: float = Field(alias="GRPC_MAX_CONNECTION_AGE_GRACE", default=10.0)
+    # Response compression: none, gzip or deflate
+    grpc_compression: str = Field(alias="GRPC_COMPRESSION", default="none")
+    grpc_max_receive_message_bytes: int = Field(alias="GRPC_MAX_RECEIVE_MESSAGE_BYTES", default=4 * 1024 * 1024)
+    grpc_max_send_message_bytes: int = Field(alias="GRPC_MAX_SEND_MESSAGE_BYTES", default=16 * 1024 * 1024)
+    # SQLAlchemy pool per process; DB_MAX_CONNECTIONS > 0 splits that budget over app.serve's processes instead
+    db_pool_size: int = Field(alias="DB_POOL_SIZE", default=10)
+    db_max_overflow: int = Field(alias="DB_MAX_OVERFLOW", default=20)
+    db_max_connections: int = Field(alias="DB_MAX_CONNECTIONS", default=0)
+    # Seconds to wait for a pooled connection; gRPC turns the timeout into RESOURCE_EXHAUSTED
+    db_pool_timeout: float = Field(alias="DB_POOL_TIMEOUT", default=30.0)
+    # In-process cart cache; size 0 disables it
+    cart_cache_size: int = Field(alias="CART_CACHE_SIZE", default=10000)
+    cart_cache_ttl: float = Field(alias="CART_CACHE_TTL", default=5.0)
+    cart_cache_channel: str = Field(alias="CART_CACHE_CHANNEL", default="cart_changed")
+    # ids per statement of ListByIds / by-ids, and the most ids one request may ask for (0 = no limit)
+    by_ids_chunk_size: int = Field(alias="BY_IDS_CHUNK_SIZE", default=250)
+    by_ids_max: int = Field(alias="BY_IDS_MAX", default=1000)
+    # Rows per fetch of the server-side cursors behind StreamByUser / StreamByIds
+    stream_yield_per: int = Field(alias="STREAM_YIELD_PER", default=100)
+    # The most ids one StreamByIds may ask for (0 = no limit)
+    stream_by_ids_max: int = Field(alias="STREAM_BY_IDS_MAX", default=10000)
+    # Seconds a stream may stay open, holding its connection, before it ends with DEADLINE_EXCEEDED (0 = no limit)
+    stream_max_seconds: float = Field(alias="STREAM_MAX_SECONDS", default=60.0)
+    # Products per UPDATE/transaction when propagating catalog prices
+    reprice_chunk_size: int = Field(alias="REPRICE_CHUNK_SIZE", default=500)
+    # Carts a reprice chunk may change and still invalidate by key; past it the whole cache is dropped
+    reprice_invalidate_max: int = Field(alias="REPRICE_INVALIDATE_MAX", default=1000)
+    # Default quantity policy of MergeCarts: sum, max, keep_user or keep_guest
+    cart_merge_policy: str = Field(alias="CART_MERGE_POLICY", default="sum")
+    # Empty/abandoned cart reaper (app.reaper); TTLs in seconds, <= 0 disables that kind
+    reaper_empty_ttl: float = Field(alias="REAPER_EMPTY_TTL", default=86400)
+    reaper_anonymous_ttl: float = Field(alias="REAPER_ANONYMOUS_TTL", default=30 * 86400)
+    reaper_closed_ttl: float = Field(alias="REAPER_CLOSED_TTL", default=7 * 86400)
+    reaper_batch_size: int = Field(alias="REAPER_BATCH_SIZE", default=500)
+    reaper_max_batches: int = Field(alias="REAPER_MAX_BATCHES", default=1000)
+    reaper_batch_pause: float = Field(alias="REAPER_BATCH_PAUSE", default=0.05)
+    reaper_archive: bool = Field(alias="REAPER_ARCHIVE", default=False)
+    # Embedded reaper period in seconds; 0 leaves reaping to the CronJob
+    reaper_interval: float = Field(alias="REAPER_INTERVAL", default=0)
+    # Requests/RPCs slower than this log their SQL statements (app.requests); 0 disables
+    slow_request_ms: float = Field(alias="SLOW_REQUEST_MS", default=0)
 
     class Config:
         env_file = ".env"
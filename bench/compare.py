@@ -0,0 +1,63 @@
+"""
+Compare two `bench.load run --out` reports and fail on regressions.
+
+Exits 1 when any op's p95 latency grew, or its throughput dropped, by more
+than `--max-regression` (a fraction), or when it sends more SQL statements
+per request than the baseline:
+
+    uv run python -m bench.compare baseline.json bench-results.json --max-regression 0.15
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+
+
+def _change(base: float, new: float) -> float:
+    return (new - base) / base if base else 0.0
+
+
+def compare(baseline: dict, current: dict, max_regression: float) -> list[str]:
+    """Print the comparison table; returns the regressions found."""
+    failures = []
+    print(f"{'op':14} {'p95 ms':>19} {'req/s':>21} {'stmts':>13}")
+    for name, new in current["ops"].items():
+        base = baseline["ops"].get(name)
+        if base is None or not base["requests"] or not new["requests"]:
+            continue
+        p95 = _change(base["p95_ms"], new["p95_ms"])
+        rps = _change(base["throughput_rps"], new["throughput_rps"])
+        print(
+            f"{name:14} {base['p95_ms']:7.2f} -> {new['p95_ms']:7.2f} {p95:+6.0%}"
+            f" {base['throughput_rps']:8.1f} -> {new['throughput_rps']:8.1f} {rps:+6.0%}"
+            f" {base['statements_per_request']:5.2f} -> {new['statements_per_request']:5.2f}"
+        )
+        if p95 > max_regression:
+            failures.append(f"{name}: p95 {p95:+.0%}")
+        if -rps > max_regression:
+            failures.append(f"{name}: throughput {rps:+.0%}")
+        # Statement counts are deterministic per op, unlike timings
+        if new["statements_per_request"] > base["statements_per_request"] + 0.01:
+            failures.append(f"{name}: {new['statements_per_request']} statements per request")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--max-regression", type=float, default=0.15)
+    args = parser.parse_args()
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    failures = compare(baseline, current, args.max_regression)
+    if failures:
+        print("\nregressions:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
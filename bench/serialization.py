@@ -0,0 +1,118 @@
+"""
+Serialization cost of ListByIds-sized responses, per cart and per item.
+
+Times encoding N synthetic cart views (the dicts `CartReadRepository`
+returns) with 1 and `--items` items each, and splits the cost into a fixed
+part per cart and a part per item:
+
+- rest/response_model: what FastAPI does for `response_model=list[CartOut]`
+  (validate, then dump_json)
+- rest/orjson: `serialization.json_response`
+- grpc/messages: `cart_pb2.Cart(...)` per cart passed to `CartList(carts=...)`
+- grpc/in_place: `serialization.cart_list`
+- rows/json, rows/orjson: decoding the items arrays Postgres sends as JSON text
+
+No database needed:
+
+    uv run python -m bench.serialization --carts 100 500 --items 10
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from datetime import UTC, datetime
+
+import orjson
+from pydantic import TypeAdapter
+
+from app.schemas import CartOut
+from app.serialization import cart_list, cart_pb2, json_response
+
+
+def make_carts(count: int, items: int) -> list[dict]:
+    created = datetime(2024, 5, 1, 12, 30, 0, 123456, tzinfo=UTC)
+    return [
+        {
+            "id": 1_000_000 + i,
+            "company_id": 17,
+            "user_id": 40_000 + i,
+            "cookie": None,
+            "status": 1,
+            "created_at": created,
+            "items": [
+                {"product_id": 5_000 + j, "name": f"product {5_000 + j}", "price": "129.99", "price_minor": 12999, "quantity": 2}
+                for j in range(items)
+            ],
+            "total_amount": f"{259.98 * items:.2f}",
+            "total_amount_minor": 25998 * items,
+        }
+        for i in range(count)
+    ]
+
+
+def _messages(carts: list[dict]) -> bytes:
+    return cart_pb2.CartList(
+        carts=[
+            cart_pb2.Cart(
+                id=c["id"],
+                company_id=c["company_id"],
+                user_id=c["user_id"] or 0,
+                cookie=c["cookie"] or "",
+                status=c["status"],
+                created_at=c["created_at"].isoformat(),
+                items=[cart_pb2.CartItem(**i) for i in c["items"]],
+                total_amount=c["total_amount"],
+                total_amount_minor=c["total_amount_minor"],
+            )
+            for c in carts
+        ]
+    ).SerializeToString()
+
+
+def paths() -> dict:
+    adapter = TypeAdapter(list[CartOut])
+    return {
+        "rest/response_model": lambda carts, raw: adapter.dump_json(adapter.validate_python(carts)),
+        "rest/orjson": lambda carts, raw: json_response(carts).body,
+        "grpc/messages": lambda carts, raw: _messages(carts),
+        "grpc/in_place": lambda carts, raw: cart_list(carts).SerializeToString(),
+        "rows/json": lambda carts, raw: [json.loads(r) for r in raw],
+        "rows/orjson": lambda carts, raw: [orjson.loads(r) for r in raw],
+    }
+
+
+def timed(fn, carts: list[dict], raw: list[str], min_time: float) -> float:
+    """Best seconds per call over repeats of at least `min_time`."""
+    best = float("inf")
+    for _ in range(5):
+        calls, started = 0, time.perf_counter()
+        while (elapsed := time.perf_counter() - started) < min_time:
+            fn(carts, raw)
+            calls += 1
+        best = min(best, elapsed / calls)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--carts", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--items", type=int, default=10, help="items per cart of the larger run (the other has 1)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per repeat")
+    args = parser.parse_args()
+
+    print(f"{'carts':>6} {'path':22} {'total ms':>9} {'us/cart':>9} {'us/item':>9}")
+    for count in args.carts:
+        small, large = make_carts(count, 1), make_carts(count, args.items)
+        raw_small = [json.dumps(c["items"]) for c in small]
+        raw_large = [json.dumps(c["items"]) for c in large]
+        for name, fn in paths().items():
+            t1 = timed(fn, small, raw_small, args.min_time)
+            tn = timed(fn, large, raw_large, args.min_time)
+            per_item = (tn - t1) / (count * (args.items - 1))
+            per_cart = t1 / count - per_item
+            print(f"{count:6} {name:22} {tn * 1e3:9.3f} {per_cart * 1e6:9.2f} {per_item * 1e6:9.2f}")
+
+
+if __name__ == "__main__":
+    main()
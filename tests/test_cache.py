@@ -0,0 +1,135 @@
+import asyncio
+from decimal import Decimal
+
+from app.cache import (
+    MISSING,
+    CartCache,
+    cart_cache,
+    cart_key,
+    decode_keys,
+    encode_payloads,
+)
+from app.cache_listener import CacheInvalidationListener, asyncpg_dsn
+from app.models import Cart, CartItem
+from app.services.cart_service import CartService
+from app.settings import settings
+
+
+def test_lru_eviction_and_counters():
+    cache = CartCache(maxsize=2, ttl=60)
+    cache.set("a", 1, cache.token())
+    cache.set("b", None, cache.token())
+    assert cache.get("a") == 1
+    cache.set("c", 3, cache.token())  # evicts "b", the least recently used
+
+    assert cache.get("b") is MISSING
+    assert cache.get("c") == 3
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 2, "misses": 1, "evictions": 1, "invalidations": 0}
+
+
+def test_ttl_expiry():
+    cache = CartCache(maxsize=10, ttl=-1)
+    cache.set("a", 1, cache.token())
+    assert cache.get("a") is MISSING
+    assert cache.evictions == 1
+
+
+def test_value_read_during_invalidation_is_not_cached():
+    cache = CartCache(maxsize=10, ttl=60)
+    token = cache.token()
+    cache.invalidate(["a"])
+    cache.set("a", "stale", token)
+    assert cache.get("a") is MISSING
+
+
+async def test_writes_invalidate_cached_reads(session):
+    async with session.begin():
+        cart = Cart(company_id=1, user_id=42)
+        session.add(cart)
+        await session.flush()
+        session.add(CartItem(cart_id=cart.id, product_id=1, name="Pen", price=Decimal("1.00"), quantity=1))
+    cart_id = cart.id
+    svc = CartService(session)
+
+    assert (await svc.get_active(1, 42, None))["total_amount"] == "1.00"
+    assert (await svc.get_cart(cart_id))["total_amount"] == "1.00"
+    assert cart_cache.get(("active", 1, 42, None)) is not MISSING
+    await session.rollback()
+
+    async with session.begin():
+        await svc.update_qty(cart_id, 1, 5)
+
+    assert (await svc.get_active(1, 42, None))["total_amount"] == "5.00"
+    assert (await svc.get_cart(cart_id))["total_amount"] == "5.00"
+    await session.rollback()
+
+    async with session.begin():
+        await svc.remove_item(cart_id, 1)
+
+    assert await svc.get_active(1, 42, None) is None
+    assert await svc.get_cart(cart_id) is None
+
+
+async def test_reprice_invalidates_only_the_carts_it_changed(session, monkeypatch):
+    async with session.begin():
+        carts = [Cart(company_id=1, user_id=42), Cart(company_id=1, user_id=43)]
+        session.add_all(carts)
+        await session.flush()
+        for cart, product_id in zip(carts, (1, 2), strict=True):
+            session.add(CartItem(cart_id=cart.id, product_id=product_id, name="Pen", price=Decimal("1.00"), quantity=1))
+    repriced, untouched = (cart.id for cart in carts)
+    svc = CartService(session)
+    for cart_id in (repriced, untouched):
+        await svc.get_cart(cart_id)
+    await session.rollback()
+
+    await svc.reprice_products([(1, "2.00", None)])
+    assert cart_cache.get(cart_key(repriced)) is MISSING
+    assert cart_cache.get(cart_key(untouched)) is not MISSING
+
+    # Past the threshold a chunk drops everything
+    monkeypatch.setattr(settings, "reprice_invalidate_max", 0)
+    await svc.reprice_products([(1, "3.00", None)])
+    assert cart_cache.get(cart_key(untouched)) is MISSING
+
+
+async def test_commit_notifies_other_replicas(database_url, session):
+    async with session.begin():
+        cart = Cart(company_id=1, user_id=42)
+        session.add(cart)
+        await session.flush()
+        session.add(CartItem(cart_id=cart.id, product_id=1, name="Pen", price=Decimal("1.00"), quantity=1))
+    cart_id = cart.id
+    svc = CartService(session)
+
+    replica = CartCache(maxsize=10, ttl=60)
+    listener = CacheInvalidationListener(asyncpg_dsn(database_url), settings.cart_cache_channel, replica)
+    task = asyncio.create_task(listener.run())
+    try:
+        await asyncio.wait_for(listener.connected.wait(), timeout=5)
+        replica.set(cart_key(cart_id), "cached", replica.token())
+
+        await session.begin()
+        await svc.update_qty(cart_id, 1, 2)
+        await session.rollback()
+        await asyncio.sleep(0.2)
+        assert replica.get(cart_key(cart_id)) == "cached"
+
+        async with session.begin():
+            await svc.update_qty(cart_id, 1, 3)
+        for _ in range(50):
+            if replica.get(cart_key(cart_id)) is MISSING:
+                break
+            await asyncio.sleep(0.1)
+        else:
+            raise AssertionError("replica cache was not invalidated")
+    finally:
+        task.cancel()
+
+
+def test_large_invalidations_are_split_to_fit_notify():
+    keys = {cart_key(i) for i in range(5000)}
+    payloads = encode_payloads(keys)
+    assert len(payloads) > 1
+    assert all(len(p.encode()) < 8000 for p in payloads)
+    assert {key for p in payloads for key in decode_keys(p)} == keys
@@ -0,0 +1,356 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Cart, CartItem, CartStatus
+from app.repositories.cart_read_repo import CartReadRepository
+from app.repositories.cart_repo import CartItemRepository, CartRepository
+from app.services.cart_service import CartMutation, CartService, fold_mutations
+
+
+async def _seed(session) -> tuple[Cart, Cart]:
+    full = Cart(company_id=1, user_id=42, status=CartStatus.ACTIVE.value)
+    empty = Cart(company_id=1, cookie="anon", status=CartStatus.ACTIVE.value)
+    session.add_all([full, empty])
+    await session.flush()
+    session.add_all([
+        CartItem(cart_id=full.id, product_id=10, name="Laptop", price=Decimal("999.99"), quantity=1),
+        CartItem(cart_id=full.id, product_id=11, name="Mouse", price=Decimal("29.99"), quantity=2),
+    ])
+    await session.commit()
+    return full, empty
+
+
+def _count_statements(engine) -> list[str]:
+    statements: list[str] = []
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *a: statements.append(a[2]))
+    return statements
+
+
+async def test_cart_view_is_one_statement(engine, session):
+    full, empty = await _seed(session)
+    session.expunge_all()
+    statements = _count_statements(engine)
+
+    cart = await CartReadRepository(session).get_by_id(full.id)
+
+    assert len(statements) == 1
+    assert cart["user_id"] == 42
+    assert cart["items"] == [
+        {"product_id": 10, "name": "Laptop", "price": "999.99", "price_minor": 99999, "quantity": 1},
+        {"product_id": 11, "name": "Mouse", "price": "29.99", "price_minor": 2999, "quantity": 2},
+    ]
+    assert cart["total_amount"] == "1059.97"
+    assert not session.identity_map
+
+
+async def test_empty_carts_are_not_returned(session):
+    full, empty = await _seed(session)
+    repo = CartReadRepository(session)
+
+    assert await repo.get_active(company_id=1, user_id=None, cookie="anon") is None
+    assert await repo.get_by_id(empty.id) is None
+
+    carts = await repo.list_by_ids_ordered([empty.id, 999, full.id])
+    assert [c["id"] for c in carts] == [full.id]
+
+
+async def test_list_by_ids_in_chunks_keeps_request_order(engine, session, monkeypatch):
+    from app.settings import settings
+
+    async with session.begin():
+        carts = [Cart(company_id=company_id, user_id=42) for company_id in range(1, 6)]
+        session.add_all(carts)
+        await session.flush()
+        for cart in carts:
+            session.add(CartItem(cart_id=cart.id, product_id=1, name="Pen", price=Decimal("1.00"), quantity=1))
+    c1, c2, c3, c4, c5 = (c.id for c in carts)
+    svc = CartService(session)
+    monkeypatch.setattr(settings, "by_ids_chunk_size", 2)
+    statements = _count_statements(engine)
+
+    found = await svc.list_by_ids([c5, 999, c1, c3, c1, c2, c4])
+    assert [c["id"] for c in found] == [c5, c1, c3, c2, c4]
+    # 6 distinct ids, one array parameter per chunk of 2
+    assert len([s for s in statements if s.startswith("WITH req")]) == 3
+
+    monkeypatch.setattr(settings, "by_ids_max", 3)
+    with pytest.raises(ValueError):
+        await svc.list_by_ids([c1, c2, c3, c4])
+
+
+async def test_upsert_cart_returns_existing_active(session):
+    repo = CartRepository(session)
+    async with session.begin():
+        by_user = await repo.upsert_cart(company_id=1, user_id=42, cookie=None)
+        assert (await repo.upsert_cart(company_id=1, user_id=42, cookie=None)).id == by_user.id
+        by_cookie = await repo.upsert_cart(company_id=1, user_id=None, cookie="anon")
+        assert (await repo.upsert_cart(company_id=1, user_id=None, cookie="anon")).id == by_cookie.id
+        assert by_cookie.id != by_user.id
+        # Past the 5 custom plans of a prepared statement: arbiter index inference must still work
+        for _ in range(8):
+            assert (await repo.upsert_cart(company_id=1, user_id=42, cookie=None)).id == by_user.id
+
+
+async def test_upsert_item_is_single_statement(engine, session):
+    repo = CartItemRepository(session)
+    async with session.begin():
+        cart = await CartRepository(session).upsert_cart(company_id=1, user_id=42, cookie=None)
+        statements = _count_statements(engine)
+        await repo.upsert_item(cart.id, 10, "Laptop", 99999, 1)
+        owner = await repo.upsert_item(cart.id, 10, "Laptop Pro", 109900, 3)
+        assert len(statements) == 2
+        assert (owner.company_id, owner.user_id, owner.cookie) == (1, 42, None)
+        item = await session.scalar(select(CartItem).where(CartItem.cart_id == cart.id))
+        assert (item.name, item.price, item.price_minor, item.quantity) == ("Laptop Pro", Decimal("1099.00"), 109900, 3)
+        assert await repo.upsert_item(cart.id + 1, 10, "Laptop", 99999, 1) is None
+
+
+async def test_list_by_user_keyset_pages_skip_empty_carts(session):
+    async with session.begin():
+        carts = [Cart(company_id=company_id, user_id=42) for company_id in range(1, 8)]
+        session.add_all(carts)
+        await session.flush()
+        for cart in carts[::2]:
+            session.add(CartItem(cart_id=cart.id, product_id=1, name="Pen", price=Decimal("1.00"), quantity=1))
+    svc = CartService(session)
+
+    page, cursor = await svc.list_by_user(42, None, None, limit=2, offset=0)
+    assert [c["id"] for c in page] == [carts[6].id, carts[4].id]
+    page, cursor = await svc.list_by_user(42, None, None, limit=2, offset=0, cursor=cursor)
+    assert [c["id"] for c in page] == [carts[2].id, carts[0].id]
+    page, cursor = await svc.list_by_user(42, None, None, limit=2, offset=0, cursor=cursor)
+    assert page == [] and cursor is None
+
+    with pytest.raises(ValueError):
+        await svc.list_by_user(42, None, None, limit=2, offset=0, cursor="not-a-cursor")
+
+
+async def test_trigger_maintains_cart_totals(session):
+    repo = CartItemRepository(session)
+    async with session.begin():
+        cart = await session.get(Cart, (await CartRepository(session).upsert_cart(company_id=1, user_id=42, cookie=None)).id)
+        assert tuple(await repo.upsert_item(cart.id, 10, "Laptop", 99999, 1)) == (1, 42, None)
+        await repo.upsert_item(cart.id, 11, "Mouse", 2999, 2)
+        await repo.upsert_item(cart.id, 11, "Mouse", 2500, 4)
+        await repo.update_quantity(cart.id, 10, 2)
+        await session.refresh(cart)
+        assert (cart.item_count, cart.total_quantity, cart.total_amount) == (2, 6, Decimal("2099.98"))
+        assert cart.total_amount_minor == 209998
+
+        assert tuple(await repo.remove_item(cart.id, 10)) == (1, 42, None)
+        await session.refresh(cart)
+        assert (cart.item_count, cart.total_quantity, cart.total_amount) == (1, 4, Decimal("100.00"))
+        assert cart.total_amount_minor == 10000
+
+        # Writers of the decimal column (older code, ad-hoc SQL) keep both in step
+        await session.execute(update(CartItem).where(CartItem.cart_id == cart.id).values(price=Decimal("0.35")))
+        await session.refresh(cart)
+        assert (cart.total_amount, cart.total_amount_minor) == (Decimal("1.40"), 140)
+
+        assert await repo.remove_item(cart.id, 10) is None
+        assert await repo.update_quantity(cart.id, 10, 1) is None
+        assert tuple(await repo.remove_item(cart.id, 11)) == (1, 42, None)
+        assert await CartRepository(session).delete_if_empty(cart.id) is True
+        assert await CartRepository(session).get_by_id(cart.id) is None
+
+
+async def test_active_summary(session):
+    full, empty = await _seed(session)
+    repo = CartReadRepository(session)
+
+    summary = await repo.get_active_summary(company_id=1, user_id=42, cookie=None)
+    assert summary == {"id": full.id, "status": CartStatus.ACTIVE.value, "item_count": 2, "total_amount": "1059.97", "total_amount_minor": 105997}
+    assert await repo.get_active_summary(company_id=1, user_id=None, cookie="anon") is None
+
+
+def test_fold_mutations_keeps_last_effect_per_product():
+    upserts, quantities, removals = fold_mutations([
+        CartMutation("upsert", 1, "Pen", "1.00", 1),
+        CartMutation("set_qty", 1, quantity=5),
+        CartMutation("set_qty", 2, quantity=3),
+        CartMutation("remove", 3),
+        CartMutation("set_qty", 3, quantity=2),
+        CartMutation("set_qty", 4, quantity=0),
+    ])
+    assert upserts == [{"product_id": 1, "name": "Pen", "price_minor": 100, "quantity": 5}]
+    assert quantities == {2: 3}
+    assert sorted(removals) == [3, 4]
+
+    upserts, _, _ = fold_mutations([CartMutation("upsert", 1, "Pen", 250, 1), CartMutation("upsert", 2, "Ink", "0.005", 1)])
+    assert [u["price_minor"] for u in upserts] == [250, 1]
+
+    with pytest.raises(ValueError):
+        fold_mutations([CartMutation("upsert", 1, "Pen", "abc", 1)])
+
+
+async def test_batch_mutate(engine, session):
+    full, empty = await _seed(session)
+    svc = CartService(session)
+    statements = _count_statements(engine)
+    async with session.begin():
+        cart = await svc.batch_mutate(full.id, [
+            CartMutation("upsert", 12, "Cable", "5.00", 2),
+            CartMutation("set_qty", 10, quantity=3),
+            CartMutation("remove", 11),
+        ])
+    assert cart["items"] == [
+        {"product_id": 10, "name": "Laptop", "price": "999.99", "price_minor": 99999, "quantity": 3},
+        {"product_id": 12, "name": "Cable", "price": "5.00", "price_minor": 500, "quantity": 2},
+    ]
+    assert cart["total_amount"] == "3009.97"
+    # lock, notify, insert, update, delete, delete-if-empty, final read
+    assert len([s for s in statements if s not in ("BEGIN", "COMMIT")]) <= 7
+
+    async with session.begin():
+        assert await svc.batch_mutate(full.id, [CartMutation("remove", 10), CartMutation("remove", 12)]) is None
+    assert await CartReadRepository(session).get_by_id(full.id) is None
+
+
+async def test_reprice_products_touches_only_active_carts(session):
+    async with session.begin():
+        active = Cart(company_id=1, user_id=42)
+        locked = Cart(company_id=1, user_id=43, status=CartStatus.LOCKED.value)
+        session.add_all([active, locked])
+        await session.flush()
+        for cart in (active, locked):
+            session.add(CartItem(cart_id=cart.id, product_id=10, name="Laptop", price=Decimal("999.99"), quantity=2))
+            session.add(CartItem(cart_id=cart.id, product_id=11, name="Mouse", price=Decimal("29.99"), quantity=1))
+    active_id, locked_id = active.id, locked.id
+    svc = CartService(session)
+
+    report = await svc.reprice_products(
+        [(10, "899.00", None), (11, "19.99", "Mouse v2"), (12, "1.00", None), (10, "949.00", None)],
+        chunk_size=2,
+    )
+    assert report == {"products": 3, "chunks": 2, "rows_updated": 2}
+
+    reads = CartReadRepository(session)
+    cart = await reads.get_by_id(active_id)
+    assert cart["items"] == [
+        {"product_id": 10, "name": "Laptop", "price": "949.00", "price_minor": 94900, "quantity": 2},
+        {"product_id": 11, "name": "Mouse v2", "price": "19.99", "price_minor": 1999, "quantity": 1},
+    ]
+    assert cart["total_amount"] == "1917.99"
+    assert (await reads.get_by_id(locked_id))["total_amount"] == "2029.97"
+
+
+async def _seed_login(session, with_user_cart: bool = True) -> tuple[int | None, int]:
+    async with session.begin():
+        guest = Cart(company_id=1, cookie="guest")
+        user = Cart(company_id=1, user_id=42) if with_user_cart else None
+        session.add_all([c for c in (guest, user) if c])
+        await session.flush()
+        session.add_all([
+            CartItem(cart_id=guest.id, product_id=10, name="Laptop v2", price=Decimal("899.00"), quantity=1),
+            CartItem(cart_id=guest.id, product_id=12, name="Bag", price=Decimal("50.00"), quantity=1),
+        ])
+        if user:
+            session.add_all([
+                CartItem(cart_id=user.id, product_id=10, name="Laptop", price=Decimal("999.99"), quantity=2),
+                CartItem(cart_id=user.id, product_id=11, name="Mouse", price=Decimal("29.99"), quantity=1),
+            ])
+    return (user.id if user else None), guest.id
+
+
+@pytest.mark.parametrize(
+    ("policy", "laptop"),
+    [
+        ("sum", ("Laptop", "999.99", 99999, 3)),
+        ("max", ("Laptop", "999.99", 99999, 2)),
+        ("keep_user", ("Laptop", "999.99", 99999, 2)),
+        ("keep_guest", ("Laptop v2", "899.00", 89900, 1)),
+    ],
+)
+async def test_merge_carts_policies(engine, session, policy, laptop):
+    user_id, guest_id = await _seed_login(session)
+    svc = CartService(session)
+    statements = _count_statements(engine)
+
+    async with session.begin():
+        cart = await svc.merge_carts(1, 42, "guest", policy)
+
+    # 2 locks, NOTIFY, INSERT ... SELECT ... ON CONFLICT, DELETE, final read (+ BEGIN/COMMIT)
+    assert len([s for s in statements if s not in ("BEGIN", "COMMIT")]) == 6
+    name, price, price_minor, quantity = laptop
+    assert cart["id"] == user_id
+    assert cart["items"] == [
+        {"product_id": 10, "name": name, "price": price, "price_minor": price_minor, "quantity": quantity},
+        {"product_id": 11, "name": "Mouse", "price": "29.99", "price_minor": 2999, "quantity": 1},
+        {"product_id": 12, "name": "Bag", "price": "50.00", "price_minor": 5000, "quantity": 1},
+    ]
+    assert await CartReadRepository(session).get_by_id(guest_id) is None
+    assert await svc.get_active(1, None, "guest") is None
+
+
+async def test_merge_carts_reassigns_guest_cart_without_user_cart(session):
+    _, guest_id = await _seed_login(session, with_user_cart=False)
+    svc = CartService(session)
+
+    async with session.begin():
+        cart = await svc.merge_carts(1, 42, "guest")
+
+    assert (cart["id"], cart["user_id"], cart["cookie"]) == (guest_id, 42, None)
+    assert (await svc.get_active(1, 42, None))["id"] == guest_id
+    assert await svc.get_active(1, None, "guest") is None
+    await session.rollback()
+
+    with pytest.raises(ValueError):
+        await svc.merge_carts(1, 42, "guest", "newest")
+
+
+async def test_increment_item_is_atomic(engine, session):
+    full, _ = await _seed(session)
+    cart_id = full.id
+    svc = CartService(session)
+    statements = _count_statements(engine)
+
+    async with session.begin():
+        cart = await svc.increment_item(cart_id, 11, 3)
+
+    # increment CTE, NOTIFY, final read (+ BEGIN/COMMIT)
+    assert len([s for s in statements if s not in ("BEGIN", "COMMIT")]) == 3
+    assert [i["quantity"] for i in cart["items"]] == [1, 5]
+    assert cart["total_amount"] == "1149.94"
+
+    # Concurrent clicks from separate sessions all land
+    async def click():
+        async with AsyncSession(engine) as other, other.begin():
+            await CartService(other).increment_item(cart_id, 11, 1)
+
+    await asyncio.gather(*(click() for _ in range(10)))
+    assert [i["quantity"] for i in (await svc.get_cart(cart_id))["items"]] == [1, 15]
+    await session.rollback()
+
+    async with session.begin():
+        cart = await svc.increment_item(cart_id, 10, -1)
+    assert [i["product_id"] for i in cart["items"]] == [11]
+    async with session.begin():
+        assert await svc.increment_item(cart_id, 10, 1) is None
+        assert await svc.increment_item(cart_id, 11, -100) is None
+    assert await svc.get_cart(cart_id) is None
+    assert await session.get(Cart, cart_id) is None
+
+
+async def test_concurrent_removals_of_the_last_items_delete_the_cart(engine, session):
+    full, _ = await _seed(session)
+    cart_id = full.id
+
+    async def remove(product_id):
+        async with AsyncSession(engine) as other, other.begin():
+            return await CartService(other).remove_item(cart_id, product_id)
+
+    # The first removal holds the cart row until it commits; the second waits
+    # on it inside the totals trigger, then finds the cart empty
+    async with AsyncSession(engine) as first:
+        async with first.begin():
+            assert [i["product_id"] for i in (await CartService(first).remove_item(cart_id, 10))["items"]] == [11]
+            second = asyncio.create_task(remove(11))
+            await asyncio.sleep(0.2)
+            assert not second.done()
+        assert await second is None
+
+    assert (await session.scalars(select(Cart.id).where(Cart.id == cart_id))).all() == []
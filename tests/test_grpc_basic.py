@@ -9,3 +9,40 @@ async def test_placeholder():
     assert True
 
 
+async def test_load_shedding():
+    import asyncio
+
+    import grpc
+    from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+    from app.grpc.interceptors import LoadSheddingInterceptor
+
+    async def slow(request, context):
+        await asyncio.sleep(0.2)
+        return request
+
+    async def pool_timeout(request, context):
+        raise PoolTimeoutError("QueuePool limit reached")
+
+    handler = grpc.method_handlers_generic_handler("test.Test", {
+        "Slow": grpc.unary_unary_rpc_method_handler(slow),
+        "PoolTimeout": grpc.unary_unary_rpc_method_handler(pool_timeout),
+    })
+    server = grpc.aio.server(interceptors=[LoadSheddingInterceptor(max_in_flight=1)])
+    server.add_generic_rpc_handlers((handler,))
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    try:
+        async with grpc.aio.insecure_channel(f"127.0.0.1:{port}") as channel:
+            slow_rpc = channel.unary_unary("/test.Test/Slow")
+            results = await asyncio.gather(slow_rpc(b"a"), slow_rpc(b"b"), return_exceptions=True)
+            [error] = [r for r in results if isinstance(r, grpc.aio.AioRpcError)]
+            assert error.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+            # The slot is released once the admitted RPC finishes
+            assert await slow_rpc(b"c") == b"c"
+
+            with pytest.raises(grpc.aio.AioRpcError) as exc:
+                await channel.unary_unary("/test.Test/PoolTimeout")(b"")
+            assert exc.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+    finally:
+        await server.stop(None)
@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+import grpc
+import pytest
+from sqlalchemy import text
+
+from app.db import create_engine
+from app.grpc.interceptors import LoadSheddingInterceptor
+from app.settings import settings
+
+
+async def test_exhausted_pool_sheds_without_waiting_for_a_connection(database_url, monkeypatch):
+    monkeypatch.setattr(settings, "db_pool_size", 1)
+    monkeypatch.setattr(settings, "db_max_overflow", 0)
+    monkeypatch.setattr(settings, "db_pool_timeout", 30.0)
+    engine = create_engine(database_url)
+
+    async def query(request, context):
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        return request
+
+    handler = grpc.method_handlers_generic_handler("test.Test", {"Query": grpc.unary_unary_rpc_method_handler(query)})
+    server = grpc.aio.server(interceptors=[LoadSheddingInterceptor(saturated=engine.pool.saturated)])
+    server.add_generic_rpc_handlers((handler,))
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    try:
+        async with grpc.aio.insecure_channel(f"127.0.0.1:{port}") as channel:
+            rpc = channel.unary_unary("/test.Test/Query")
+            assert await rpc(b"a") == b"a"
+
+            async with engine.connect() as held:
+                await held.execute(text("SELECT 1"))
+                started = time.perf_counter()
+                with pytest.raises(grpc.aio.AioRpcError) as exc:
+                    await asyncio.wait_for(rpc(b"b"), timeout=5)
+                assert exc.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+                assert time.perf_counter() - started < 1
+
+            # Admitted again once the connection is back in the pool
+            assert await rpc(b"c") == b"c"
+    finally:
+        await server.stop(None)
+        await engine.dispose()
@@ -0,0 +1,82 @@
+import asyncio
+import os
+import time
+
+from app.metrics import Counter, Histogram, Registry, start_metrics_server
+
+
+def test_exposition_format():
+    registry = Registry()
+    requests = registry.register(Counter("requests_total", "Requests.", ("route",)))
+    latency = registry.register(Histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0)))
+    requests.inc('/a"b')
+    latency.observe(0.05, "/a")
+    latency.observe(0.5, "/a")
+    latency.observe(5, "/a")
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{route="/a\\"b"} 1',
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1.0"} 2',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+        'latency_seconds_sum{route="/a"} 5.55',
+        'latency_seconds_count{route="/a"} 3',
+    ]
+
+
+async def test_metrics_endpoint(client):
+    await client.get("/api/v1/cart/1")
+    await client.get("/no/such/path")
+
+    r = await client.get("/metrics")
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = r.text
+    assert 'http_requests_total{method="GET",route="/api/v1/cart/{cart_id}",status="404"}' in body
+    assert 'http_requests_total{method="GET",route="<unmatched>",status="404"}' in body
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/v1/cart/{cart_id}"}' in body
+    # The scrape itself is in flight
+    assert "http_requests_in_flight 1" in body
+    assert 'db_pool_connections{engine="primary",state="checked_out"} 0' in body
+    assert "db_pool_acquire_seconds_count" in body
+    assert 'cart_cache_operations_total{op="misses"}' in body
+
+
+def test_workers_share_samples_through_a_directory(tmp_path):
+    workers = []
+    for name in ("1", "2", "3"):
+        worker = Registry()
+        worker.register(Counter("rpcs_total", "RPCs.", ("method",))).inc("Get", amount=int(name))
+        worker.share(str(tmp_path), name)
+        worker.dump()
+        workers.append(worker)
+    # Worker 3 exited without cleaning up
+    old = time.time() - 3600
+    os.utime(tmp_path / "3.json", (old, old))
+
+    assert sorted(workers[0].render().splitlines()) == sorted([
+        "# HELP rpcs_total RPCs.",
+        "# TYPE rpcs_total counter",
+        'rpcs_total{method="Get",worker="1"} 1',
+        'rpcs_total{method="Get",worker="2"} 2',
+    ])
+    workers[1].discard()
+    assert "worker=\"2\"" not in workers[0].render()
+
+
+async def test_metrics_server_for_grpc_workers():
+    server = await start_metrics_server(0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: test\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+    finally:
+        server.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 200 OK")
+    assert "# TYPE grpc_server_handled_total counter" in body.decode()
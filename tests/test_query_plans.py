@@ -0,0 +1,150 @@
+"""
+EXPLAIN-based regression test: every repository query must be served by an
+index on a seeded dataset, never by a sequential scan of cart/cart_item.
+"""
+import json
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from sqlalchemy import event, text
+
+from app.models import CartStatus
+from app.repositories.cart_read_repo import CartReadRepository
+from app.repositories.cart_repo import CartItemRepository, CartRepository
+
+CARTS = 20_000
+USERS = 2_000
+
+SEED = [
+    # Odd ids are user carts, even ids are anonymous cookie carts; (company, user) pairs never repeat
+    f"""
+    INSERT INTO cart (id, user_id, company_id, cookie, status)
+    SELECT i,
+           CASE WHEN i % 2 = 1 THEN i % {USERS} + 1 END,
+           i / {USERS} + 1,
+           CASE WHEN i % 2 = 0 THEN 'cookie-' || i END,
+           i % 4 + 1
+    FROM generate_series(1, {CARTS}) AS i
+    """,
+    "SELECT setval(pg_get_serial_sequence('cart', 'id'), (SELECT max(id) FROM cart))",
+    """
+    INSERT INTO cart_item (cart_id, product_id, name, price, quantity)
+    SELECT c.id, (c.id * 7 + p) % 5000, 'product', 9.99, p
+    FROM cart c CROSS JOIN generate_series(1, 3) AS p
+    """,
+    "ANALYZE cart",
+    "ANALYZE cart_item",
+]
+
+
+def _scans(plan: dict):
+    yield plan["Node Type"], plan.get("Relation Name")
+    for child in plan.get("Plans", []):
+        yield from _scans(child)
+
+
+@pytest.fixture
+async def seeded(engine):
+    async with engine.begin() as conn:
+        for stmt in SEED:
+            await conn.execute(text(stmt))
+    return engine
+
+
+async def test_repository_queries_use_indexes(seeded, session):
+    captured: list[tuple[str, object]] = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not statement.startswith("EXPLAIN"):
+            captured.append((statement, parameters))
+
+    event.listen(seeded.sync_engine, "before_cursor_execute", capture)
+
+    carts = CartRepository(session)
+    items = CartItemRepository(session)
+    reads = CartReadRepository(session)
+    user_id, company_id = 43, 1  # cart 43
+
+    await session.begin()
+    await reads.get_by_id(43)
+    await reads.get_active(company_id, user_id, None)
+    await reads.get_active(2, None, "cookie-2000")
+    await reads.list_by_user(user_id, None, None, 50, 0)
+    await reads.list_by_user(user_id, company_id, None, 50, 0)
+    await reads.list_by_user(user_id, company_id, CartStatus.ACTIVE.value, 50, 0)
+    await reads.list_by_user(user_id, None, None, 50, 0, after_id=10_000)
+    await reads.list_by_ids_ordered([5, 43, 17_001])
+    async for _ in reads.stream_by_user(user_id, company_id, None, None, 50, yield_per=10):
+        pass
+    await reads.get_active_summary(company_id, user_id, None)
+    await carts.get_by_id(43)
+    await carts.get_active(company_id, user_id, None)
+    await carts.upsert_cart(company_id, user_id, None)
+    await carts.upsert_cart(2, None, "cookie-2000")
+    await items.upsert_item(43, 1, "Pen", 100, 2)
+    await items.update_quantity(43, 1, 3)
+    await items.remove_item(45, (45 * 7 + 1) % 5000)
+    await carts.change_status(47, CartStatus.CANCELLED.value)
+    await carts.delete_cart(49)
+    await carts.lock_active(2, None, "cookie-2000")
+    await carts.lock_active(company_id, user_id, None)
+    await items.merge_into(43, 45, "sum")
+    await items.increment(43, 1, -1)
+    await items.bulk_upsert(43, [{"product_id": 2, "name": "Ink", "price_minor": 100, "quantity": 1}])
+    await items.bulk_set_quantity(43, {1: 2, 2: 3})
+    await items.bulk_remove(43, [2])
+    await items.reprice_active([(1, 150, None), ((45 * 7 + 2) % 5000, 250, "Pencil")])
+    await carts.lock(43)
+    await carts.delete_if_empty(51)
+    await carts.assign_to_user(51, user_id)
+    cutoff = datetime.now(UTC) - timedelta(days=1)
+    for kind in ("empty", "anonymous", "closed"):
+        await carts.reap_batch(kind, cutoff, None, 100)
+        await carts.reap_batch(kind, cutoff, (cutoff, 10), 100, archive=True)
+
+    assert captured
+    conn = await session.connection()
+    for statement, parameters in captured:
+        res = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+        raw = res.scalar_one()
+        plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+        seq_scans = [rel for node, rel in _scans(plan) if node == "Seq Scan" and rel in ("cart", "cart_item")]
+        assert not seq_scans, f"sequential scan on {seq_scans} for:\n{statement}"
+    await session.rollback()
+
+
+async def _relations(session, run) -> set[str]:
+    """Tables in the plan of every statement issued by `run()`."""
+    captured: list[tuple[str, object]] = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not statement.startswith("EXPLAIN"):
+            captured.append((statement, parameters))
+
+    sync_engine = session.bind.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", capture)
+    try:
+        await run()
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", capture)
+    conn = await session.connection()
+    relations = set()
+    for statement, parameters in captured:
+        raw = (await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters)).scalar_one()
+        plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+        relations |= {rel for _, rel in _scans(plan) if rel}
+    return relations
+
+
+async def test_list_by_user_prunes_archive_partitions(engine, session):
+    reads = CartReadRepository(session)
+    await session.begin()
+
+    async def by_status(status):
+        return await _relations(session, lambda: reads.list_by_user(43, 1, status, 50, 0))
+
+    assert "cart_archive_cancelled" not in await by_status(CartStatus.CHECKED_OUT.value)
+    assert "cart_archive_checked_out" in await by_status(CartStatus.CHECKED_OUT.value)
+    assert not {rel for rel in await by_status(CartStatus.ACTIVE.value) if rel.startswith("cart_archive")}
+    assert "cart_archive_other" not in await by_status(None)
+    await session.rollback()
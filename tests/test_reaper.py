@@ -0,0 +1,120 @@
+from datetime import UTC, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import select
+
+from app.models import Cart, CartArchive, CartItem, CartStatus
+from app.reaper import CartReaper
+from app.repositories.cart_read_repo import CartReadRepository
+from app.services.cart_service import CartService
+
+DAY = 86400
+
+
+async def _seed_reapable(session) -> dict[str, int]:
+    old = datetime.now(UTC) - timedelta(days=60)
+    carts = {
+        "empty_old": Cart(company_id=1, user_id=1, created_at=old),
+        "empty_new": Cart(company_id=1, user_id=2),
+        "anon_stale": Cart(company_id=1, cookie="stale", created_at=old),
+        "anon_fresh": Cart(company_id=1, cookie="fresh", created_at=old),
+        "anon_checked_out": Cart(company_id=1, cookie="paid", created_at=old, status=CartStatus.CHECKED_OUT.value),
+        "user_stale": Cart(company_id=1, user_id=3, created_at=old),
+    }
+    async with session.begin():
+        session.add_all(carts.values())
+        await session.flush()
+        for name, cart in carts.items():
+            if not name.startswith("empty"):
+                session.add(CartItem(cart_id=cart.id, product_id=1, name="Pen", price=Decimal("1.00"), quantity=1))
+    # Item inserts bumped updated_at, and trg_cart_touch overrides explicit values,
+    # so backdate everything but the fresh cart with the trigger disabled
+    async with session.begin():
+        conn = await session.connection()
+        await conn.exec_driver_sql("ALTER TABLE cart DISABLE TRIGGER trg_cart_touch")
+        await conn.exec_driver_sql(
+            "UPDATE cart SET updated_at = created_at WHERE cookie IS DISTINCT FROM 'fresh'"
+        )
+        await conn.exec_driver_sql("ALTER TABLE cart ENABLE TRIGGER trg_cart_touch")
+    return {name: cart.id for name, cart in carts.items()}
+
+
+async def test_reaper_deletes_empty_and_stale_anonymous_carts(session):
+    ids = await _seed_reapable(session)
+
+    reaper = CartReaper(session, ttls={"empty": DAY, "anonymous": 30 * DAY}, batch_size=1, pause=0, archive=False)
+    report = await reaper.run_once()
+
+    assert report == {"archive": False, "batches": 4, "empty": 1, "anonymous": 1, "closed": 0}
+    left = set((await session.scalars(select(Cart.id))).all())
+    assert left == {ids[name] for name in ("empty_new", "anon_fresh", "anon_checked_out", "user_stale")}
+    assert (await session.scalars(select(CartItem.cart_id))).all().count(ids["anon_stale"]) == 0
+    await session.rollback()
+
+    assert (await reaper.run_once())["batches"] == 2
+
+
+async def test_reaper_archive_mode_keeps_a_snapshot(session):
+    ids = await _seed_reapable(session)
+
+    report = await CartReaper(session, ttls={"empty": 0, "anonymous": 30 * DAY}, pause=0, archive=True).run_once()
+
+    assert report == {"archive": True, "batches": 1, "empty": 0, "anonymous": 1, "closed": 0}
+    archived = (await session.scalars(select(CartArchive))).one()
+    assert (archived.id, archived.cookie, archived.reason) == (ids["anon_stale"], "stale", "anonymous")
+    assert archived.items == [{"product_id": 1, "name": "Pen", "price": "1.00", "price_minor": 100, "quantity": 1}]
+    assert await session.get(Cart, ids["anon_stale"]) is None
+
+
+async def test_catalog_reprice_does_not_refresh_abandoned_carts(session):
+    ids = await _seed_reapable(session)
+    stale_at = (await session.get(Cart, ids["anon_stale"])).updated_at
+    await session.rollback()
+
+    report = await CartService(session).reprice_products([(1, "2.00", None)])
+    assert report["rows_updated"] == 3
+
+    cart = await session.get(Cart, ids["anon_stale"])
+    assert (cart.updated_at, cart.total_amount_minor) == (stale_at, 200)
+    await session.rollback()
+    report = await CartReaper(session, ttls={"empty": 0, "anonymous": 30 * DAY}, pause=0, archive=False).run_once()
+    assert report["anonymous"] == 1
+    assert await session.get(Cart, ids["anon_stale"]) is None
+
+
+async def test_closed_carts_move_to_archive_and_stay_readable(session):
+    old = datetime.now(UTC) - timedelta(days=60)
+    async with session.begin():
+        carts = [
+            Cart(company_id=1, user_id=7, created_at=old, status=CartStatus.CHECKED_OUT.value),
+            Cart(company_id=1, user_id=7, created_at=old, status=CartStatus.CANCELLED.value),
+            Cart(company_id=1, user_id=7),
+        ]
+        session.add_all(carts)
+        await session.flush()
+        for cart in carts:
+            session.add(CartItem(cart_id=cart.id, product_id=1, name="Pen", price=Decimal("2.50"), quantity=2))
+    checked_out, cancelled, active = (cart.id for cart in carts)
+    reads = CartReadRepository(session)
+    before = await reads.list_by_user(7, None, None, 10, 0)
+    await session.rollback()
+
+    # A zero TTL disables a kind, so use a tiny one for "closed"
+    report = await CartReaper(session, ttls={"closed": 0.001}, pause=0, archive=False).run_once()
+
+    assert report["closed"] == 2
+    assert {a.id: a.reason for a in (await session.scalars(select(CartArchive))).all()} == {
+        checked_out: "closed",
+        cancelled: "closed",
+    }
+    assert (await session.scalars(select(Cart.id))).all() == [active]
+    assert await reads.get_by_id(checked_out) == next(c for c in before if c["id"] == checked_out)
+    assert await reads.list_by_user(7, None, None, 10, 0) == before
+    assert [c["id"] for c in await reads.list_by_user(7, 1, CartStatus.CANCELLED.value, 10, 0)] == [cancelled]
+    assert [c["id"] for c in await reads.list_by_user(7, None, None, 1, 0, after_id=active)] == [cancelled]
+    assert [c["id"] for c in await reads.list_by_ids_ordered([checked_out, active])] == [checked_out, active]
+
+    # Streamed through a server-side cursor, one row per fetch
+    assert [c async for c in reads.stream_by_user(7, None, None, None, None, yield_per=1)] == before
+    assert [c["id"] async for c in reads.stream_by_user(7, None, None, active, 1, yield_per=1)] == [cancelled]
+    assert [c["id"] async for c in reads.stream_by_ids([checked_out, active], yield_per=1)] == [checked_out, active]
@@ -0,0 +1,75 @@
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.cache import cart_cache, cart_key, encode_keys
+from app.cache_listener import CacheInvalidationListener
+from app.metrics import db_reads
+from app.replicas import ReplicaRouter, replica_router
+from app.settings import settings
+
+
+def test_pick_skips_lagging_replicas_and_sticky_keys():
+    router = ReplicaRouter(sticky_seconds=60, max_lag=1)
+    fresh, lagging = (create_async_engine(f"postgresql+asyncpg://{host}/cart") for host in ("r1", "r2"))
+    router.set_engines([fresh, lagging])
+    # Unknown lag counts as too much
+    assert router.pick() is None
+
+    router.lags = [0.2, 5.0]
+    assert [router.pick(), router.pick()] == [fresh, fresh]
+
+    router.mark_written({cart_key(1)})
+    assert router.pick({cart_key(1), cart_key(2)}) is None
+    assert router.pick({cart_key(2)}) is fresh
+
+    router.mark_all_written()
+    assert router.pick({cart_key(2)}) is None
+
+
+def test_notified_writes_are_sticky(monkeypatch):
+    monkeypatch.setattr(replica_router, "engines", [object()])
+    monkeypatch.setattr(replica_router, "_written", {})
+    listener = CacheInvalidationListener("", settings.cart_cache_channel, cart_cache)
+    listener._on_notify(None, 0, settings.cart_cache_channel, encode_keys([cart_key(7)]))
+    assert replica_router.is_sticky({cart_key(7)})
+    assert not replica_router.is_sticky({cart_key(8)})
+
+
+@pytest.fixture
+async def replica_client(engine, database_url, monkeypatch):
+    """The REST app with the test database doubling as its only, never lagging, replica."""
+    from httpx import ASGITransport, AsyncClient
+
+    from app import db
+    from app.main import app
+
+    monkeypatch.setattr(settings, "database_replica_urls", database_url)
+    db.init_engines()
+    await replica_router.check_lag()
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+    await db.dispose_engines()
+
+
+async def test_reads_follow_own_writes_to_primary(replica_client):
+    def reads(target):
+        return sum(v for k, v in db_reads._values.items() if k[0] == target)
+
+    assert replica_router.lags == [0.0]
+    item = {"company_id": 1, "user_id": 42, "product_id": 10, "name": "Pen", "price": "1.50", "quantity": 1}
+    r = await replica_client.post("/api/v1/cart/add-item", json=item)
+    cart_id = r.json()["id"]
+
+    primary, replica = reads("primary"), reads("replica")
+    assert (await replica_client.get(f"/api/v1/cart/{cart_id}")).status_code == 200
+    assert (reads("primary"), reads("replica")) == (primary + 1, replica)
+
+    # Carts nobody wrote to lately are read from the replica
+    assert (await replica_client.get("/api/v1/cart/999")).status_code == 404
+    assert (reads("primary"), reads("replica")) == (primary + 1, replica + 1)
+
+
+async def test_replica_pools_have_their_own_gauges(replica_client):
+    body = (await replica_client.get("/metrics")).text
+    assert 'db_pool_connections{engine="primary",state="size"}' in body
+    assert 'db_pool_connections{engine="localhost",state="size"}' in body
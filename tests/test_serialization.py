@@ -0,0 +1,91 @@
+from datetime import UTC, datetime
+
+from pydantic import TypeAdapter
+
+from app.schemas import CartOut
+from app.serialization import cart_list, cart_pb2, cart_response, json_response
+
+CARTS = [
+    {
+        "id": 1,
+        "company_id": 2,
+        "user_id": None,
+        "cookie": "c-ü",
+        "status": 1,
+        "created_at": datetime(2024, 5, 1, 12, 30, 0, 123456, tzinfo=UTC),
+        "items": [
+            {"product_id": 10, "name": "Füller", "price": "12.50", "price_minor": 1250, "quantity": 2},
+            {"product_id": 11, "name": "Pen", "price": "1.00", "price_minor": 100, "quantity": 1},
+        ],
+        "total_amount": "26.00",
+        "total_amount_minor": 2600,
+    },
+    {
+        "id": 2,
+        "company_id": 2,
+        "user_id": 7,
+        "cookie": None,
+        "status": 3,
+        "created_at": datetime(2024, 5, 2, tzinfo=UTC),
+        "items": [],
+        "total_amount": "0.00",
+        "total_amount_minor": 0,
+    },
+]
+
+
+def test_json_matches_response_model_output():
+    expected = TypeAdapter(list[CartOut]).dump_json(TypeAdapter(list[CartOut]).validate_python(CARTS))
+    assert json_response(CARTS).body == expected
+
+
+def test_protobuf_matches_field_by_field_construction():
+    expected = cart_pb2.CartList(
+        carts=[
+            cart_pb2.Cart(
+                id=c["id"],
+                company_id=c["company_id"],
+                user_id=c["user_id"] or 0,
+                cookie=c["cookie"] or "",
+                status=c["status"],
+                created_at=c["created_at"].isoformat(),
+                items=[cart_pb2.CartItem(**i) for i in c["items"]],
+                total_amount=c["total_amount"],
+                total_amount_minor=c["total_amount_minor"],
+            )
+            for c in CARTS
+        ],
+        next_cursor="abc",
+    )
+    assert cart_list(CARTS, "abc") == expected
+    assert cart_response(CARTS[0]).cart == expected.carts[0]
+
+
+async def test_routes_keep_headers_and_status(client):
+    item = {"company_id": 1, "user_id": 42, "product_id": 10, "name": "Pen", "price": "1.50", "price_minor": 150, "quantity": 1}
+    r = await client.post("/api/v1/cart/add-item", json=item)
+    assert r.status_code == 201
+    assert r.headers["content-type"] == "application/json"
+
+    # A fresh visitor cookie is set on the injected response
+    r = await client.get("/api/v1/cart/active", params={"company_id": 1, "user_id": 42})
+    assert r.status_code == 200
+    assert "sellio_cart=" in r.headers["set-cookie"]
+    assert r.headers["x-sql-statements"] == "1"
+
+
+async def test_prices_as_strings_or_minor_units(client):
+    item = {"company_id": 1, "user_id": 42, "product_id": 10, "name": "Pen", "price_minor": 150, "quantity": 2}
+    r = await client.post("/api/v1/cart/add-item", json=item)
+    assert r.status_code == 201
+    cart = r.json()
+    assert cart["items"][0]["price"] == "1.50" and cart["items"][0]["price_minor"] == 150
+    assert (cart["total_amount"], cart["total_amount_minor"]) == ("3.00", 300)
+
+    r = await client.post(f"/api/v1/cart/{cart['id']}/item", json={"product_id": 11, "name": "Ink", "price": "0.99", "quantity": 1})
+    assert (r.json()["total_amount"], r.json()["total_amount_minor"]) == ("3.99", 399)
+
+    r = await client.post(f"/api/v1/cart/{cart['id']}/item", json={"product_id": 11, "name": "Ink", "price": "abc", "quantity": 1})
+    assert r.status_code == 400
+    r = await client.post(f"/api/v1/cart/{cart['id']}/item", json={"product_id": 11, "name": "Ink", "quantity": 1})
+    assert r.status_code == 400
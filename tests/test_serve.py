@@ -0,0 +1,53 @@
+import os
+
+from app import serve
+from app.settings import settings
+
+
+def test_size_pool_splits_connection_budget(monkeypatch):
+    monkeypatch.setattr(settings, "db_max_connections", 20)
+    monkeypatch.setattr(settings, "db_pool_size", 10)
+    monkeypatch.setattr(settings, "db_max_overflow", 20)
+    monkeypatch.setattr(settings, "cart_cache_size", 0)
+    monkeypatch.setattr(settings, "database_replica_urls", "")
+    monkeypatch.setattr(os, "environ", dict(os.environ))
+
+    serve.size_pool(6)
+
+    assert (settings.db_pool_size, settings.db_max_overflow) == (3, 0)
+    assert (os.environ["DB_POOL_SIZE"], os.environ["DB_MAX_OVERFLOW"]) == ("3", "0")
+
+
+def test_size_pool_counts_replica_pools_and_listener(monkeypatch):
+    monkeypatch.setattr(settings, "db_max_connections", 48)
+    monkeypatch.setattr(settings, "cart_cache_size", 10000)
+    monkeypatch.setattr(settings, "database_replica_urls", "postgresql+asyncpg://r1/cart,postgresql+asyncpg://r2/cart")
+    monkeypatch.setattr(os, "environ", dict(os.environ))
+
+    serve.size_pool(6)
+
+    # 8 per process: the LISTEN connection, then 3 pools (primary, 2 replicas) of 2
+    assert settings.db_pool_size == 2
+    assert 6 * (3 * settings.db_pool_size + 1) <= 48
+
+
+def test_size_pool_keeps_explicit_pool_without_budget(monkeypatch):
+    monkeypatch.setattr(settings, "db_max_connections", 0)
+    monkeypatch.setattr(settings, "db_pool_size", 10)
+
+    serve.size_pool(6)
+
+    assert settings.db_pool_size == 10
+
+
+def test_share_metrics_creates_a_directory_once(monkeypatch):
+    monkeypatch.setattr(settings, "metrics_dir", "")
+    monkeypatch.setattr(os, "environ", dict(os.environ))
+
+    created = serve.share_metrics()
+    try:
+        assert os.path.isdir(created)
+        assert os.environ["METRICS_DIR"] == settings.metrics_dir == created
+        assert serve.share_metrics() is None
+    finally:
+        os.rmdir(created)
@@ -0,0 +1,181 @@
+"""Round trips per write request, as reported by the X-SQL-Statements header."""
+import pytest
+from sqlalchemy import literal, select
+
+from app.instrumentation import track_statements
+
+
+def _statements(response) -> int:
+    return int(response.headers["X-SQL-Statements"])
+
+
+async def test_write_statement_budget(client):
+    # DML with RETURNING, NOTIFY for cache invalidation, one read of the cart view
+    r = await client.post("/api/v1/cart/upsert", json={"company_id": 1, "user_id": 42})
+    assert r.status_code == 201 and r.json()["items"] == []
+    assert _statements(r) == 1
+    assert int(r.headers["X-SQL-Round-Trips"]) == 3
+
+    item = {"company_id": 1, "user_id": 42, "product_id": 10, "name": "Laptop", "price": "999.99", "quantity": 1}
+    r = await client.post("/api/v1/cart/add-item", json=item)
+    cart_id = r.json()["id"]
+    assert r.json()["total_amount"] == "999.99"
+    assert _statements(r) == 4
+
+    r = await client.post(f"/api/v1/cart/{cart_id}/item", json={"product_id": 11, "name": "Mouse", "price": "29.99", "quantity": 1})
+    assert len(r.json()["items"]) == 2
+    assert _statements(r) == 3
+
+    r = await client.put(f"/api/v1/cart/{cart_id}/item/11/quantity", json={"quantity": 3})
+    assert r.json()["total_amount"] == "1089.96"
+    assert _statements(r) == 3
+
+    r = await client.post(f"/api/v1/cart/{cart_id}/item/11/increment", json={"delta": 1})
+    assert r.json()["total_amount"] == "1119.95"
+    assert _statements(r) == 3
+
+    r = await client.put(f"/api/v1/cart/{cart_id}/status", json={"status": 2})
+    assert r.json()["status"] == 2
+    assert _statements(r) == 3
+
+    # Removals also run the emptiness check, in its own statement so it sees
+    # concurrent removals of the cart's other items
+    r = await client.delete(f"/api/v1/cart/{cart_id}/item/11")
+    assert [i["product_id"] for i in r.json()["items"]] == [10]
+    assert _statements(r) == 4
+
+    # Last item: the cart goes with it, nothing left to read
+    r = await client.delete(f"/api/v1/cart/{cart_id}/item/10")
+    assert "message" in r.json()
+    assert _statements(r) == 3
+    r = await client.get(f"/api/v1/cart/{cart_id}")
+    assert r.status_code == 404
+
+
+async def test_missing_targets_stop_after_one_statement(client):
+    r = await client.post("/api/v1/cart/999/item", json={"product_id": 1, "name": "Pen", "price": "1.00", "quantity": 1})
+    assert r.status_code == 404
+    assert _statements(r) == 1
+
+    r = await client.put("/api/v1/cart/999/status", json={"status": 2})
+    assert r.status_code == 400
+    assert _statements(r) == 1
+
+    r = await client.delete("/api/v1/cart/999/item/1")
+    assert _statements(r) == 1
+
+
+async def test_track_statements_is_scoped(session):
+    with track_statements() as outer:
+        await session.execute(select(literal(1)))
+        with track_statements() as inner:
+            await session.execute(select(literal(1)))
+    await session.execute(select(literal(1)))
+    assert outer.transactions == ["BEGIN"]
+    assert len(outer.statements) == 1
+    assert len(inner.statements) == 1
+    assert inner.transactions == []
+    await session.rollback()
+
+
+
+async def test_timing_headers_and_slow_log(client, monkeypatch, caplog):
+    from app.settings import settings
+
+    item = {"company_id": 1, "user_id": 42, "product_id": 10, "name": "Laptop", "price": "999.99", "quantity": 1}
+    r = await client.post("/api/v1/cart/add-item", json=item)
+    assert r.headers["X-SQL-Rows"] == "4"  # one row from each statement
+    assert r.headers["Server-Timing"].startswith("db;dur=")
+
+    monkeypatch.setattr(settings, "slow_request_ms", 0.001)
+    with caplog.at_level("INFO", logger="app.requests"):
+        await client.get(f"/api/v1/cart/{r.json()['id']}")
+    [record] = caplog.records
+    assert record.request["name"] == "GET /api/v1/cart/{cart_id}"
+    assert record.request["statements"] == 1
+    assert record.request["sql"][0]["statement"].startswith("SELECT cart.id")
+
+
+async def test_grpc_trailing_metadata(engine):
+    import grpc
+
+    from app import db
+    from app.grpc.interceptors import InstrumentationInterceptor
+    from app.grpc.server import CartServiceImpl, cart_pb2, cart_pb2_grpc
+
+    db.init_engines()
+    server = grpc.aio.server(interceptors=[InstrumentationInterceptor()])
+    cart_pb2_grpc.add_CartServiceServicer_to_server(CartServiceImpl(), server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    try:
+        async with grpc.aio.insecure_channel(f"127.0.0.1:{port}") as channel:
+            stub = cart_pb2_grpc.CartServiceStub(channel)
+            call = stub.UpsertCart(cart_pb2.UpsertCartRequest(company_id=1, user_id=42))
+            await call
+            assert dict(await call.trailing_metadata())["x-sql-statements"] == "1"
+
+            # Aborted RPCs report too
+            call = stub.RemoveItem(cart_pb2.RemoveItemRequest(cart_id=999, product_id=1))
+            with pytest.raises(grpc.aio.AioRpcError) as exc:
+                await call
+            assert exc.value.code() == grpc.StatusCode.NOT_FOUND
+            assert dict(exc.value.trailing_metadata())["x-sql-statements"] == "1"
+    finally:
+        await server.stop(None)
+        await db.dispose_engines()
+
+
+async def test_grpc_streaming_lists(engine, monkeypatch):
+    import grpc
+
+    from app import db
+    from app.grpc.interceptors import InstrumentationInterceptor
+    from app.grpc.server import CartServiceImpl, cart_pb2, cart_pb2_grpc
+    from app.settings import settings
+
+    monkeypatch.setattr(settings, "by_ids_max", 2)
+    monkeypatch.setattr(settings, "stream_by_ids_max", 3)
+    monkeypatch.setattr(settings, "stream_yield_per", 2)
+    db.init_engines()
+    server = grpc.aio.server(interceptors=[InstrumentationInterceptor()])
+    cart_pb2_grpc.add_CartServiceServicer_to_server(CartServiceImpl(), server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    try:
+        async with grpc.aio.insecure_channel(f"127.0.0.1:{port}") as channel:
+            stub = cart_pb2_grpc.CartServiceStub(channel)
+            ids = []
+            for company_id in range(1, 4):
+                cart = (await stub.UpsertCart(cart_pb2.UpsertCartRequest(company_id=company_id, user_id=42))).cart
+                item = cart_pb2.UpsertItemRequest(cart_id=cart.id, product_id=1, name="Pen", price_minor=150, quantity=1)
+                await stub.UpsertItem(item)
+                ids.append(cart.id)
+
+            request = cart_pb2.ListByIdsRequest(ids=ids[::-1])
+            with pytest.raises(grpc.aio.AioRpcError) as exc:
+                await stub.ListByIds(request)
+            assert exc.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+            # Capped by STREAM_BY_IDS_MAX instead of BY_IDS_MAX; one statement, fetched 2 rows at a time
+            call = stub.StreamByIds(request)
+            carts = [cart async for cart in call]
+            assert [c.id for c in carts] == ids[::-1]
+            assert carts[0].items[0].price == "1.50" and carts[0].total_amount_minor == 150
+            assert dict(await call.trailing_metadata())["x-sql-statements"] == "1"
+            with pytest.raises(grpc.aio.AioRpcError) as exc:
+                [cart async for cart in stub.StreamByIds(cart_pb2.ListByIdsRequest(ids=ids + ids[:1]))]
+            assert exc.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+            call = stub.StreamByUser(cart_pb2.ListByUserRequest(user_id=42))
+            assert [cart.id async for cart in call] == sorted(ids, reverse=True)
+            assert dict(await call.trailing_metadata())["x-sql-statements"] == "1"
+            call = stub.StreamByUser(cart_pb2.ListByUserRequest(user_id=42, limit=1))
+            assert [cart.id async for cart in call] == [max(ids)]
+
+            with pytest.raises(grpc.aio.AioRpcError) as exc:
+                [cart async for cart in stub.StreamByUser(cart_pb2.ListByUserRequest(user_id=42, cursor="bad"))]
+            assert exc.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+    finally:
+        await server.stop(None)
+        await db.dispose_engines()
@@ -0,0 +1,94 @@
+"""Server-streaming RPCs end cleanly at STREAM_MAX_SECONDS."""
+import asyncio
+
+import grpc
+import pytest
+
+from app import db
+from app.grpc.interceptors import InstrumentationInterceptor, LoadSheddingInterceptor
+from app.grpc.server import CartServiceImpl, cart_pb2, cart_pb2_grpc
+from app.services.cart_service import CartService
+from app.settings import settings
+
+
+@pytest.fixture
+async def stub(database_url):
+    db.init_engines()
+    server = grpc.aio.server(interceptors=[InstrumentationInterceptor(), LoadSheddingInterceptor()])
+    cart_pb2_grpc.add_CartServiceServicer_to_server(CartServiceImpl(), server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    try:
+        async with grpc.aio.insecure_channel(f"127.0.0.1:{port}") as channel:
+            yield cart_pb2_grpc.CartServiceStub(channel)
+    finally:
+        await server.stop(None)
+        await db.dispose_engines()
+
+
+async def _carts(stub, user_id: int, count: int) -> list[int]:
+    ids = []
+    for company_id in range(1, count + 1):
+        cart = (await stub.UpsertCart(cart_pb2.UpsertCartRequest(company_id=company_id, user_id=user_id))).cart
+        item = cart_pb2.UpsertItemRequest(cart_id=cart.id, product_id=1, name="Pen", price_minor=150, quantity=1)
+        await stub.UpsertItem(item)
+        ids.append(cart.id)
+    return ids
+
+
+def _slowed(monkeypatch, name: str, delay: float) -> None:
+    """Make CartService.`name` wait `delay` seconds after each cart, like a long scan would."""
+    stream = getattr(CartService, name)
+
+    def slowed(self, *args):
+        carts = stream(self, *args)
+
+        async def paced():
+            async for cart in carts:
+                yield cart
+                await asyncio.sleep(delay)
+
+        return paced()
+
+    monkeypatch.setattr(CartService, name, slowed)
+
+
+async def test_stream_by_ids_ends_with_deadline_exceeded(stub, monkeypatch):
+    ids = await _carts(stub, 301, 3)
+    monkeypatch.setattr(settings, "stream_max_seconds", 0.5)
+    _slowed(monkeypatch, "stream_by_ids", 0.3)
+
+    call = stub.StreamByIds(cart_pb2.ListByIdsRequest(ids=ids))
+    received = []
+    with pytest.raises(grpc.aio.AioRpcError) as exc:
+        async for cart in call:
+            received.append(cart.id)
+    assert exc.value.code() == grpc.StatusCode.DEADLINE_EXCEEDED
+    assert "STREAM_MAX_SECONDS" in exc.value.details()
+    # The carts written before the limit arrive; the interceptors still report the RPC
+    assert received == ids[:2]
+    assert "x-sql-statements" in dict(await call.trailing_metadata())
+    assert db.engine.pool.checkedout() == 0
+
+
+async def test_stream_by_user_past_the_limit_ends_cleanly_and_resumes(stub, monkeypatch):
+    ids = sorted(await _carts(stub, 302, 3), reverse=True)
+    monkeypatch.setattr(settings, "stream_max_seconds", 0.5)
+    _slowed(monkeypatch, "stream_by_user", 0.3)
+
+    call = stub.StreamByUser(cart_pb2.ListByUserRequest(user_id=302))
+    received = []
+    with pytest.raises(grpc.aio.AioRpcError) as exc:
+        async for cart in call:
+            received.append(cart.id)
+    # A status of its own, after the carts sent so far, not a cancelled or aborted call
+    assert exc.value.code() == grpc.StatusCode.DEADLINE_EXCEEDED
+    assert received == ids[:2]
+    metadata = dict(await call.trailing_metadata())
+    assert "x-sql-statements" in metadata
+    assert db.engine.pool.checkedout() == 0
+
+    monkeypatch.setattr(settings, "stream_max_seconds", 0)
+    call = stub.StreamByUser(cart_pb2.ListByUserRequest(user_id=302, cursor=metadata["x-next-cursor"]))
+    assert [cart.id async for cart in call] == ids[2:]
+    assert await call.code() == grpc.StatusCode.OK